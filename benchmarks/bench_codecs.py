@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the available JSON codecs on some representative payloads
+
+    python benchmarks/bench_codecs.py [--iterations N]
+
+"""
+import argparse
+import json
+import time
+
+from tclient import codec
+
+
+def build_payloads():
+    record = {
+        'id': 12345,
+        'name': u'Raphael ☃',
+        'tags': ['turtle', 'ninja', 'mutant', 'teenage'],
+        'score': 98.6,
+        'active': True,
+        'parent': None,
+        'location': {'lat': 40.7128, 'lng': -74.0060},
+    }
+
+    return {
+        'small_object': record,
+        'large_array': [dict(record, id=ndx) for ndx in range(10000)],
+        'numbers': [ndx * 1.5 for ndx in range(100000)],
+        'long_strings': {'text_%d' % ndx: 'lorem ipsum ' * 100 for ndx in range(500)},
+    }
+
+
+def time_call(func, value, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        func(value)
+    return (time.time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    results = []
+    for payload_name, payload in sorted(build_payloads().items()):
+        encoded = json.dumps(payload)
+        for json_codec in codec.CODECS:
+            results.append({
+                'payload': payload_name,
+                'codec': json_codec.name,
+                'bytes': len(encoded),
+                'dumps_ms': time_call(json_codec.dumps, payload, args.iterations) * 1000,
+                'loads_ms': time_call(json_codec.loads, encoded, args.iterations) * 1000,
+            })
+
+    for result in results:
+        print json.dumps(result, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
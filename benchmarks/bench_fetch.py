@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure tclient's throughput against a local stand-in server
+
+    python benchmarks/bench_fetch.py [--sizes 1,10,100] [--backends simple,curl] ...
+
+Starts `benchmarks/server.py` in a separate process, then runs each scenario
+(mode x batch size x body size x backend) in a fresh process of it's own, so
+peak RSS and CPU time are for that scenario alone. Results are printed one
+JSON object per line, tagged with the current commit, so runs can be compared
+across commits.
+
+Modes:
+    fetch - `tclient.fetch` for each request, one after the other
+    fetch_all - A single `tclient.fetch_all`
+    segment_requests - `tclient.segment_requests`, then `fetch_all` for each segment
+    fetch_segmented - `tclient.fetch_segmented`
+
+The body size is the size of the response for the fetch modes, and of the
+request body (an upload) for the segmented modes.
+"""
+import Queue
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import tornado
+import tornado.httpclient
+
+import tclient
+
+
+MODES = ['fetch', 'fetch_all', 'segment_requests', 'fetch_segmented']
+
+BACKENDS = {
+    'simple': 'tornado.simple_httpclient.SimpleAsyncHTTPClient',
+    'curl': 'tornado.curl_httpclient.CurlAsyncHTTPClient',
+}
+
+
+def parse_list(value, convert=str):
+    return [convert(item) for item in value.split(',') if item]
+
+
+def start_server(keep_alive=True):
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    args = [sys.executable, server_path]
+    if not keep_alive:
+        args.append('--no-keep-alive')
+
+    server = subprocess.Popen(args, stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    return server, port
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_requests(port, mode, batch_size, body_size, latency, error_rate):
+    upload = mode in ('segment_requests', 'fetch_segmented')
+    url = "http://127.0.0.1:%d/bench" % port
+
+    requests = []
+    for _ in xrange(batch_size):
+        req = tclient.Request(url, method="POST" if upload else "GET")
+        req.params['latency'] = latency
+        req.params['error_rate'] = error_rate
+        if upload:
+            req.params['size'] = 0
+            req.body = 'x' * body_size
+        else:
+            req.params['size'] = body_size
+        requests.append(req)
+
+    return requests
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_mode(mode, requests, args):
+    kwargs = {'max_concurrency': args.max_concurrency}
+    if mode == 'fetch':
+        return [tclient.fetch(req) for req in requests]
+    elif mode == 'fetch_all':
+        return tclient.fetch_all(requests, **kwargs)
+    elif mode == 'segment_requests':
+        responses = []
+        for segment in tclient.segment_requests(requests, max_bytes=args.segment_bytes):
+            responses.extend(tclient.fetch_all(segment, **kwargs))
+        return responses
+    elif mode == 'fetch_segmented':
+        return tclient.fetch_segmented(requests, max_bytes=args.segment_bytes,
+                                       parallel_segments=args.parallel_segments, **kwargs)
+    else:
+        raise ValueError("Unknown mode %r" % mode)
+
+
+def run_scenario(results, port, mode, batch_size, body_size, backend, args):
+    """Run in a process of it's own, putting the result on the results queue"""
+    tornado.httpclient.AsyncHTTPClient.configure(BACKENDS[backend])
+
+    requests = build_requests(port, mode, batch_size, body_size, args.latency, args.error_rate)
+
+    start_times = os.times()
+    start = time.time()
+    responses = run_mode(mode, requests, args)
+    elapsed = time.time() - start
+    end_times = os.times()
+
+    cpu_time = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+    latencies = [resp.request_time for resp in responses if resp.request_time is not None]
+
+    results.put({
+        'mode': mode,
+        'batch_size': batch_size,
+        'body_size': body_size,
+        'backend': backend,
+        'keep_alive': not args.no_keep_alive,
+        'latency_ms': args.latency,
+        'error_rate': args.error_rate,
+        'elapsed_s': elapsed,
+        'requests_per_s': len(responses) / elapsed if elapsed else None,
+        'p50_ms': (percentile(latencies, 0.5) or 0.0) * 1000,
+        'p99_ms': (percentile(latencies, 0.99) or 0.0) * 1000,
+        'errors': sum(1 for resp in responses if resp.error),
+        'cpu_ms_per_request': cpu_time * 1000 / len(responses),
+        # ru_maxrss is in kilobytes on linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def wait_for_result(worker, results):
+    """Wait for the scenario's result, or None if it's process dies without one"""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except Queue.Empty:
+            if not worker.is_alive():
+                break
+
+    # The result may have been sent just before the process exited
+    try:
+        return results.get(timeout=1.0)
+    except Queue.Empty:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--sizes', default='1,10,100,1000,10000',
+                        help="Batch sizes to run")
+    parser.add_argument('--body-sizes', default='100,10000,1000000')
+    parser.add_argument('--backends', default='simple,curl')
+    parser.add_argument('--latency', type=float, default=10.0,
+                        help="Server latency for each request, in milliseconds")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--no-keep-alive', action='store_true')
+    parser.add_argument('--max-concurrency', type=int, default=100)
+    parser.add_argument('--segment-bytes', type=int, default=10 * 1024 * 1024)
+    parser.add_argument('--parallel-segments', type=int, default=4)
+    parser.add_argument('--max-serial', type=int, default=1000,
+                        help="Largest batch to run one at a time in the 'fetch' mode")
+    args = parser.parse_args()
+
+    backends = parse_list(args.backends)
+    if 'curl' in backends:
+        try:
+            import pycurl  # noqa
+        except ImportError:
+            sys.stderr.write("pycurl isn't available, skipping the curl backend\n")
+            backends.remove('curl')
+
+    server, port = start_server(keep_alive=not args.no_keep_alive)
+    commit = current_commit()
+    try:
+        for mode in parse_list(args.modes):
+            for batch_size in parse_list(args.sizes, int):
+                if mode == 'fetch' and batch_size > args.max_serial:
+                    continue
+
+                for body_size in parse_list(args.body_sizes, int):
+                    for backend in backends:
+                        results = multiprocessing.Queue()
+                        worker = multiprocessing.Process(
+                            target=run_scenario,
+                            args=(results, port, mode, batch_size, body_size, backend, args))
+                        worker.start()
+                        result = wait_for_result(worker, results)
+                        worker.join()
+
+                        if result is None:
+                            # It's traceback will already be on stderr
+                            result = {
+                                'mode': mode,
+                                'batch_size': batch_size,
+                                'body_size': body_size,
+                                'backend': backend,
+                                'failed': "Exited with %s" % worker.exitcode,
+                            }
+
+                        result['commit'] = commit
+                        result['tornado'] = tornado.version
+                        print json.dumps(result, sort_keys=True)
+                        sys.stdout.flush()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
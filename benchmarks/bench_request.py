@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure the per-request overhead of building requests and rendering their urls
+and bodies, the way a batch (and the http client) reads them
+
+    python benchmarks/bench_request.py [--requests N] [--reads N] [--template]
+
+With --template, requests are expanded from a single template request rather
+than built one at a time.
+
+"""
+import argparse
+import json
+import time
+
+import tclient
+
+from bench_fetch import current_commit
+
+
+def build_requests(count):
+    requests = []
+    for ndx in xrange(count):
+        req = tclient.Request("http://localhost:8888/search", method="POST")
+        req.params['q'] = 'turtles in a half-shell'
+        req.params['page'] = ndx
+        req.body = {'id': ndx, 'name': 'Raphael'}
+        requests.append(req)
+    return requests
+
+
+def expand_requests(count):
+    template = tclient.Request("http://localhost:8888/search", method="POST")
+    template.params['q'] = 'turtles in a half-shell'
+    template.body = {'name': 'Raphael'}
+    return [template.derive(params={'page': ndx}, body={'id': ndx, 'name': 'Raphael'})
+            for ndx in xrange(count)]
+
+
+def read_requests(requests, reads):
+    for req in requests:
+        for _ in xrange(reads):
+            req.url
+            req.body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--reads', type=int, default=4,
+                        help="Times each request's url and body are read")
+    parser.add_argument('--template', action='store_true',
+                        help="Derive the requests from a template request")
+    args = parser.parse_args()
+
+    start = time.time()
+    build = expand_requests if args.template else build_requests
+    requests = build(args.requests)
+    build_time = time.time() - start
+
+    start = time.time()
+    read_requests(requests, args.reads)
+    read_time = time.time() - start
+
+    print json.dumps({
+        'commit': current_commit(),
+        'requests': args.requests,
+        'reads': args.reads,
+        'template': args.template,
+        'build_us_per_request': build_time * 1e6 / args.requests,
+        'read_us_per_request': read_time * 1e6 / args.requests,
+    }, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local stand-in server for benchmarking tclient
+
+    python benchmarks/server.py [--port N] [--no-keep-alive]
+
+Prints the port it's listening on as the first line of output. Each request
+can ask for the response it wants with query parameters:
+
+    latency - Milliseconds to wait before responding
+    size - Size of the response body in bytes
+    error_rate - Fraction (0 to 1) of requests that get a 500 response
+
+Request bodies are read and thrown away, so it works for uploads too.
+"""
+import argparse
+import random
+import sys
+
+import tornado.gen
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+
+
+class BenchHandler(tornado.web.RequestHandler):
+    # Bodies of each size, so we're not benchmarking building them
+    bodies = {}
+
+    @tornado.web.asynchronous
+    @tornado.gen.coroutine
+    def respond(self):
+        latency = float(self.get_argument('latency', 0)) / 1000.0
+        size = int(self.get_argument('size', 0))
+        error_rate = float(self.get_argument('error_rate', 0))
+
+        if latency > 0:
+            loop = tornado.ioloop.IOLoop.current()
+            yield tornado.gen.Task(loop.add_timeout, loop.time() + latency)
+
+        if error_rate and random.random() < error_rate:
+            self.set_status(500)
+
+        if size not in self.bodies:
+            self.bodies[size] = 'x' * size
+
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.finish(self.bodies[size])
+
+    get = respond
+    post = respond
+    put = respond
+
+
+def build_app():
+    # Skip the access log, it'd only slow us down
+    return tornado.web.Application([(r'/.*', BenchHandler)], log_function=lambda handler: None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--no-keep-alive', action='store_true')
+    args = parser.parse_args()
+
+    sockets = tornado.netutil.bind_sockets(args.port, address='127.0.0.1')
+    server = tornado.httpserver.HTTPServer(build_app(), no_keep_alive=args.no_keep_alive)
+    server.add_sockets(sockets)
+
+    print sockets[0].getsockname()[1]
+    sys.stdout.flush()
+
+    tornado.ioloop.IOLoop.instance().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,9 +20,18 @@ __license__ = 'ISC'
 __copyright__ = 'Copyright 2013 Rhett Garber'
 
 
+from . import recording
+from .background import BackgroundClient
+from .cache import Cache
 from .core import fetch_all
+from .core import fetch_all_async
 from .core import fetch
+from .core import fetch_iter
+from .core import fetch_segmented
 from .request import Request
+from .retry import RetryPolicy
+from .session import Session
+from .sharding import fetch_sharded
 from .utils import segment_requests
 
 # flake8: noqa
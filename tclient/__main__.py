@@ -0,0 +1,6 @@
+import sys
+
+from tclient import cli
+
+
+sys.exit(cli.main())
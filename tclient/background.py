@@ -0,0 +1,197 @@
+"""
+tclient.background
+~~~~~~~~
+
+This module provides the BackgroundClient class, which runs an io loop in a
+thread of it's own so that any number of other threads can share it (and it's
+connections).
+
+    client = tclient.BackgroundClient(max_concurrency=100)
+
+    # From any thread
+    future = client.submit_all(requests, timeout=30)
+    responses = future.result()
+
+Requires `concurrent.futures`, which on Python 2 is the `futures` package.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import collections
+import functools
+import logging
+import threading
+import time
+
+import tornado.concurrent
+import tornado.ioloop
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None
+
+from . import core
+
+
+log = logging.getLogger(__name__)
+
+
+class LimitedClient(object):
+    """Wraps an http client, limiting how many requests it has in flight at once
+
+    Requests beyond the limit wait in a queue until an earlier request completes.
+    Requests that run out of time while waiting are never sent, and get a
+    timeout response instead.
+    """
+    def __init__(self, client, max_concurrency):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.expired = 0
+        self._queue = collections.deque()
+
+    def fetch(self, request, callback, **kwargs):
+        if self.in_flight >= self.max_concurrency:
+            self._queue.append((time.time(), request, callback, kwargs))
+            return
+
+        self._send(request, callback, kwargs)
+
+    def _send(self, request, callback, kwargs):
+        self.in_flight += 1
+        self.client.fetch(request, callback=functools.partial(self._handle_response, callback),
+                          **kwargs)
+
+    def _handle_response(self, callback, response):
+        self.in_flight -= 1
+        try:
+            callback(response)
+        finally:
+            self._send_queued()
+
+    def _send_queued(self):
+        while self._queue and self.in_flight < self.max_concurrency:
+            queued_at, request, callback, kwargs = self._queue.popleft()
+            send_request = core.dequeue_request(request, queued_at)
+            if send_request is not None:
+                self._send(send_request, callback, kwargs)
+                continue
+
+            # It's batch has most likely given up on it already
+            self.expired += 1
+            callback(core.build_timeout_response(request, time.time() - queued_at))
+
+    def close(self):
+        self.client.close()
+
+
+class BackgroundClient(object):
+    """Io loop and http client running in a background thread
+
+    `submit` and `submit_all` can be called from any thread. The requests are
+    handed over to the loop's thread, and a `concurrent.futures.Future` is
+    returned for the responses.
+
+    Since every thread shares the one client, they share it's connections too,
+    and `max_concurrency` limits how many requests the whole process has in
+    flight.
+
+    Args:
+        max_concurrency - Maximum number of requests in flight across all batches
+        cache - `tclient.Cache` to use for every batch
+        codec - JSON codec for every batch, unless a batch picks it's own
+    """
+    def __init__(self, max_concurrency=None, cache=None, codec=None):
+        if futures is None:
+            raise ImportError("BackgroundClient requires concurrent.futures")
+
+        self.codec = codec
+        self.loop = tornado.ioloop.IOLoop()
+        self.client = core.build_client(self.loop, cache=cache)
+        if max_concurrency is not None:
+            self.client = LimitedClient(self.client, max_concurrency)
+
+        self.closed = False
+        self._active = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='tclient-background')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        self.loop.make_current()
+        self.loop.start()
+
+    def submit_all(self, requests, **kwargs):
+        """Fetch all provided requests, returning a `concurrent.futures.Future` for the
+        list of responses
+
+        Takes the same arguments as `tclient.fetch_all`.
+        """
+        future = futures.Future()
+        kwargs.setdefault('codec', self.codec)
+
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("BackgroundClient is closed")
+            self.loop.add_callback(self._start, list(requests), future, kwargs)
+
+        return future
+
+    def submit(self, request, **kwargs):
+        """Fetch a single request, returning a `concurrent.futures.Future` for the response"""
+        future = futures.Future()
+
+        def handle_responses(batch_future):
+            if batch_future.cancelled():
+                future.cancel()
+            elif batch_future.exception() is not None:
+                future.set_exception(batch_future.exception())
+            else:
+                future.set_result(batch_future.result()[0])
+
+        self.submit_all([request], **kwargs).add_done_callback(handle_responses)
+        return future
+
+    def _start(self, requests, future, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            batch_future = core.start_all(self.loop, self.client, requests, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            return
+
+        self._active += 1
+        batch_future.add_done_callback(self._batch_done)
+        tornado.concurrent.chain_future(batch_future, future)
+
+    def _batch_done(self, batch_future):
+        self._active -= 1
+        if self.closed:
+            self._stop_when_idle()
+
+    def _stop_when_idle(self):
+        if not self._active:
+            self.loop.stop()
+
+    def close(self):
+        """Stop the loop and close the client, once every batch that's been submitted
+        is complete"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.loop.add_callback(self._stop_when_idle)
+
+        self._thread.join()
+        core.close_loop(self.loop, self.client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
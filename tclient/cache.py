@@ -0,0 +1,357 @@
+"""
+tclient.cache
+~~~~~~~~
+
+This module provides an HTTP response cache that sits in front of the http
+client, honoring Cache-Control and Expires, and revalidating stale responses
+with If-None-Match / If-Modified-Since.
+
+    cache = tclient.Cache(max_bytes=64 * 1024 * 1024, path='/var/cache/tclient')
+    responses = tclient.fetch_all(requests, cache=cache)
+
+    print cache.hits, cache.misses, cache.revalidations
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import collections
+import copy
+import hashlib
+import io
+import logging
+import os
+import cPickle as pickle
+import time
+
+import tornado.httpclient
+from tornado import httputil
+from tornado.escape import utf8
+
+from .utils import parse_http_date
+
+
+log = logging.getLogger(__name__)
+
+# Headers describing the body itself, which a 304 response doesn't get to change.
+ENTITY_HEADERS = frozenset(['content-length', 'content-encoding', 'transfer-encoding'])
+
+# Request headers saying who is asking, so one caller's responses are never served to another.
+CREDENTIAL_HEADERS = ('Authorization', 'Proxy-Authorization', 'Cookie')
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into a dictionary of directives"""
+    directives = {}
+    if not value:
+        return directives
+
+    for directive in value.split(','):
+        name, _, arg = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+
+    return directives
+
+
+def freshness_lifetime(headers, now):
+    """How long, in seconds, a response is fresh for, or None if it can't be stored at all"""
+    cache_control = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cache_control:
+        return None
+
+    if 'no-cache' in cache_control:
+        return 0
+
+    lifetime = 0
+    if cache_control.get('max-age', '').isdigit():
+        lifetime = int(cache_control['max-age'])
+    else:
+        expires = parse_http_date(headers.get('Expires'))
+        if expires is not None:
+            date = parse_http_date(headers.get('Date')) or now
+            lifetime = max(0, expires - date)
+
+    age = headers.get('Age', '')
+    if age.isdigit():
+        lifetime = max(0, lifetime - int(age))
+
+    return lifetime
+
+
+class CacheEntry(object):
+    __slots__ = ('code', 'headers', 'body', 'expires', 'vary')
+
+    def __init__(self, code, headers, body, expires, vary):
+        self.code = code
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.vary = vary
+
+    # HTTPHeaders doesn't survive pickling, so store them as a list.
+    def __getstate__(self):
+        return (self.code, list(self.headers.get_all()), self.body, self.expires, self.vary)
+
+    def __setstate__(self, state):
+        self.code, header_list, self.body, self.expires, self.vary = state
+        self.headers = httputil.HTTPHeaders()
+        for name, value in header_list:
+            self.headers.add(name, value)
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def is_fresh(self, now=None):
+        return self.expires > (now or time.time())
+
+    def matches(self, request):
+        for name, value in self.vary:
+            if request.headers.get(name) != value:
+                return False
+        return True
+
+
+class MemoryStore(object):
+    """LRU store for cache entries, bounded by the total size of their bodies"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._entries[key] = entry
+        return entry
+
+    def set(self, key, entry):
+        self.delete(key)
+        if entry.size > self.max_bytes:
+            return
+
+        self._entries[key] = entry
+        self.size += entry.size
+
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+class DiskStore(object):
+    """Store for cache entries as files in a directory"""
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, hashlib.sha1(utf8(key)).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._entry_path(key), 'rb') as entry_file:
+                return pickle.load(entry_file)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, entry):
+        # Write to a temporary file first so readers never see a partial entry
+        entry_path = self._entry_path(key)
+        tmp_path = '%s.%d.tmp' % (entry_path, os.getpid())
+        with open(tmp_path, 'wb') as entry_file:
+            pickle.dump(entry, entry_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, entry_path)
+
+    def delete(self, key):
+        try:
+            os.unlink(self._entry_path(key))
+        except OSError:
+            pass
+
+
+class Cache(object):
+    """HTTP response cache
+
+    Only successful GET responses are stored. Responses are fresh for as long
+    as their Cache-Control or Expires headers allow. Once stale, responses with
+    an ETag or Last-Modified are revalidated with the server rather than
+    fetched again. Requests can skip fresh responses with their own
+    `Cache-Control: no-cache` or `max-age=0`.
+
+    Responses to requests carrying credentials (Authorization, Cookie or
+    auth_username) are only served to requests with the same credentials.
+
+    Args:
+        max_bytes - Maximum total size of the bodies kept in memory
+        path - Directory for an on-disk tier, for bodies larger than `disk_threshold`
+        disk_threshold - Size at which bodies are stored on disk rather than in memory
+    """
+    def __init__(self, max_bytes=16 * 1024 * 1024, path=None, disk_threshold=256 * 1024):
+        self.memory = MemoryStore(max_bytes)
+        self.disk = DiskStore(path) if path is not None else None
+        self.disk_threshold = disk_threshold
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def cache_key(self, request):
+        if request.method.upper() != 'GET':
+            return None
+
+        # Streamed bodies never make it into the response for us to store.
+        if getattr(request, 'body_sink', None) is not None \
+                or request.streaming_callback is not None:
+            return None
+
+        # Requests that are already conditional are the callers business.
+        if 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+            return None
+
+        if 'no-store' in parse_cache_control(request.headers.get('Cache-Control')):
+            return None
+
+        # Responses to requests with credentials are kept apart for each set of credentials.
+        credentials = [request.headers.get(name) for name in CREDENTIAL_HEADERS]
+        credentials += [request.auth_username, request.auth_password]
+        if not any(credentials):
+            return request.url
+
+        digest = hashlib.sha1(repr([utf8(value) if value else None for value in credentials]))
+        return '%s#%s' % (request.url, digest.hexdigest())
+
+    def wants_refresh(self, request):
+        """Has the request asked for a fresh response, rather than one from the cache?"""
+        cache_control = parse_cache_control(request.headers.get('Cache-Control'))
+        return 'no-cache' in cache_control or cache_control.get('max-age') == '0' \
+            or request.headers.get('Pragma') == 'no-cache'
+
+    def get(self, key, request):
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+
+        if entry is not None and entry.matches(request):
+            return entry
+
+        return None
+
+    def set(self, key, entry):
+        if self.disk is not None and entry.size > self.disk_threshold:
+            self.memory.delete(key)
+            self.disk.set(key, entry)
+        else:
+            self.memory.set(key, entry)
+
+    def store(self, key, request, response, now=None):
+        """Store the response, if it's cacheable, returning the new entry"""
+        if response.code != 200 or response.buffer is None:
+            return None
+
+        now = now or time.time()
+        lifetime = freshness_lifetime(response.headers, now)
+        if lifetime is None:
+            return None
+
+        if lifetime == 0 and 'ETag' not in response.headers \
+                and 'Last-Modified' not in response.headers:
+            return None
+
+        vary_names = [name.strip() for name in response.headers.get('Vary', '').split(',')
+                      if name.strip()]
+        if '*' in vary_names:
+            return None
+
+        # Bodies are stored as they arrived, so an encoded one is only any good to
+        # requests that asked for it the same way.
+        if 'Content-Encoding' in response.headers \
+                and 'accept-encoding' not in [name.lower() for name in vary_names]:
+            vary_names.append('Accept-Encoding')
+
+        vary = tuple((name, request.headers.get(name)) for name in vary_names)
+        entry = CacheEntry(response.code, httputil.HTTPHeaders(response.headers),
+                           response.body, now + lifetime, vary)
+        self.set(key, entry)
+        return entry
+
+    def revalidated(self, key, entry, response, now=None):
+        """Refresh an entry with the headers from a 304 response"""
+        now = now or time.time()
+        for name, value in response.headers.items():
+            if name.lower() not in ENTITY_HEADERS:
+                entry.headers[name] = value
+
+        lifetime = freshness_lifetime(entry.headers, now)
+        if lifetime is None:
+            self.memory.delete(key)
+            if self.disk is not None:
+                self.disk.delete(key)
+        else:
+            entry.expires = now + lifetime
+            self.set(key, entry)
+
+    def build_response(self, request, entry, start_time):
+        response = tornado.httpclient.HTTPResponse(
+            request, entry.code, headers=httputil.HTTPHeaders(entry.headers),
+            buffer=io.BytesIO(entry.body), request_time=time.time() - start_time)
+        response.from_cache = True
+        return response
+
+    def wrap(self, client):
+        return CachingClient(client, self)
+
+
+class CachingClient(object):
+    """Wraps an http client, answering requests from the cache where we can"""
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def fetch(self, request, callback, **kwargs):
+        start_time = time.time()
+        key = self.cache.cache_key(request)
+        entry = None
+        if key is not None:
+            entry = self.cache.get(key, request)
+
+        if entry is not None and entry.is_fresh() and not self.cache.wants_refresh(request):
+            self.cache.hits += 1
+            callback(self.cache.build_response(request, entry, start_time))
+            return
+
+        send_request = request
+        if entry is not None:
+            etag = entry.headers.get('ETag')
+            last_modified = entry.headers.get('Last-Modified')
+            if etag or last_modified:
+                send_request = copy.copy(request)
+                send_request.headers = httputil.HTTPHeaders(request.headers)
+                if etag:
+                    send_request.headers['If-None-Match'] = etag
+                if last_modified:
+                    send_request.headers['If-Modified-Since'] = last_modified
+
+        def handle_response(response):
+            if key is None:
+                pass
+            elif entry is not None and response.code == 304:
+                self.cache.revalidations += 1
+                self.cache.revalidated(key, entry, response)
+                response = self.cache.build_response(request, entry, start_time)
+            else:
+                self.cache.misses += 1
+                self.cache.store(key, request, response)
+
+            callback(response)
+
+        self.client.fetch(send_request, callback=handle_response, **kwargs)
+
+    def close(self):
+        self.client.close()
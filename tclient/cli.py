@@ -0,0 +1,212 @@
+"""
+tclient.cli
+~~~~~~~~
+
+This module provides the command line load driver, run as `python -m tclient`.
+
+Requests are read as JSON, one per line, from a file or stdin:
+
+    {"method": "POST", "url": "http://localhost:8888/search",
+     "params": {"q": "turtles"}, "headers": {"X-Test": "1"}, "body": {"limit": 10}}
+
+Records written by `tclient.recording.Recorder` work too. A line is written
+for each response as it completes, and a summary goes to stderr at the end.
+Both directions are streamed, so memory use only depends on how many
+requests are in flight.
+
+    python -m tclient requests.jsonl --concurrency 200 --rate 1000 > responses.jsonl
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import argparse
+import collections
+import json
+import logging
+import sys
+import time
+
+import tornado.ioloop
+
+from . import core
+from . import metrics
+from . import recording
+from . import test
+from .request import Request
+
+
+log = logging.getLogger(__name__)
+
+
+def build_request(spec):
+    """Build a `Request` from a request spec, or a recorded request"""
+    if 'request' in spec:
+        return recording.build_request(spec)
+
+    body = spec.get('body')
+    if body is not None and not isinstance(body, dict):
+        body = body.encode('utf-8') if isinstance(body, unicode) else body
+
+    req = Request(spec['url'], method=spec.get('method', 'GET').upper(),
+                  headers=spec.get('headers'), body=body)
+    req.params.update(spec.get('params') or {})
+
+    if req.body is None and req.method in recording.BODY_METHODS:
+        req.body = ''
+
+    return req
+
+
+def iter_requests(lines):
+    for line in lines:
+        if line.strip():
+            yield build_request(json.loads(line))
+
+
+def build_result(ndx, response, include_body=False):
+    result = {
+        'index': ndx,
+        'method': response.request.method,
+        'url': response.request.url,
+        'code': response.code,
+        'error': str(response.error) if response.error is not None else None,
+        'request_time': response.request_time,
+        'queue_time': response.queue_time,
+        'attempts': response.attempts,
+        'time_info': response.time_info,
+        'body_size': len(response.body) if response.buffer is not None else None,
+    }
+
+    if include_body:
+        result['body'], result['body_encoding'] = recording.encode_body(
+            response.body if response.buffer is not None else None)
+
+    return result
+
+
+class RateLimitedClient(object):
+    """Wraps an http client, starting no more than `rate` requests a second
+
+    Requests beyond the rate wait in a queue, which is only as long as the
+    batch's concurrency window. Requests that run out of time while waiting
+    get a timeout response rather than using up the rate.
+    """
+    def __init__(self, client, loop, rate):
+        self.client = client
+        self.loop = loop
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self._queue = collections.deque()
+        self._timeout = None
+
+    def fetch(self, request, callback, **kwargs):
+        self._queue.append((time.time(), request, callback, kwargs))
+        if self._timeout is None:
+            self._send()
+
+    def _send(self):
+        self._timeout = None
+        while self._queue:
+            now = time.time()
+            queued_at, request, callback, kwargs = self._queue[0]
+            send_request = core.dequeue_request(request, queued_at, now)
+            if send_request is None:
+                self._queue.popleft()
+                callback(core.build_timeout_response(request, now - queued_at))
+                continue
+
+            if now < self.next_time:
+                self._timeout = self.loop.add_timeout(self.next_time, self._send)
+                return
+
+            self.next_time = max(now, self.next_time) + self.interval
+            self._queue.popleft()
+            self.client.fetch(send_request, callback=callback, **kwargs)
+
+    def close(self):
+        if self._timeout is not None:
+            self.loop.remove_timeout(self._timeout)
+        self.client.close()
+
+
+def build_summary(latency, count, errors, elapsed):
+    histogram = latency.get()
+    return {
+        'requests': count,
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'requests_per_s': count / elapsed if elapsed else None,
+        'mean_ms': histogram.mean * 1000 if histogram.mean is not None else None,
+        'p50_ms': (histogram.percentile(0.5) or 0.0) * 1000,
+        'p90_ms': (histogram.percentile(0.9) or 0.0) * 1000,
+        'p99_ms': (histogram.percentile(0.99) or 0.0) * 1000,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m tclient', description="Run requests from a JSONL file through tclient")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="File of request specs, one JSON object a line (default stdin)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="File to write responses to (default stdout)")
+    parser.add_argument('-c', '--concurrency', type=int, default=100,
+                        help="Maximum number of requests in flight")
+    parser.add_argument('--max-per-host', type=int, default=None)
+    parser.add_argument('-r', '--rate', type=float, default=None,
+                        help="Maximum number of requests started a second")
+    parser.add_argument('-t', '--timeout', type=float, default=None,
+                        help="Deadline for each request, in seconds")
+    parser.add_argument('--retries', type=int, default=0)
+    parser.add_argument('--bodies', action='store_true',
+                        help="Include response bodies in the output")
+    parser.add_argument('--mock', action='store_true',
+                        help="Answer every request with an empty 200 from a MockClient")
+    parser.add_argument('--mock-latency', type=float, default=None,
+                        help="Seconds to delay each mock response by")
+    parser.add_argument('--quiet', action='store_true', help="Don't print a summary")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, 'rb')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'wb')
+
+    if args.mock:
+        mock_client = test.get_test_client()
+        mock_client.handle(r'.*', lambda req: "", latency=args.mock_latency)
+
+    loop = tornado.ioloop.IOLoop()
+    client = core.build_client(loop)
+    if args.rate:
+        client = RateLimitedClient(client, loop, args.rate)
+
+    latency = metrics.LatencyHistogram()
+    count = 0
+    errors = 0
+    start = time.time()
+    try:
+        results = core.iter_all(loop, client, iter_requests(input_file),
+                                max_concurrency=args.concurrency,
+                                max_per_host=args.max_per_host,
+                                request_timeout=args.timeout, retries=args.retries,
+                                hooks=latency)
+        for ndx, response in results:
+            count += 1
+            if response.error is not None:
+                errors += 1
+            output_file.write(json.dumps(build_result(ndx, response, args.bodies)) + "\n")
+    finally:
+        output_file.flush()
+        core.close_loop(loop, client)
+        if args.mock:
+            test.clear_test_client()
+
+    if not args.quiet:
+        summary = build_summary(latency, count, errors, time.time() - start)
+        sys.stderr.write(json.dumps(summary, sort_keys=True) + "\n")
+
+    return 0
@@ -0,0 +1,166 @@
+"""
+tclient.codec
+~~~~~~~~
+
+This module provides the JSON codecs used for encoding request bodies and
+decoding responses. The standard library's json module is used by default, but
+faster implementations can be plugged in globally:
+
+    tclient.codec.set_default(tclient.codec.fastest())
+
+or for a single batch:
+
+    tclient.fetch_all(requests, codec=tclient.codec.get('ujson'))
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import json
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec(object):
+    """Codec using the standard library's json module"""
+    name = 'json'
+
+    def dumps(self, value):
+        return json.dumps(value)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class SimpleJSONCodec(JSONCodec):
+    name = 'simplejson'
+
+    def dumps(self, value):
+        return simplejson.dumps(value)
+
+    def loads(self, data):
+        return simplejson.loads(data)
+
+
+class UJSONCodec(JSONCodec):
+    name = 'ujson'
+
+    def dumps(self, value):
+        return ujson.dumps(value)
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+# Available codecs, fastest first
+CODECS = []
+if ujson is not None:
+    CODECS.append(UJSONCodec())
+if simplejson is not None:
+    CODECS.append(SimpleJSONCodec())
+CODECS.append(JSONCodec())
+
+_default = CODECS[-1]
+
+
+def get(name):
+    """Find an available codec by name"""
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+
+    raise ValueError("Codec %r is not available" % name)
+
+
+def fastest():
+    return CODECS[0]
+
+
+def get_default():
+    return _default
+
+
+def set_default(codec):
+    """Set the codec used by requests and responses that don't specify their own"""
+    global _default
+    _default = codec
+
+
+def iter_json_array(chunks):
+    """Decode the items of a JSON array one at a time from an iterable of chunks
+
+    This avoids building the entire array, and for chunks read from a file,
+    holding the entire document in memory.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    exhausted = False
+    started = False
+
+    while True:
+        # Skip whitespace and separators, reading more data as needed
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+
+            if pos < len(buf) or exhausted:
+                break
+
+            try:
+                buf = buf[pos:] + next(chunks)
+                pos = 0
+            except StopIteration:
+                exhausted = True
+
+        if pos >= len(buf):
+            raise ValueError("Unexpected end of JSON array")
+
+        char = buf[pos]
+        if not started:
+            if char != '[':
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        elif char == ']':
+            return
+        elif char == ',':
+            pos += 1
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            value, end = None, None
+
+        # The value is only complete if it's followed by the next separator. Otherwise
+        # it might have been cut off between chunks (like a number split in two).
+        if end is not None:
+            while end < len(buf) and buf[end] in ' \t\r\n':
+                end += 1
+            if end >= len(buf) or buf[end] not in ',]':
+                end = None
+
+        if end is None:
+            if exhausted:
+                raise ValueError("Invalid JSON array item at %d" % pos)
+
+            try:
+                buf = buf[pos:] + next(chunks)
+                pos = 0
+            except StopIteration:
+                exhausted = True
+            continue
+
+        pos = end
+        yield value
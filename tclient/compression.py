@@ -0,0 +1,255 @@
+"""
+tclient.compression
+~~~~~~~~
+
+This module provides compression of request bodies, and decompression of
+response bodies, for batches. Large payloads are (de)compressed in a thread
+pool so the io loop can keep the rest of the batch moving.
+
+    tclient.fetch_all(requests, compress='gzip')
+
+or, with more control:
+
+    compression = tclient.compression.Compression('gzip', min_size=4096)
+    tclient.fetch_all(requests, compress=compression)
+
+Responses are accepted in every encoding available. gzip and deflate always
+are, zstd and brotli when the `zstandard` and `brotli` modules are installed.
+Requests can pick their own encoding (or opt out with False) through
+`Request.compress`.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import copy
+import cStringIO
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import decoding
+from .errors import ContentDecodingError
+from .request import copy_headers
+
+
+log = logging.getLogger(__name__)
+
+# Bodies smaller than this aren't worth compressing
+MIN_SIZE = 1024
+
+# Bodies at least this big are (de)compressed in a thread pool rather than on the loop
+OFFLOAD_SIZE = 64 * 1024
+
+
+class GzipEncoding(object):
+    name = 'gzip'
+
+    # Tells zlib to use gzip's header and trailer
+    wbits = 16 + zlib.MAX_WBITS
+
+    def compress(self, data):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, self.wbits)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        return zlib.decompress(data, self.wbits)
+
+
+class DeflateEncoding(GzipEncoding):
+    name = 'deflate'
+    wbits = zlib.MAX_WBITS
+
+
+class ZstdEncoding(object):
+    name = 'zstd'
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor().compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class BrotliEncoding(object):
+    name = 'br'
+
+    def compress(self, data):
+        return brotli.compress(data)
+
+    def decompress(self, data):
+        return brotli.decompress(data)
+
+
+# Available encodings, in order of preference
+ENCODINGS = []
+if zstandard is not None:
+    ENCODINGS.append(ZstdEncoding())
+if brotli is not None:
+    ENCODINGS.append(BrotliEncoding())
+ENCODINGS.append(GzipEncoding())
+ENCODINGS.append(DeflateEncoding())
+
+
+def get(name):
+    """Find an available encoding by name"""
+    for encoding in ENCODINGS:
+        if encoding.name == name:
+            return encoding
+
+    raise ValueError("Encoding %r is not available" % name)
+
+
+def run_encoding(name, method, data):
+    """Run an encoding's compress or decompress, returning (success, value) so failures
+    make it back to us"""
+    try:
+        return True, getattr(get(name), method)(data)
+    except Exception:
+        log.exception("Failed to %s %d bytes with %s", method, len(data), name)
+        return False, None
+
+
+class Compression(object):
+    """Compression settings for a batch
+
+    Args:
+        encoding - Name of the encoding for request bodies, or None to only
+            decompress responses
+        min_size - Request bodies smaller than this are sent as they are
+        offload_size - Bodies at least this big are handled in a thread pool
+        accept - Names of the encodings to accept responses in, by default all
+            of them
+    """
+    def __init__(self, encoding='gzip', min_size=MIN_SIZE, offload_size=OFFLOAD_SIZE,
+                 accept=None):
+        if encoding is not None:
+            get(encoding)
+
+        self.encoding = encoding
+        self.min_size = min_size
+        self.offload_size = offload_size
+        self.accept = [get(name).name for name in accept] if accept is not None \
+            else [known.name for known in ENCODINGS]
+        self.accept_header = ", ".join(self.accept)
+
+    def request_encoding(self, request):
+        """Name of the encoding to compress the request's body with, if we should"""
+        encoding = getattr(request, 'compress', None)
+        if encoding is None:
+            encoding = self.encoding
+
+        if not encoding or 'Content-Encoding' in request.headers:
+            return None
+
+        body = request.body
+        if body is None or len(body) < self.min_size:
+            return None
+
+        return encoding
+
+    def should_negotiate(self, request):
+        """Should we ask for a compressed response, and decompress it ourselves?
+
+        Streamed responses are left to the http client.
+        """
+        return getattr(request, 'body_sink', None) is None \
+            and request.streaming_callback is None \
+            and 'Accept-Encoding' not in request.headers
+
+    def prepare(self, request, compressed=None):
+        """Build the request to actually send, with the (encoding, body) from
+        `compress` and asking for a compressed response
+
+        The request itself is left alone, so it can be sent again as it was.
+        """
+        negotiate = self.should_negotiate(request)
+        if compressed is None and not negotiate:
+            return request
+
+        sent = copy.copy(request)
+        sent.headers = copy_headers(request.headers)
+        if compressed is not None:
+            encoding, body = compressed
+            sent.body = body
+            sent.headers['Content-Encoding'] = encoding
+        if negotiate:
+            sent.headers['Accept-Encoding'] = self.accept_header
+            sent.use_gzip = False
+
+        return sent
+
+    def response_encoding(self, response, sent):
+        """Name of the encoding to decompress the response's body with, if we should
+
+        `sent` is the request as it was sent, from `prepare`.
+        """
+        if sent.use_gzip is not False or response.buffer is None \
+                or response.body_path is not None:
+            return None
+
+        encoding = response.headers.get('Content-Encoding', '').strip().lower()
+        return encoding if encoding in self.accept else None
+
+    def run(self, loop, name, method, data, callback):
+        """Compress or decompress the data, calling back with (success, value)
+
+        Small payloads are handled right away, before we return.
+        """
+        if len(data) < self.offload_size:
+            callback(run_encoding(name, method, data))
+            return
+
+        def handle_result(result):
+            loop.add_callback(callback, result)
+
+        decoding.get_pool('thread').apply_async(
+            run_encoding, (name, method, data), callback=handle_result)
+
+    def compress(self, loop, request, encoding, callback):
+        """Compress the request's body, calling back with the encoding and the
+        compressed body (or None if it failed)"""
+        def handle_result(result):
+            success, value = result
+            callback(encoding, value if success else None)
+
+        self.run(loop, encoding, 'compress', request.body, handle_result)
+
+    def decompress(self, loop, response, encoding, callback):
+        """Decompress the response's body, calling back with the number of bytes saved"""
+        body = response.body
+
+        def handle_result(result):
+            success, value = result
+            if not success:
+                response.error = ContentDecodingError(
+                    "Failed to decode %s response body" % encoding)
+                callback(0)
+                return
+
+            response._body = value
+            response.buffer = cStringIO.StringIO(value)
+            response.headers['X-Consumed-Content-Encoding'] = response.headers['Content-Encoding']
+            del response.headers['Content-Encoding']
+            callback(len(value) - len(body))
+
+        self.run(loop, encoding, 'decompress', body, handle_result)
+
+
+def build_compression(compress):
+    """Build `Compression` settings from what was passed to a batch"""
+    if compress is None or compress is False or isinstance(compress, Compression):
+        return compress or None
+    elif compress is True:
+        return Compression()
+    else:
+        return Compression(compress)
@@ -8,11 +8,16 @@ This module provides the core runner for our http client.
 :license: ISC, see LICENSE for more details.
 
 """
+import collections
+import copy
 import logging
 import functools
 import time
+import urlparse
 
+import tornado.concurrent
 import tornado.ioloop
+import tornado.httpclient
 import tornado.stack_context
 
 
@@ -21,7 +26,12 @@ try:
 except ImportError:
     blueox = None
 
-from .response import Response
+from .compression import build_compression
+from .decoding import Decoder
+from .metrics import build_hooks
+from .response import COMPACT_KEEP, Response
+from .retry import RetryPolicy
+from .utils import request_size, segment_indices
 
 
 log = logging.getLogger(__name__)
@@ -32,90 +42,991 @@ log = logging.getLogger(__name__)
 _CLIENT = None
 
 
-def fetch_all(requests, timeout=None, retries=0):
-    """Fetch all provided requests
-
-    This function creates it's own io loop and http client to process all the requests in parallel.
-    The responses are returned as a list of the exact same length.
-    """
-    log.debug("Starting fetch_all with %d requests", len(requests))
-    if not requests:
-        return []
-
-    loop = tornado.ioloop.IOLoop()
-
-    global _CLIENT
+def build_client(loop, cache=None):
+    """Build the http client we'll use for running requests on the specified loop"""
     if _CLIENT:
-        client = _CLIENT
+        # Test clients may want to know which loop they're running on
+        client = _CLIENT.bind(loop) if hasattr(_CLIENT, 'bind') else _CLIENT
     elif blueox:
         client = blueox.tornado_utils.AsyncHTTPClient(io_loop=loop)
     else:
         client = tornado.httpclient.AsyncHTTPClient(io_loop=loop)
 
-    # Since we're directly controlling our ioloop, we need to handle exceptions so we can
-    # stop it in case of a failure.
-    ioloop_exc = []
+    if cache is not None:
+        client = cache.wrap(client)
+
+    return client
+
+
+def close_loop(loop, client):
+    """Close a loop and client we're done with
+
+    We may have given up on requests that are still in progress, so make sure
+    any sockets left on the loop get closed too.
+    """
+    client.close()
+    loop.close(all_fds=True)
+
+
+def request_host(request):
+    return urlparse.urlparse(request.url).netloc
+
+
+COALESCE_METHODS = frozenset(['GET', 'HEAD'])
+
+
+def coalesce_key(request):
+    """Build a key identifying requests that must get the same response
+
+    Only requests that are safe to share a response between get a key,
+    otherwise we return None.
+    """
+    if request.method.upper() not in COALESCE_METHODS or request.body:
+        return None
+
+    # Each streamed response has to go wherever it's own request says
+    if getattr(request, 'body_sink', None) is not None \
+            or request.streaming_callback is not None:
+        return None
+
+    headers = tuple(sorted((name.lower(), value) for name, value in request.headers.items()))
+    return (request.method.upper(), request.url, headers,
+            request.auth_username, request.auth_password)
+
+
+def build_timeout_response(request, request_time=0.0):
+    """Build the response we hand back for requests we gave up waiting on"""
+    return Response(request, 599, error=tornado.httpclient.HTTPError(599, "Timeout"),
+                    request_time=request_time)
+
+
+def dequeue_request(request, queued_at, now=None):
+    """The request to send after it's waited in a queue since `queued_at`, with it's
+    request_timeout cut short by the wait, or None if it's run out of time"""
+    if not request.request_timeout:
+        return request
+
+    waited = (now or time.time()) - queued_at
+    remaining = request.request_timeout - waited
+    if remaining <= 0:
+        return None
+
+    request = copy.copy(request)
+    request.request_timeout = remaining
+    return request
+
+
+class ActiveRequest(object):
+    """State for a request that's been started (and may be waiting on a retry)"""
+    __slots__ = ('request', 'host', 'queue_time', 'start_time', 'deadline', 'attempts',
+                 'deadline_timeout', 'retry_timeout', 'compressed', 'send_request')
+
+    def __init__(self, request, host, queue_time, start_time, deadline, send_request=None):
+        self.request = request
+        # The request as the batch sends it, which may carry the batch's codec
+        self.send_request = send_request or request
+        self.host = host
+        self.queue_time = queue_time
+        self.start_time = start_time
+        self.deadline = deadline
+        self.attempts = 1
+        self.deadline_timeout = None
+        self.retry_timeout = None
+        # (encoding, body) to send in place of the request's own body
+        self.compressed = None
+
+
+class Batch(object):
+    """A set of requests being run together on an io loop
+
+    The batch doesn't start or stop the loop itself. As each request completes,
+    `on_result` is called with the index of the request and its `Response`.
+    Once every request has a response (or the batch fails or times out) the
+    callback provided to `start` is called.
+
+    Requests can be any iterable, and are only pulled from it as they're
+    about to be started.
+
+    Args:
+        timeout - Deadline, in seconds, for the entire batch
+        request_timeout - Deadline, in seconds, for each request once it's started,
+            including any retries
+        retries - Number of times to retry a request that failed, or a `RetryPolicy`
+        max_concurrency - Maximum number of requests in flight at any one time
+        max_per_host - Maximum number of requests in flight to any single host
+        coalesce - Only send one of any identical GET or HEAD requests
+        codec - JSON codec for requests and responses that don't have their own
+        decode - Decode JSON responses in a pool as they arrive, see `tclient.decoding.Decoder`
+        hooks - `tclient.metrics.Hooks` (or a list of them) for instrumenting the batch
+        compact - Hand back a `CompactResponse` keeping only the 'body', 'headers' or 'status'
+        compress - Compress request bodies and accept compressed responses, see
+            `tclient.compression`
+
+    Requests that miss their deadline get a 599 timeout response. Each attempt
+    is sent with its `request_timeout` lowered to fit the deadline, so the
+    http client gives up on the connection at the same time we do.
+
+    Requests held back by the concurrency limits wait in our own queue, and are
+    started as soon as an earlier request finishes. How long each request waited
+    is available as `Response.queue_time`.
+
+    When coalescing, duplicate requests wait on the first identical request and
+    get a copy of it's response marked as `Response.coalesced`. Note that this
+    keeps every response around until the batch is complete.
+    """
+    def __init__(self, loop, client, requests, on_result, timeout=None, request_timeout=None,
+                 retries=0, max_concurrency=None, max_per_host=None, coalesce=False,
+                 codec=None, decode=None, on_response=None, hooks=None, compact=None,
+                 compress=None):
+        if compact is not None and compact not in COMPACT_KEEP:
+            raise ValueError("Unknown compact mode %r" % compact)
+
+        self.loop = loop
+        self.client = client
+        self.on_result = on_result
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        if isinstance(retries, RetryPolicy):
+            self.retry_policy = retries
+        else:
+            self.retry_policy = RetryPolicy.from_retries(retries)
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.coalesce = coalesce
+        self.codec = codec
+        self.decoder = Decoder(decode) if decode is not None else None
+        self.on_response = on_response
+        self.hooks = build_hooks(hooks)
+        self.compact = compact
+        self.compression = build_compression(compress)
+
+        self.exc_info = None
+        self.finished = False
+        self.timed_out = False
+
+        self._callback = None
+        self._start_time = None
+        self._deadline = None
+        self._deadline_timeout = None
+
+        self._pending = enumerate(requests)
+        self._exhausted = False
+        self._blocked = collections.defaultdict(collections.deque)
+        self._blocked_count = 0
+        self._freed_hosts = collections.deque()
+        self._dispatching = False
+        self._host_in_flight = collections.defaultdict(int)
+        self._started = 0
+        self._retries_used = 0
+        self.coalesced = 0
+
+        # Bytes we didn't have to send or receive, thanks to compression
+        self.bytes_saved = 0
+
+        # When coalescing, the index of the first request for each key, along with
+        # any later duplicates waiting on it (or it's response, once we have it).
+        self._coalesce_ndx = {}
+        self._coalesce_waiting = {}
+        self._coalesce_done = {}
+
+        # Requests that have been started, by request index
+        self._active = {}
+
+        # Responses waiting to be decoded, by request index
+        self._decoding = {}
+
+    def start(self, callback):
+        self._callback = callback
+        self._start_time = time.time()
+
+        if self.timeout is not None:
+            self._deadline = self._start_time + self.timeout
+            self._deadline_timeout = self.loop.add_timeout(self._deadline, self.expire)
+
+        if self.hooks is not None:
+            self.hooks.on_batch_start(self)
+
+        self._dispatch()
+
+    def finish(self):
+        if self.finished:
+            return
+
+        self.finished = True
+
+        if self.coalesced:
+            log.debug("Saved %d requests by coalescing", self.coalesced)
+
+        if self.bytes_saved:
+            log.debug("Saved %d bytes by compressing", self.bytes_saved)
+
+        if self._deadline_timeout is not None:
+            self.loop.remove_timeout(self._deadline_timeout)
+
+        for active in self._active.itervalues():
+            self._clear_timeouts(active)
+
+        if self.hooks is not None:
+            self.hooks.on_batch_finish(self)
+
+        if self._callback is not None:
+            self._callback()
+
+    def expire(self):
+        """Give up on the batch, handing back a timeout response for everything that's
+        been started but not completed.
+
+        Requests that were never started are left for the caller, see `expire_unstarted`.
+        """
+        if self.finished:
+            return
 
-    def handle_exception(*exc_info):
+        log.warning("Timeout waiting on requests")
+        self.timed_out = True
+        self._deadline_timeout = None
+
+        now = time.time()
+        for ndx in sorted(self._active):
+            self._expire_request(ndx, now)
+
+        # Whatever hasn't been decoded yet will have to be decoded by the caller
+        for ndx in sorted(self._decoding):
+            self._emit(ndx, self._decoding.pop(ndx))
+
+        for blocked in self._blocked.itervalues():
+            for ndx, req in blocked:
+                if self.hooks is not None:
+                    self.hooks.on_timeout(ndx, req)
+                resp = build_timeout_response(req)
+                resp.queue_time = now - self._start_time
+                self._emit(ndx, resp)
+        self._blocked.clear()
+        self._blocked_count = 0
+
+        self.finish()
+
+    def cancel(self):
+        """Stop the batch without calling back, ignoring anything still outstanding"""
+        self._callback = None
+        self.finish()
+
+    def expire_unstarted(self):
+        """Iterate through (index, response) with a timeout response for each request we
+        never got to start"""
+        queue_time = time.time() - self._start_time
+        for ndx, req in self._pending:
+            resp = build_timeout_response(req)
+            resp.queue_time = queue_time
+            if self.compact is not None:
+                resp = resp.compact(self.compact)
+            yield ndx, resp
+
+    def handle_exception(self, *exc_info):
         log.error("Exception encountered during fetch")
-        loop.stop()
-        ioloop_exc.append(exc_info)
+        if self.exc_info is None:
+            self.exc_info = exc_info
+        self.finish()
         return True
 
-    responses = [None] * len(requests)
-    request_retries = [retries] * len(requests)
+    def _coalesce_request(self, ndx, req):
+        """Check for an identical earlier request, returning True if this one can
+        share it's response."""
+        key = coalesce_key(req)
+        if key is None:
+            return False
+
+        leader_ndx = self._coalesce_ndx.get(key)
+        if leader_ndx is None:
+            self._coalesce_ndx[key] = ndx
+            self._coalesce_waiting[ndx] = []
+            return False
+
+        self.coalesced += 1
+        if leader_ndx in self._coalesce_done:
+            self.on_result(ndx, self._coalesce_done[leader_ndx].copy_for(req))
+        else:
+            self._coalesce_waiting[leader_ndx].append((ndx, req))
+
+        return True
+
+    def _decoded(self, ndx, result):
+        resp = self._decoding.pop(ndx, None)
+        if resp is None or self.finished:
+            return
+
+        success, value = result
+        if success:
+            resp._json = value
+
+        self._emit(ndx, resp)
+        self._dispatch()
+
+    def _emit(self, ndx, resp):
+        if self.compact is not None:
+            resp = resp.compact(self.compact)
+
+        self.on_result(ndx, resp)
+
+        waiting = self._coalesce_waiting.pop(ndx, None)
+        if waiting is not None:
+            self._coalesce_done[ndx] = resp
+            for dup_ndx, dup_req in waiting:
+                self.on_result(dup_ndx, resp.copy_for(dup_req))
+
+    def _clear_timeouts(self, active):
+        if active.deadline_timeout is not None:
+            self.loop.remove_timeout(active.deadline_timeout)
+            active.deadline_timeout = None
+        if active.retry_timeout is not None:
+            self.loop.remove_timeout(active.retry_timeout)
+            active.retry_timeout = None
+
+    def _has_capacity(self):
+        return self.max_concurrency is None or len(self._active) < self.max_concurrency
+
+    def _next_request(self):
+        # Anything waiting on a host that just freed up goes first, it's been waiting
+        # longer than anything still in the pending queue.
+        while self._freed_hosts:
+            host = self._freed_hosts.popleft()
+            blocked = self._blocked.get(host)
+            if blocked and self._host_in_flight[host] < self.max_per_host:
+                self._blocked_count -= 1
+                return blocked.popleft()
+
+        while not self._exhausted:
+            try:
+                ndx, req = next(self._pending)
+            except StopIteration:
+                self._exhausted = True
+                break
+
+            if self.coalesce and self._coalesce_request(ndx, req):
+                continue
+
+            if self.max_per_host is not None:
+                host = request_host(req)
+                if self._host_in_flight[host] >= self.max_per_host:
+                    self._blocked[host].append((ndx, req))
+                    self._blocked_count += 1
+                    continue
+
+            return ndx, req
+
+        return None
+
+    def _dispatch(self, freed_host=None):
+        if freed_host is not None and freed_host in self._blocked:
+            self._freed_hosts.append(freed_host)
+
+        # Clients may call us back before fetch() even returns, so make sure we
+        # don't recurse back into here.
+        if self._dispatching:
+            return
+
+        self._dispatching = True
+        try:
+            while self._has_capacity() and not self.finished:
+                next_req = self._next_request()
+                if next_req is None:
+                    break
+
+                self._fetch(*next_req)
+        finally:
+            self._dispatching = False
+
+        if self._exhausted and not self._active and not self._decoding \
+                and self._blocked_count == 0:
+            log.debug("Collected all responses, exiting...")
+            self.finish()
+
+    def _fetch(self, ndx, req):
+        host = None
+        if self.max_per_host is not None:
+            host = request_host(req)
+            self._host_in_flight[host] += 1
+
+        now = time.time()
+        deadline = self._deadline
+        if self.request_timeout is not None:
+            deadline = min(deadline or float('inf'), now + self.request_timeout)
+
+        # The batch's codec goes on a copy, so the caller's request keeps it's own
+        send_request = req
+        if self.codec is not None and getattr(req, 'codec', False) is None:
+            send_request = copy.copy(req)
+            send_request.codec = self.codec
+
+        active = ActiveRequest(req, host, now - self._start_time, now, deadline, send_request)
+        self._active[ndx] = active
+        self._started += 1
+
+        if self.hooks is not None:
+            self.hooks.on_dispatch(ndx, req, active.queue_time)
+
+        # The batch deadline has it's own timer
+        if self.request_timeout is not None:
+            active.deadline_timeout = self.loop.add_timeout(
+                deadline, functools.partial(self._expire_request, ndx))
+
+        encoding = None
+        if self.compression is not None:
+            encoding = self.compression.request_encoding(send_request)
+
+        if encoding is not None:
+            self.compression.compress(self.loop, send_request, encoding,
+                                      functools.partial(self._compressed, ndx, active))
+        else:
+            self._send(ndx)
+
+    def _compressed(self, ndx, active, encoding, body):
+        if self.finished or self._active.get(ndx) is not active:
+            return
+
+        if body is not None:
+            self.bytes_saved += len(active.send_request.body) - len(body)
+            active.compressed = (encoding, body)
+        self._send(ndx)
+
+    def _send(self, ndx):
+        active = self._active[ndx]
+        active.retry_timeout = None
+
+        req = active.send_request
+        sink = getattr(req, 'body_sink', None)
+        if sink is not None:
+            sink.start()
+
+        # Anything we change for this attempt goes on a copy, leaving the caller's
+        # request as it was
+        if self.compression is not None:
+            req = self.compression.prepare(req, active.compressed)
+
+        if active.deadline is not None:
+            remaining = active.deadline - time.time()
+            if not req.request_timeout or remaining < req.request_timeout:
+                if req is active.request:
+                    req = copy.copy(req)
+                req.request_timeout = max(remaining, 0.001)
+
+        with tornado.stack_context.ExceptionStackContext(self.handle_exception):
+            self.client.fetch(req, callback=functools.partial(self._collect_response, ndx))
+
+    def _expire_request(self, ndx, now=None):
+        active = self._active.get(ndx)
+        if active is None:
+            return
+
+        active.deadline_timeout = None
+        log.debug("Request %d timed out", ndx)
+
+        if self.hooks is not None:
+            self.hooks.on_timeout(ndx, active.request)
+
+        resp = build_timeout_response(active.request, (now or time.time()) - active.start_time)
+        self._complete(ndx, resp)
+
+    def _collect_response(self, request_ndx, response):
+        if self.finished:
+            return
+
+        active = self._active.get(request_ndx)
+        if active is None:
+            # We must have already given up on this one
+            return
 
-    def collect_response(request_ndx, response):
         log.debug("Received %d response for request %d", response.code, request_ndx)
 
+        if self.on_response is not None:
+            self.on_response(response)
+
         # Should we try again?
-        if response.error and request_retries[request_ndx] > 0:
-            request_retries[request_ndx] -= 1
-            log.debug(
-                "Attempt %d for request %d",
-                (retries - request_retries[request_ndx]) + 1, request_ndx)
+        if response.error:
+            delay = self.retry_policy.retry_delay(response, active.attempts)
+            if delay is not None \
+                    and (active.deadline is None or time.time() + delay < active.deadline) \
+                    and self.retry_policy.budget_allows(self._retries_used, self._started):
+                active.attempts += 1
+                self._retries_used += 1
+                log.debug(
+                    "Attempt %d for request %d in %.3fs", active.attempts, request_ndx, delay)
+
+                if self.hooks is not None:
+                    self.hooks.on_retry(
+                        request_ndx, active.request, response, active.attempts, delay)
+
+                if delay > 0:
+                    active.retry_timeout = self.loop.add_timeout(
+                        time.time() + delay, functools.partial(self._send, request_ndx))
+                else:
+                    self._send(request_ndx)
+                return
+
+        resp = Response.from_response(response)
+        sent = resp.request
+        resp.request = active.request
 
-            with tornado.stack_context.ExceptionStackContext(handle_exception):
-                client.fetch(
-                    response.request,
-                    callback=functools.partial(collect_response, request_ndx))
+        encoding = None
+        if self.compression is not None:
+            encoding = self.compression.response_encoding(resp, sent)
 
+        if encoding is not None:
+            self.compression.decompress(
+                self.loop, resp, encoding,
+                functools.partial(self._decompressed, request_ndx, active, resp))
+        else:
+            self._complete(request_ndx, resp)
+
+    def _decompressed(self, ndx, active, resp, saved):
+        if self.finished or self._active.get(ndx) is not active:
             return
 
-        responses[request_ndx] = Response.from_response(response)
-        if all(responses):
-            log.debug("Collected all responses, exiting...")
-            loop.stop()
+        self.bytes_saved += saved
+        self._complete(ndx, resp)
 
-    def handle_timeout():
-        log.warning("Timeout waiting on requests")
-        loop.stop()
+    def _complete(self, ndx, resp):
+        active = self._active.pop(ndx)
+        self._clear_timeouts(active)
 
-    timeout_req = None
-    if timeout is not None:
-        timeout_req = loop.add_timeout(time.time() + timeout, handle_timeout)
+        resp.queue_time = active.queue_time
+        resp.attempts = active.attempts
+        if self.codec is not None:
+            resp.codec = self.codec
 
-    for ndx, req in enumerate(requests):
-        with tornado.stack_context.ExceptionStackContext(handle_exception):
-            client.fetch(req, callback=functools.partial(collect_response, ndx))
+        if active.host is not None:
+            self._host_in_flight[active.host] -= 1
 
+        if self.hooks is not None:
+            self.hooks.on_response(ndx, resp)
+
+        if self.decoder is not None and not self.timed_out and self.decoder.should_decode(resp):
+            self._decoding[ndx] = resp
+            self.decoder.decode(self.loop, resp, functools.partial(self._decoded, ndx))
+        else:
+            self._emit(ndx, resp)
+
+        # If we're in the middle of expiring the whole batch, there's nothing else to do.
+        if not self.timed_out:
+            self._dispatch(freed_host=active.host)
+
+
+class Segment(object):
+    """Timing for one segment of requests run by a `SegmentedBatch`"""
+    __slots__ = ('index', 'indexes', 'size', 'start_time', 'end_time', 'timed_out')
+
+    def __init__(self, index, indexes, size, start_time):
+        self.index = index
+        self.indexes = indexes
+        self.size = size
+        self.start_time = start_time
+        self.end_time = None
+        self.timed_out = False
+
+    @property
+    def elapsed(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class SegmentedBatch(object):
+    """Requests split into segments, with several segments run at once on an io loop
+
+    Each segment is it's own `Batch`. As soon as one finishes, the next segment
+    is started, so a slow request only holds up it's own segment.
+
+    Like `Batch`, `on_result` is called with the index (into all the requests)
+    and `Response` as each request completes, and the callback provided to
+    `start` once they all have.
+
+    Args:
+        max_bytes, max_length, packing - How to split up requests, see
+            `tclient.utils.segment_requests`
+        parallel_segments - Number of segments to run at a time
+        timeout - Deadline, in seconds, for all the segments
+        on_segment - Called with a `Segment` as each one finishes
+
+    Any other arguments are passed along to each segment's `Batch`.
+    """
+    def __init__(self, loop, client, requests, on_result, max_bytes=None, max_length=None,
+                 packing='greedy', parallel_segments=2, timeout=None, on_segment=None,
+                 **kwargs):
+        self.loop = loop
+        self.client = client
+        self.requests = requests
+        self.on_result = on_result
+        self.parallel_segments = parallel_segments
+        self.timeout = timeout
+        self.on_segment = on_segment
+        self.batch_kwargs = kwargs
+
+        self.segments = []
+        self.exc_info = None
+        self.finished = False
+        self.timed_out = False
+
+        self._callback = None
+        self._deadline = None
+        self._pending = iter(segment_indices(
+            requests, max_bytes=max_bytes, max_length=max_length, packing=packing))
+        self._running = {}
+        self._starting = False
+
+    def start(self, callback):
+        self._callback = callback
+        if self.timeout is not None:
+            self._deadline = time.time() + self.timeout
+
+        self._start_segments()
+
+    def finish(self):
+        if self.finished:
+            return
+
+        self.finished = True
+        for batch in self._running.keys():
+            batch.cancel()
+        self._running.clear()
+
+        if self._callback is not None:
+            self._callback()
+
+    def cancel(self):
+        self._callback = None
+        self.finish()
+
+    def _start_segments(self):
+        # Segments can finish before their batch even returns from start(), so make
+        # sure we don't recurse back into here.
+        if self._starting:
+            return
+
+        self._starting = True
+        try:
+            while len(self._running) < self.parallel_segments and not self.finished:
+                try:
+                    indexes = next(self._pending)
+                except StopIteration:
+                    break
+
+                self._start_segment(indexes)
+        finally:
+            self._starting = False
+
+        if not self._running:
+            self.finish()
+
+    def _start_segment(self, indexes):
+        now = time.time()
+        requests = [self.requests[ndx] for ndx in indexes]
+        segment = Segment(len(self.segments), indexes,
+                          sum(request_size(req) for req in requests), now)
+        self.segments.append(segment)
+
+        if self._deadline is not None and now >= self._deadline:
+            self.timed_out = segment.timed_out = True
+            for ndx, req in zip(indexes, requests):
+                resp = build_timeout_response(req)
+                resp.queue_time = 0.0
+                if self.batch_kwargs.get('compact') is not None:
+                    resp = resp.compact(self.batch_kwargs['compact'])
+                self.on_result(ndx, resp)
+            self._segment_done(segment, None)
+            return
+
+        timeout = None
+        if self._deadline is not None:
+            timeout = self._deadline - now
+
+        def collect_result(segment_ndx, response):
+            self.on_result(indexes[segment_ndx], response)
+
+        batch = Batch(self.loop, self.client, requests, collect_result, timeout=timeout,
+                      **self.batch_kwargs)
+        self._running[batch] = segment
+        batch.start(functools.partial(self._segment_done, segment, batch))
+
+    def _segment_done(self, segment, batch):
+        segment.end_time = time.time()
+        if batch is not None:
+            self._running.pop(batch, None)
+
+            if batch.exc_info:
+                self.exc_info = batch.exc_info
+                self.finish()
+                return
+
+            if batch.timed_out:
+                self.timed_out = segment.timed_out = True
+                for segment_ndx, resp in batch.expire_unstarted():
+                    self.on_result(segment.indexes[segment_ndx], resp)
+
+        log.debug("Segment %d of %d requests (%d bytes) took %.3fs", segment.index,
+                  len(segment.indexes), segment.size, segment.elapsed)
+
+        if self.on_segment is not None:
+            self.on_segment(segment)
+
+        self._start_segments()
+
+
+def run_all(loop, client, requests, on_response=None, **kwargs):
+    """Run all provided requests using an existing io loop and http client
+
+    The loop is started and will be stopped again once all the requests are
+    complete (or we timeout). Neither the loop nor the client are closed, so
+    they can be reused for the next batch.
+
+    See `Batch` for the other supported arguments.
+    """
+    if not requests:
+        return []
+
+    responses = [None] * len(requests)
+    batch = Batch(loop, client, requests, responses.__setitem__, on_response=on_response,
+                  **kwargs)
+
+    batch.start(loop.stop)
     loop.start()
 
     # Did we encounter any exceptions?
-    if ioloop_exc:
-        exc_info = ioloop_exc[0]
+    if batch.exc_info:
+        exc_info = batch.exc_info
         # This should re-raise the exception
         raise exc_info[0], exc_info[1], exc_info[2]
 
-    # Cleanup
-    if timeout_req is not None:
-        loop.remove_timeout(timeout_req)
+    if batch.timed_out:
+        for ndx, resp in batch.expire_unstarted():
+            responses[ndx] = resp
 
-    client.close()
-    loop.close()
+    return responses
+
+
+def iter_all(loop, client, requests, on_response=None, **kwargs):
+    """Run all provided requests using an existing io loop and http client, yielding
+    (index, response) pairs as each request completes.
+
+    The loop only runs while we're waiting for the next response, so at most
+    the number of requests in flight are ever buffered waiting for the caller.
+    """
+    buffered = collections.deque()
+
+    def collect_result(ndx, response):
+        if not buffered:
+            loop.stop()
+        buffered.append((ndx, response))
+
+    batch = Batch(loop, client, requests, collect_result, on_response=on_response, **kwargs)
+
+    try:
+        batch.start(loop.stop)
+        while True:
+            # Note that if the loop was already asked to stop, this returns right away.
+            loop.start()
+
+            if batch.exc_info:
+                exc_info = batch.exc_info
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            while buffered:
+                yield buffered.popleft()
+
+            if batch.finished:
+                break
+
+        if batch.timed_out:
+            for result in batch.expire_unstarted():
+                yield result
+    finally:
+        # We might be here because the caller stopped iterating early, in which case we
+        # don't want any straggling responses showing up.
+        batch.cancel()
+
+
+def run_segmented(loop, client, requests, on_response=None, **kwargs):
+    """Run all provided requests in segments, using an existing io loop and http client
+
+    See `SegmentedBatch` for the supported arguments.
+    """
+    if not requests:
+        return []
+
+    responses = [None] * len(requests)
+    batch = SegmentedBatch(loop, client, requests, responses.__setitem__,
+                           on_response=on_response, **kwargs)
+
+    batch.start(loop.stop)
+    loop.start()
+
+    if batch.exc_info:
+        exc_info = batch.exc_info
+        raise exc_info[0], exc_info[1], exc_info[2]
 
     return responses
 
 
-def fetch(request, timeout=None, retries=0):
-    return fetch_all([request], timeout=timeout, retries=retries)[0]
+def start_all(loop, client, requests, on_response=None, **kwargs):
+    """Start all provided requests on a running io loop, returning a `Future` for the
+    list of responses
+
+    This has to be called from the loop's own thread. See `Batch` for the
+    other supported arguments.
+    """
+    future = tornado.concurrent.TracebackFuture()
+
+    requests = list(requests)
+    if not requests:
+        future.set_result([])
+        return future
+
+    responses = [None] * len(requests)
+    batch = Batch(loop, client, requests, responses.__setitem__, on_response=on_response,
+                  **kwargs)
+
+    def handle_finish():
+        if batch.exc_info:
+            future.set_exc_info(batch.exc_info)
+            return
+
+        if batch.timed_out:
+            for ndx, resp in batch.expire_unstarted():
+                responses[ndx] = resp
+
+        future.set_result(responses)
+
+    batch.start(handle_finish)
+    return future
+
+
+def fetch_all(requests, timeout=None, request_timeout=None, retries=0, max_concurrency=None,
+              max_per_host=None, coalesce=False, cache=None, codec=None, decode=None,
+              hooks=None, compact=None, compress=None):
+    """Fetch all provided requests
+
+    This function creates it's own io loop and http client to process all the requests in parallel.
+    The responses are returned as a list of the exact same length.
+
+    `timeout` is a deadline for the whole batch, and `request_timeout` a
+    deadline for each request (including retries) once it's started. Any
+    request that doesn't finish in time gets a 599 timeout response.
+
+    `retries` can either be a number of times to immediately retry any failed
+    request, or a `tclient.RetryPolicy` for more control.
+
+    By default every request is started at once. Use `max_concurrency` and
+    `max_per_host` to limit how many requests are in flight at a time.
+
+    With `coalesce`, identical GET or HEAD requests in the batch are only sent
+    once. Their responses are marked as `Response.coalesced`, so the number of
+    requests saved is `sum(resp.coalesced for resp in responses)`.
+
+    Pass a `tclient.Cache` as `cache` to have cacheable responses served from,
+    and stored in, it.
+
+    `codec` picks the JSON codec used for request bodies and `Response.json`,
+    see `tclient.codec`.
+
+    With `decode` set to 'thread' or 'process' (or your own `multiprocessing`
+    pool), JSON responses are decoded in a pool as they arrive, while the rest
+    of the batch is still in flight. `Response.json` is then ready to go.
+
+    `hooks` are called as each request is dispatched, retried, times out and
+    completes, see `tclient.metrics`.
+
+    For huge batches, `compact` hands back a `tclient.response.CompactResponse`
+    for each request, holding on to less. Set it to 'body' to keep everything
+    that matters, 'headers' to drop the bodies, or 'status' to keep just the
+    code and any error.
+
+    With `compress` set to an encoding like 'gzip' (or `True`), large request
+    bodies are compressed and compressed responses accepted. Big payloads are
+    handled in a thread pool, see `tclient.compression`.
+
+    If you're going to be making many calls, see `tclient.Session` which keeps
+    the loop and client (and so any open connections) around between batches.
+    """
+    log.debug("Starting fetch_all with %d requests", len(requests))
+    if not requests:
+        return []
+
+    loop = tornado.ioloop.IOLoop()
+    client = build_client(loop, cache=cache)
+
+    try:
+        return run_all(loop, client, requests, timeout=timeout, request_timeout=request_timeout,
+                       retries=retries, max_concurrency=max_concurrency,
+                       max_per_host=max_per_host, coalesce=coalesce, codec=codec,
+                       decode=decode, hooks=hooks, compact=compact, compress=compress)
+    finally:
+        close_loop(loop, client)
+
+
+def fetch_iter(requests, **kwargs):
+    """Fetch all provided requests, yielding (index, response) pairs as they complete
+
+    This takes the same arguments as `fetch_all`, but rather than waiting for
+    every response, each is handed back as soon as it's ready. Requests can be
+    any iterable, including a generator, and are only consumed as they're
+    started. Once the timeout hits, everything outstanding is yielded with a
+    timeout response.
+
+    Memory use is bounded by the number of requests in flight, so for very large
+    batches you'll want to set `max_concurrency`.
+    """
+    loop = tornado.ioloop.IOLoop()
+    client = build_client(loop, cache=kwargs.pop('cache', None))
+
+    try:
+        for result in iter_all(loop, client, requests, **kwargs):
+            yield result
+    finally:
+        close_loop(loop, client)
+
+
+def fetch_segmented(requests, max_bytes=None, max_length=None, parallel_segments=2, **kwargs):
+    """Fetch all provided requests, split up into segments
+
+    Requests are split up like `tclient.utils.segment_requests` (which also
+    takes a `packing` argument), and `parallel_segments` of those segments are
+    run at a time. Each time a segment completes, the next one is started
+    right away.
+
+    Responses are returned in the same order as the requests. Provide an
+    `on_segment` callback to get the timing for each segment, as a
+    `tclient.core.Segment`, as it completes.
+
+    Other arguments are the same as `fetch_all`. Note that `timeout` is for all
+    the requests, while the concurrency limits apply to each segment.
+    """
+    log.debug("Starting fetch_segmented with %d requests", len(requests))
+    if not requests:
+        return []
+
+    loop = tornado.ioloop.IOLoop()
+    client = build_client(loop, cache=kwargs.pop('cache', None))
+
+    try:
+        return run_segmented(loop, client, requests, max_bytes=max_bytes, max_length=max_length,
+                             parallel_segments=parallel_segments, **kwargs)
+    finally:
+        close_loop(loop, client)
+
+
+def fetch_all_async(requests, io_loop=None, cache=None, **kwargs):
+    """Fetch all provided requests on an io loop that's already running
+
+    Rather than running it's own loop, this starts the requests on `io_loop`
+    (by default the current loop) and returns a `Future` for the list of
+    responses. From inside a coroutine, like a tornado request handler:
+
+        responses = yield tclient.fetch_all_async(requests, timeout=5)
+
+    Takes the same arguments as `fetch_all`. The loop's shared http client is
+    used, so it's never closed by us.
+    """
+    loop = io_loop or tornado.ioloop.IOLoop.current()
+    return start_all(loop, build_client(loop, cache=cache), requests, **kwargs)
+
+
+def fetch(request, **kwargs):
+    return fetch_all([request], **kwargs)[0]
@@ -0,0 +1,83 @@
+"""
+tclient.decoding
+~~~~~~~~
+
+This module provides the Decoder class, which decodes JSON response bodies in
+a thread or process pool while the rest of a batch is still in flight.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import logging
+import multiprocessing
+import multiprocessing.pool
+
+from . import codec as json_codec
+
+
+log = logging.getLogger(__name__)
+
+# Pools shared by all batches, created as they're needed
+_POOLS = {}
+
+
+def get_pool(kind):
+    if kind not in _POOLS:
+        if kind == 'thread':
+            _POOLS[kind] = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
+        elif kind == 'process':
+            _POOLS[kind] = multiprocessing.Pool(multiprocessing.cpu_count())
+        else:
+            raise ValueError("Unknown decode mode %r" % kind)
+
+    return _POOLS[kind]
+
+
+def decode_body(codec, body):
+    """Decode the body, returning (success, value) so failures make it back to us"""
+    if isinstance(codec, basestring):
+        codec = json_codec.get(codec)
+
+    try:
+        return True, codec.loads(body)
+    except Exception:
+        return False, None
+
+
+class Decoder(object):
+    """Decodes JSON response bodies in a pool
+
+    Args:
+        pool - 'thread' or 'process' to use our shared pools, or your own
+            `multiprocessing` pool.
+
+    A thread pool is only going to help for codecs that release the GIL.
+    Process pools have to copy each body over, and the decoded value back.
+    """
+    def __init__(self, pool):
+        self.use_processes = pool == 'process' or (
+            isinstance(pool, multiprocessing.pool.Pool)
+            and not isinstance(pool, multiprocessing.pool.ThreadPool))
+
+        if isinstance(pool, basestring):
+            pool = get_pool(pool)
+        self.pool = pool
+
+    def should_decode(self, response):
+        if response.error or response.buffer is None:
+            return False
+
+        return 'json' in response.headers.get('Content-Type', '')
+
+    def decode(self, loop, response, callback):
+        """Decode the response's body, calling back on the loop with (success, value)"""
+        codec = response.codec or json_codec.get_default()
+        if self.use_processes and codec in json_codec.CODECS:
+            # Our own codecs are looked up again by name on the other side
+            codec = codec.name
+
+        def handle_result(result):
+            loop.add_callback(callback, result)
+
+        self.pool.apply_async(decode_body, (codec, response.body), callback=handle_result)
@@ -12,3 +12,18 @@ This module contains the set of tclient's exceptions
 class TclientError(Exception):
     """This is an ambiguous error that occured."""
     pass
+
+
+class BodyTooLarge(TclientError):
+    """The response body was larger than the request's max_body_size"""
+    pass
+
+
+class ShardFailed(TclientError):
+    """A worker process for `tclient.sharding.fetch_sharded` failed"""
+    pass
+
+
+class ContentDecodingError(TclientError):
+    """A compressed response body couldn't be decompressed"""
+    pass
@@ -9,32 +9,138 @@ out forms for http requests.
 :license: ISC, see LICENSE for more details.
 
 """
+import inspect
+import mimetypes
+import os
 import urllib
+import uuid
 
-try:
-    import urllib3
-except ImportError:
+import tornado.gen
+import tornado.httpclient
+from tornado.escape import utf8
+
+from .utils import VersionedDict
+
+
+# Newer versions of tornado can stream request bodies through a `body_producer`, with older
+# versions we have to hand over the whole body at once.
+STREAMING_SUPPORTED = 'body_producer' in inspect.getargspec(
+    tornado.httpclient.HTTPRequest.__init__).args
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def file_size(file_object):
+    """Determine how much data is left to read from a file object"""
+    start = file_object.tell()
     try:
-        from requests.packages import urllib3
-    except ImportError:
-        urllib3 = None
+        return os.fstat(file_object.fileno()).st_size - start
+    except (AttributeError, IOError, OSError):
+        file_object.seek(0, os.SEEK_END)
+        size = file_object.tell() - start
+        file_object.seek(start)
+        return size
+
+
+class MultipartEncoder(object):
+    """Encodes form fields and files as multipart/form-data, without reading the files
+    into memory.
+
+    The length of the body is known up front, from the size of the files. The
+    body itself can be read in chunks, either by iterating over the encoder
+    or through `body_producer` for tornado's streaming requests. Each pass
+    starts the files back where they were when the encoder was built, so the
+    body can be sent again for retries.
+    """
+    def __init__(self, fields, files, boundary=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+
+        # Each part is either a string, or a (file object, start, length) tuple
+        self.parts = []
+        for name, value in fields.iteritems():
+            if not isinstance(value, basestring):
+                value = str(value)
+
+            self.parts.append(self._part_header(name) + utf8(value) + "\r\n")
+
+        for ndx, (file_name, file_object) in enumerate(files):
+            content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+            self.parts.append(self._part_header('file_%d' % ndx, file_name, content_type))
+            self.parts.append((file_object, file_object.tell(), file_size(file_object)))
+            self.parts.append("\r\n")
+
+        self.parts.append("--%s--\r\n" % self.boundary)
+
+        self.content_length = sum(
+            len(part) if isinstance(part, str) else part[2] for part in self.parts)
 
+    def _part_header(self, name, file_name=None, content_type=None):
+        disposition = 'form-data; name="%s"' % utf8(name)
+        if file_name is not None:
+            disposition += '; filename="%s"' % utf8(file_name)
 
-class Form(dict):
+        lines = ["--%s" % self.boundary, "Content-Disposition: %s" % disposition]
+        if content_type is not None:
+            lines.append("Content-Type: %s" % content_type)
+
+        return "\r\n".join(lines) + "\r\n\r\n"
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, str):
+                yield part
+                continue
+
+            file_object, start, length = part
+            file_object.seek(start)
+            while length > 0:
+                chunk = file_object.read(min(self.chunk_size, length))
+                if not chunk:
+                    raise IOError("File %r was truncated while encoding" % file_object)
+
+                length -= len(chunk)
+                yield chunk
+
+    def read(self):
+        """Render the entire body"""
+        return "".join(self)
+
+    @tornado.gen.coroutine
+    def body_producer(self, write):
+        for chunk in self:
+            yield write(chunk)
+
+
+class Form(VersionedDict):
     """Dictionary like object that handles form data.
 
     Note that we DO NOT support multiple values for the same name as you can for query strings.
     This is because RFC 2388 indicates you can't.
+
+    Files are only read as the request is sent, see `MultipartEncoder`.
     """
 
     def __init__(self):
         self._files = []
 
-    def add_file(self, file_name, file_object):
-        if urllib3 is None:
-            raise NotImplementedError
+    def copy(self):
+        form = Form()
+        form.update(self)
+        form._files = list(self._files)
+        return form
 
+    def add_file(self, file_name, file_object):
         self._files.append((file_name, file_object))
+        self.version += 1
+
+    @property
+    def has_files(self):
+        return bool(self._files)
+
+    def get_encoder(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        return MultipartEncoder(self, self._files, chunk_size=chunk_size)
 
     def get_value(self, content_type=None):
         if content_type is None:
@@ -43,11 +149,8 @@ class Form(dict):
 
         if (content_type is None and self._files) \
                 or (content_type and content_type.startswith("multipart/form-data")):
-            fields = self.copy()
-            for ndx, (file_name, file_object) in enumerate(self._files):
-                fields['file_%d' % ndx] = (file_name, file_object.read())
-
-            value, content_type = urllib3.filepost.encode_multipart_formdata(fields)
+            encoder = self.get_encoder()
+            value, content_type = encoder.read(), encoder.content_type
         elif content_type.startswith('application/x-www-form-urlencoded'):
             value = urllib.urlencode(self)
         elif content_type.startswith('application/json'):
@@ -0,0 +1,233 @@
+"""
+tclient.metrics
+~~~~~~~~
+
+This module provides hooks for instrumenting batches of requests, along with
+a couple of built-in aggregators:
+
+    latency = tclient.metrics.LatencyHistogram()
+    stats = tclient.metrics.BatchStats()
+    responses = tclient.fetch_all(requests, hooks=[latency, stats])
+
+    print latency.percentile(0.99), stats.wall_time, stats.max_in_flight
+
+When no hooks are installed, all a batch pays is an `is None` check at each
+point a hook would be called.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import bisect
+import collections
+import time
+import urlparse
+
+from .utils import request_size
+
+
+class Hooks(object):
+    """Base class for hooks into a batch's requests. Override whichever you need.
+
+    All hooks are called on the batch's io loop.
+    """
+    def on_batch_start(self, batch):
+        pass
+
+    def on_dispatch(self, ndx, request, queue_time):
+        """The request is being handed to the http client for the first time"""
+        pass
+
+    def on_retry(self, ndx, request, response, attempts, delay):
+        """The request failed with `response`, and will be sent again after `delay`"""
+        pass
+
+    def on_timeout(self, ndx, request):
+        """The request missed it's deadline, either while in flight or still queued"""
+        pass
+
+    def on_response(self, ndx, response):
+        """Final response for a request that was sent, including `queue_time`, `attempts`,
+        and the client's `request_time` and `time_info`"""
+        pass
+
+    def on_batch_finish(self, batch):
+        pass
+
+
+class HookList(Hooks):
+    """Calls each of a list of hooks in turn"""
+    def __init__(self, hooks):
+        self.hooks = list(hooks)
+
+    def on_batch_start(self, batch):
+        for hook in self.hooks:
+            hook.on_batch_start(batch)
+
+    def on_dispatch(self, ndx, request, queue_time):
+        for hook in self.hooks:
+            hook.on_dispatch(ndx, request, queue_time)
+
+    def on_retry(self, ndx, request, response, attempts, delay):
+        for hook in self.hooks:
+            hook.on_retry(ndx, request, response, attempts, delay)
+
+    def on_timeout(self, ndx, request):
+        for hook in self.hooks:
+            hook.on_timeout(ndx, request)
+
+    def on_response(self, ndx, response):
+        for hook in self.hooks:
+            hook.on_response(ndx, response)
+
+    def on_batch_finish(self, batch):
+        for hook in self.hooks:
+            hook.on_batch_finish(batch)
+
+
+def build_hooks(hooks):
+    """Accept a single `Hooks`, a list of them, or None"""
+    if hooks is None or isinstance(hooks, Hooks):
+        return hooks
+    return HookList(hooks)
+
+
+# Upper bounds, in seconds, for the histogram buckets. Each doubling from 100us up
+# to ~105s is split into 16 equal buckets, so a bucket is never more than ~6% wide.
+LATENCY_SUB_BUCKETS = 16
+LATENCY_BUCKETS = [0.0001 * 2 ** power * (1 + float(sub) / LATENCY_SUB_BUCKETS)
+                   for power in range(20) for sub in range(1, LATENCY_SUB_BUCKETS + 1)]
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for ndx, count in enumerate(other.counts):
+            self.counts[ndx] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        """Estimate of the percentile, interpolated within the bucket it falls in"""
+        if not self.count:
+            return None
+
+        target = fraction * self.count
+        seen = 0
+        for ndx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                break
+
+        # Nothing was smaller than the smallest value we saw, or bigger than the biggest
+        lower = max(LATENCY_BUCKETS[ndx - 1] if ndx else 0.0, self.min)
+        upper = min(LATENCY_BUCKETS[ndx] if ndx < len(LATENCY_BUCKETS) else self.max, self.max)
+        return lower + (upper - lower) * (target - (seen - count)) / count
+
+
+class LatencyHistogram(Hooks):
+    """Latency histograms per (host, status code)
+
+    Args:
+        phase - None for the whole `request_time`, or a key from the client's
+            `time_info` (like 'connect' or 'starttransfer' for curl) to only
+            track that phase.
+    """
+    def __init__(self, phase=None):
+        self.phase = phase
+        self.histograms = collections.defaultdict(Histogram)
+
+    def on_response(self, ndx, response):
+        if self.phase is None:
+            value = response.request_time
+        else:
+            value = (response.time_info or {}).get(self.phase)
+
+        if value is not None:
+            host = urlparse.urlparse(response.request.url).netloc
+            self.histograms[(host, response.code)].add(value)
+
+    def get(self, host=None, code=None):
+        """Combined histogram for everything matching the host and code"""
+        combined = Histogram()
+        for (hist_host, hist_code), histogram in self.histograms.iteritems():
+            if (host is None or host == hist_host) and (code is None or code == hist_code):
+                combined.merge(histogram)
+        return combined
+
+    def percentile(self, fraction, host=None, code=None):
+        return self.get(host, code).percentile(fraction)
+
+
+class BatchStats(Hooks):
+    """Totals across every batch the hooks were installed for"""
+    def __init__(self):
+        self.batches = 0
+        self.wall_time = 0.0
+        self.requests = 0
+        self.responses = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.bytes_saved = 0
+        self.queue_time = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._start_times = {}
+
+    def on_batch_start(self, batch):
+        self.batches += 1
+        self._start_times[id(batch)] = time.time()
+
+    def on_dispatch(self, ndx, request, queue_time):
+        self.requests += 1
+        self.queue_time += queue_time
+        self.bytes_out += request_size(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def on_retry(self, ndx, request, response, attempts, delay):
+        self.retries += 1
+        self.bytes_out += request_size(request)
+
+    def on_timeout(self, ndx, request):
+        self.timeouts += 1
+
+    def on_response(self, ndx, response):
+        self.responses += 1
+        self.in_flight -= 1
+        if response.body_size is not None:
+            self.bytes_in += response.body_size
+        elif response.buffer is not None:
+            self.bytes_in += len(response.body)
+
+    def on_batch_finish(self, batch):
+        start_time = self._start_times.pop(id(batch), None)
+        if start_time is not None:
+            self.wall_time += time.time() - start_time
+        self.bytes_saved += getattr(batch, 'bytes_saved', 0)
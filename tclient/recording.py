@@ -0,0 +1,343 @@
+"""
+tclient.recording
+~~~~~~~~
+
+This module provides recording of requests and their responses to a JSONL
+file, and replaying them later, either as `tclient.test.MockClient` fixtures
+or against a real (presumably local) server.
+
+    recorder = tclient.recording.Recorder('traffic.jsonl')
+    responses = tclient.fetch_all(requests, hooks=recorder)
+    recorder.close()
+
+    # Later, at twice the recorded pace
+    tclient.recording.replay(tclient.recording.iter_records('traffic.jsonl'),
+                             base_url='http://localhost:8888', speed=2.0)
+
+Each line is one request and it's response. Bodies that aren't valid UTF-8
+are stored base64 encoded.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import base64
+import collections
+import functools
+import io
+import json
+import logging
+import time
+import urlparse
+
+import tornado.httpclient
+import tornado.ioloop
+import tornado.stack_context
+from tornado import httputil
+
+from . import core
+from .metrics import Hooks
+from .request import Request
+
+
+log = logging.getLogger(__name__)
+
+# Methods tornado insists on having a body for
+BODY_METHODS = frozenset(['POST', 'PUT', 'PATCH'])
+
+# Requests in flight when replaying as fast as possible, unless told otherwise
+REPLAY_CONCURRENCY = 100
+
+
+def encode_body(body):
+    """Encode a body for JSON, returning (body, encoding)"""
+    if body is None:
+        return None, None
+
+    try:
+        return body.decode('utf-8'), None
+    except UnicodeDecodeError:
+        return base64.b64encode(body), 'base64'
+
+
+def decode_body(body, encoding):
+    if body is None:
+        return None
+    elif encoding == 'base64':
+        return base64.b64decode(body)
+    else:
+        return body.encode('utf-8')
+
+
+def header_list(headers):
+    if headers is None:
+        return []
+    elif isinstance(headers, httputil.HTTPHeaders):
+        return list(headers.get_all())
+    else:
+        return headers.items()
+
+
+def build_headers(header_list):
+    headers = httputil.HTTPHeaders()
+    for name, value in header_list:
+        headers.add(name, value)
+    return headers
+
+
+def build_record(response, now=None):
+    """Build the record for a response (and the request it's for)"""
+    now = now or time.time()
+    request = response.request
+
+    request_body, request_encoding = encode_body(request.body)
+    response_body = None
+    response_encoding = None
+    if response.buffer is not None and getattr(response, 'body_path', None) is None:
+        response_body, response_encoding = encode_body(response.body)
+
+    error = None
+    if response.error is not None:
+        error = str(response.error)
+
+    return {
+        'start': now - (response.request_time or 0.0),
+        'request': {
+            'method': request.method,
+            'url': request.url,
+            'headers': header_list(request.headers),
+            'body': request_body,
+            'body_encoding': request_encoding,
+        },
+        'response': {
+            'code': response.code,
+            'headers': header_list(response.headers),
+            'body': response_body,
+            'body_encoding': response_encoding,
+            'error': error,
+            'request_time': response.request_time,
+            'time_info': response.time_info,
+            'queue_time': getattr(response, 'queue_time', None),
+            'attempts': getattr(response, 'attempts', 1),
+        },
+    }
+
+
+def build_request(record, base_url=None):
+    """Build a `Request` from a record, optionally sending it to another server"""
+    request_record = record['request']
+
+    url = request_record['url']
+    if base_url is not None:
+        parts = urlparse.urlsplit(url)
+        base = urlparse.urlsplit(base_url)
+        url = urlparse.urlunsplit((base.scheme, base.netloc, parts.path, parts.query, ''))
+
+    headers = build_headers(request_record['headers'])
+    body = decode_body(request_record['body'], request_record.get('body_encoding'))
+    method = request_record['method'].upper()
+    if body is None and method in BODY_METHODS:
+        body = ''
+
+    # The Host header would send us to the recorded server, whatever the url says
+    if base_url is not None and 'Host' in headers:
+        del headers['Host']
+
+    return Request(url, method=method, headers=headers, body=body)
+
+
+def build_response(request, record):
+    """Build the recorded response for a request"""
+    response_record = record['response']
+    code = response_record['code']
+
+    error = None
+    if response_record['error'] is not None and code == 599:
+        error = tornado.httpclient.HTTPError(599, response_record['error'])
+
+    body = decode_body(response_record['body'], response_record.get('body_encoding'))
+    return tornado.httpclient.HTTPResponse(
+        request, code, headers=build_headers(response_record['headers']),
+        buffer=io.BytesIO(body) if body is not None else None, error=error,
+        request_time=response_record['request_time'],
+        time_info=response_record['time_info'] or {})
+
+
+def iter_records(path):
+    """Read records from a file, one at a time"""
+    with open(path, 'rb') as record_file:
+        for line in record_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Recorder(Hooks):
+    """Hooks recording each response (and it's request) as a line in a file
+
+    Records are appended as responses arrive, and flushed at the end of each batch.
+
+    Args:
+        target - Path of the file to append to, or a file object
+    """
+    def __init__(self, target):
+        if isinstance(target, basestring):
+            self.file = open(target, 'ab')
+            self.owns_file = True
+        else:
+            self.file = target
+            self.owns_file = False
+
+        self.count = 0
+
+    def on_response(self, ndx, response):
+        self.file.write(json.dumps(build_record(response)) + "\n")
+        self.count += 1
+
+    def on_batch_finish(self, batch):
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+        if self.owns_file:
+            self.file.close()
+
+
+def install_fixtures(client, records):
+    """Answer requests through a `tclient.test.MockClient` with recorded responses
+
+    Requests are matched by method and url. If there's more than one
+    response for a request, they're used in turn, and the last one repeats.
+    Unlike replaying, the records are all held in memory.
+    """
+    recorded = collections.defaultdict(collections.deque)
+    for record in records:
+        request_record = record['request']
+        recorded[(request_record['method'].upper(), request_record['url'])].append(record)
+
+    def handle_request(request):
+        queue = recorded.get((request.method.upper(), request.url))
+        if not queue:
+            log.warning("No recorded response for %s %s", request.method, request.url)
+            return client.build_response(request, code=404)
+
+        record = queue.popleft() if len(queue) > 1 else queue[0]
+        return build_response(request, record)
+
+    client.handle(r'.*', handle_request)
+    return recorded
+
+
+def replay(records, base_url=None, speed=1.0, on_response=None, **kwargs):
+    """Send recorded requests again, returning how many were sent
+
+    Records are read lazily, so any number of them can be replayed. They're
+    sent at the pace they were recorded, sped up by `speed`. With `speed` as
+    None, they're sent as fast as possible through `tclient.fetch_iter`
+    (which takes the rest of the arguments, like `max_concurrency`). Only
+    `REPLAY_CONCURRENCY` requests are in flight at a time by default.
+
+    Args:
+        records - Iterable of records, like from `iter_records`
+        base_url - Scheme and host to send requests to, rather than the recorded ones
+        on_response - Called with each record and the new response
+    """
+    if speed is None:
+        kwargs.setdefault('max_concurrency', REPLAY_CONCURRENCY)
+        records, requests = _tee_requests(records, base_url)
+        count = 0
+        for ndx, response in core.fetch_iter(requests, **kwargs):
+            count += 1
+            if on_response is not None:
+                on_response(records[ndx], response)
+            del records[ndx]
+        return count
+
+    loop = tornado.ioloop.IOLoop()
+    client = core.build_client(loop)
+    try:
+        return PacedReplay(loop, client, records, base_url=base_url, speed=speed,
+                           on_response=on_response).run()
+    finally:
+        core.close_loop(loop, client)
+
+
+def _tee_requests(records, base_url):
+    """Build requests lazily, keeping each record around until it's response is back"""
+    pending = {}
+
+    def iter_requests():
+        for ndx, record in enumerate(records):
+            pending[ndx] = record
+            yield build_request(record, base_url)
+
+    return pending, iter_requests()
+
+
+class PacedReplay(object):
+    """Sends records on an io loop at the pace they were recorded
+
+    Only one record is ever waiting to be sent, so we never read ahead.
+    """
+    def __init__(self, loop, client, records, base_url=None, speed=1.0, on_response=None):
+        self.loop = loop
+        self.client = client
+        self.records = iter(records)
+        self.base_url = base_url
+        self.speed = speed
+        self.on_response = on_response
+
+        self.sent = 0
+        self.in_flight = 0
+        self.exhausted = False
+        self.exc_info = None
+
+        self._recorded_start = None
+        self._replay_start = None
+
+    def run(self):
+        self.loop.add_callback(self._schedule_next)
+        self.loop.start()
+
+        # Did we encounter any exceptions?
+        if self.exc_info:
+            exc_info = self.exc_info
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return self.sent
+
+    def handle_exception(self, *exc_info):
+        log.error("Exception encountered during replay")
+        if self.exc_info is None:
+            self.exc_info = exc_info
+        self.loop.stop()
+
+    def _schedule_next(self):
+        record = next(self.records, None)
+        if record is None:
+            self.exhausted = True
+            if not self.in_flight:
+                self.loop.stop()
+            return
+
+        if self._recorded_start is None:
+            self._recorded_start = record['start']
+            self._replay_start = time.time()
+
+        send_time = self._replay_start + (record['start'] - self._recorded_start) / self.speed
+        self.loop.add_timeout(max(send_time, time.time()), functools.partial(self._send, record))
+
+    def _send(self, record):
+        self.sent += 1
+        self.in_flight += 1
+        with tornado.stack_context.ExceptionStackContext(self.handle_exception):
+            self.client.fetch(build_request(record, self.base_url),
+                              callback=functools.partial(self._handle_response, record))
+        self._schedule_next()
+
+    def _handle_response(self, record, response):
+        self.in_flight -= 1
+        if self.on_response is not None:
+            self.on_response(record, response)
+
+        if self.exhausted and not self.in_flight:
+            self.loop.stop()
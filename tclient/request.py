@@ -9,12 +9,27 @@ This module provides the Request class, which is how we build http requests.
 
 """
 import urllib
-import json
 
 import tornado.httpclient
+from tornado import httputil
 from tornado.escape import utf8
 
+from . import codec as json_codec
+from . import form
 from .form import Form
+from .stream import BodySink
+from .utils import VersionedDict
+
+
+def copy_headers(headers):
+    """Copy headers, keeping every value for headers that appear more than once"""
+    if not isinstance(headers, httputil.HTTPHeaders):
+        return httputil.HTTPHeaders(headers)
+
+    copied = httputil.HTTPHeaders()
+    for name, value in headers.get_all():
+        copied.add(name, value)
+    return copied
 
 
 class Request(tornado.httpclient.HTTPRequest):
@@ -44,12 +59,54 @@ class Request(tornado.httpclient.HTTPRequest):
         req.form['name'] = "my name"
         req.form.add_file("plan", open("~/.plan"))
 
+    Where tornado supports it, forms with files are streamed through
+    `body_producer` rather than read into memory. The body is None in that case,
+    but the Content-Length header is set from the size of the files.
+
+    Dictionary bodies are encoded as JSON when they're set, using the request's
+    `codec` if set, or the default from `tclient.codec`. They're encoded again
+    if a different codec is picked later. A batch's codec is only applied to
+    the copy of the request it sends.
+
+    The rendered url and body are cached, and only rendered again once the
+    url, `params`, body or form change.
+
+    Large response bodies can be sent somewhere other than memory with
+    `stream_to`, which takes a path, a file object or a callable to be handed
+    each chunk. Use `max_body_size` to abort requests with bodies larger than
+    you're willing to handle. See `tclient.stream.BodySink`.
+
+        req = tclient.Request('http://localhost:8888/export', stream_to='/tmp/export.csv')
+
+    In batches with compression turned on, `compress` picks the encoding for
+    this request's body, or False to send it as it is. See `tclient.compression`.
+
+    For building lots of similar requests, set up one request as a template
+    and `derive` the others from it (or `expand` it into a whole batch).
     """
     def __init__(self, url, **kwargs):
         body = None
         if 'body' in kwargs:
             body = kwargs.pop('body')
 
+        self._body_producer = None
+        self._encoder = None
+        self._streaming_callback = None
+        self._stream_to = kwargs.pop('stream_to', None)
+        self._max_body_size = kwargs.pop('max_body_size', None)
+        self._sink = None
+        self._build_sink()
+        self._json_body = None
+        self._json_codec = None
+        self._form = None
+        self._form_version = None
+        self._params = VersionedDict()
+        self._url_key = None
+        self._url = None
+        self._headers_shared = False
+        self.codec = kwargs.pop('codec', None)
+        self.compress = kwargs.pop('compress', None)
+
         super(Request, self).__init__(None, **kwargs)
 
         self.url = url
@@ -57,15 +114,16 @@ class Request(tornado.httpclient.HTTPRequest):
         if body is not None:
             self.body = body
 
-        self.params = {}
-        self._form = None
-
     def get_url(self):
+        url_key = (self._url_base, self._params.version)
+        if url_key == self._url_key:
+            return self._url
+
         url = self._url_base
 
         # Note we use this as a hook for doing extra 'pre-render' type operations
-        if self.params:
-            query = urllib.urlencode(self.params)
+        if self._params:
+            query = urllib.urlencode(self._params)
             if '?' in url:
                 url += '&'
             else:
@@ -73,8 +131,76 @@ class Request(tornado.httpclient.HTTPRequest):
 
             url += query
 
+        self._url_key = url_key
+        self._url = url
         return url
 
+    @property
+    def headers(self):
+        # Headers shared with the request we were derived from are copied before
+        # anybody gets a chance to change them.
+        if self._headers_shared:
+            self._headers = copy_headers(self._headers)
+            self._headers_shared = False
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value if value is not None else httputil.HTTPHeaders()
+        self._headers_shared = False
+
+    def derive(self, url=None, params=None, headers=None, **kwargs):
+        """Build a new request based on this one, without going through __init__
+
+        `params` and `headers` are added to copies of ours, and any other
+        request attributes (like `body` or `request_timeout`) replace ours. The
+        headers themselves are shared until either request accesses them.
+        """
+        # Apply any change of codec once here, rather than in every request.
+        if self._json_body is not None:
+            self.body
+
+        req = self.__class__.__new__(self.__class__)
+        req.__dict__.update(self.__dict__)
+
+        req._params = VersionedDict(self._params)
+        if params:
+            req._params.update(params)
+        req._url_key = None
+
+        # Both of us have to copy the headers before changing them
+        self._headers_shared = True
+        req._headers_shared = True
+        if headers:
+            req.headers.update(headers)
+
+        if self._form is not None:
+            req._form = self._form.copy()
+        req._encoder = None
+        req._form_version = None
+        req._build_sink()
+
+        if url is not None:
+            req.url = url
+        for name, value in kwargs.iteritems():
+            setattr(req, name, value)
+
+        return req
+
+    def expand(self, param_rows):
+        """Derive a request for each dictionary of params"""
+        return [self.derive(params=params) for params in param_rows]
+
+    @property
+    def params(self):
+        return self._params
+
+    @params.setter
+    def params(self, value):
+        # Changes to a plain dict can't be tracked, so we keep our own copy
+        self._params = value if isinstance(value, VersionedDict) else VersionedDict(value)
+        self._url_key = None
+
     @property
     def url(self):
         return self.get_url()
@@ -83,22 +209,130 @@ class Request(tornado.httpclient.HTTPRequest):
     def url(self, value):
         self._url_base = value
 
+    def _check_form(self):
+        """Throw away anything rendered from our form if it's changed since"""
+        if self._form_version is not None and self._form_version != self._form.version:
+            if self._encoder is None:
+                self._body = None
+            self._encoder = None
+            self._form_version = None
+
+    def get_encoder(self):
+        """Returns the `MultipartEncoder` for streaming our form, if we should be streaming it"""
+        if self._form is not None:
+            self._check_form()
+
+        if self._encoder is None and form.STREAMING_SUPPORTED and self._body is None \
+                and self._form is not None and self._form.has_files:
+            self._encoder = self._form.get_encoder()
+            self._form_version = self._form.version
+            self.headers['Content-Type'] = self._encoder.content_type
+            self.headers['Content-Length'] = str(self._encoder.content_length)
+
+        return self._encoder
+
     @property
     def body(self):
-        if self._body is None and self._form is not None:
-            self._body, self.headers['Content-Type'] = self._form.get_value()
-            return self._body
+        if self._json_body is not None and self.codec is not None \
+                and self.codec is not self._json_codec:
+            self._body = utf8(self.codec.dumps(self._json_body))
+            self._json_codec = self.codec
+
+        if self._form is not None:
+            self._check_form()
 
-        return utf8(self._body)
+            if self._body is None:
+                if self.get_encoder() is not None:
+                    return None
+
+                body, self.headers['Content-Type'] = self._form.get_value()
+                self._body = utf8(body)
+                self._form_version = self._form.version
+
+        return self._body
 
     @body.setter
     def body(self, value):
         if isinstance(value, dict):
-            self._body = json.dumps(value)
-            if 'Content-Type' not in self.headers:
+            # Keep our own copy in case it has to be encoded again, the caller may
+            # well reuse theirs for the next request.
+            self._json_body = dict(value)
+            self._json_codec = self.codec or json_codec.get_default()
+            self._body = utf8(self._json_codec.dumps(value))
+            # Checked without copying headers we're sharing, they usually have it already
+            if 'Content-Type' not in self._headers:
                 self.headers['Content-Type'] = 'application/json'
         else:
-            self._body = value
+            self._body = utf8(value)
+            self._json_body = None
+            self._json_codec = None
+
+        self._encoder = None
+        self._form_version = None
+
+    @property
+    def body_size(self):
+        """Size of the body, avoiding reading files into memory for multipart forms"""
+        if self._form is not None:
+            self._check_form()
+
+        if self._body is None and self._json_body is None and self._form is not None \
+                and self._form.has_files:
+            return (self._encoder or self._form.get_encoder()).content_length
+
+        body = self.body
+        return body and len(body) or 0
+
+    @property
+    def body_producer(self):
+        if self._body_producer is None:
+            encoder = self.get_encoder()
+            if encoder is not None:
+                return encoder.body_producer
+
+        return self._body_producer
+
+    @body_producer.setter
+    def body_producer(self, value):
+        self._body_producer = value
+
+    def _build_sink(self):
+        if self._stream_to is not None or self._max_body_size is not None:
+            self._sink = BodySink(self._stream_to, self._max_body_size)
+        else:
+            self._sink = None
+
+    @property
+    def body_sink(self):
+        return self._sink
+
+    @property
+    def stream_to(self):
+        return self._stream_to
+
+    @stream_to.setter
+    def stream_to(self, value):
+        self._stream_to = value
+        self._build_sink()
+
+    @property
+    def max_body_size(self):
+        return self._max_body_size
+
+    @max_body_size.setter
+    def max_body_size(self, value):
+        self._max_body_size = value
+        self._build_sink()
+
+    @property
+    def streaming_callback(self):
+        if self._sink is not None:
+            return self._sink.write
+        return self._streaming_callback
+
+    @streaming_callback.setter
+    def streaming_callback(self, value):
+        self._streaming_callback = value
 
     @property
     def form(self):
@@ -1,23 +1,259 @@
-import json
+import cStringIO
+import copy
+import mmap
 
 from tornado import httpclient
+from tornado import httputil
 
+from . import codec as json_codec
+from .errors import BodyTooLarge
+
+# How much of a streamed body to read at a time when decoding it incrementally
+ITER_CHUNK_SIZE = 64 * 1024
+
+# What a `CompactResponse` can keep, from the most to the least
+COMPACT_KEEP = ('body', 'headers', 'status')
+
+
+class BodyMixin(object):
+    """Ways of getting at the body shared by `Response` and `CompactResponse`"""
+    __slots__ = ()
+
+    def body_view(self):
+        """A `memoryview` of the body, for slicing it up without copying
+
+        For large bodies streamed to a file see `body_mmap`.
+        """
+        body = self.body
+        return memoryview(body) if body is not None else None
+
+    def body_mmap(self):
+        """Memory map a body that was streamed to a file, rather than reading it all in"""
+        if not self.body_size:
+            return None
+
+        with open(self.body_path, 'rb') as body_file:
+            return mmap.mmap(body_file.fileno(), 0, access=mmap.ACCESS_READ)
 
-class Response(httpclient.HTTPResponse):
     @property
     def json(self):
         try:
             return self._json
         except AttributeError:
-            self._json = json.loads(self.body)
+            self._json = (self.codec or json_codec.get_default()).loads(self.body)
             return self._json
 
+    def iter_json(self):
+        """Decode the items of a JSON array body one at a time
+
+        For huge arrays this avoids building the whole list, and for bodies
+        streamed to a file, reading the whole file in.
+        """
+        if self.body_path is not None and self._body is None:
+            with open(self.body_path, 'rb') as body_file:
+                chunks = iter(lambda: body_file.read(ITER_CHUNK_SIZE), '')
+                for item in json_codec.iter_json_array(chunks):
+                    yield item
+        else:
+            for item in json_codec.iter_json_array([self.body]):
+                yield item
+
+
+# HTTPResponse has to come first so plain responses can be converted in place,
+# see `from_response`
+class Response(httpclient.HTTPResponse, BodyMixin):
+    # How long the request waited in our own queue before being handed to the http client.
+    # Note that `request_time` doesn't include this.
+    queue_time = None
+
+    # Number of times the request was sent before we got this response
+    attempts = 1
+
+    # Set when this response was shared from an identical request in the same batch, rather
+    # than making a request of it's own.
+    coalesced = False
+
+    # Set when this response came from a `tclient.Cache` (including after revalidating
+    # it with the server)
+    from_cache = False
+
+    # For requests using `stream_to`, where the body ended up. See `tclient.stream.BodySink`
+    body_path = None
+    body_size = None
+
+    # JSON codec for decoding the body, if not the default. See `tclient.codec`
+    codec = None
+
+    @property
+    def body(self):
+        if self.body_path is not None:
+            if self._body is None:
+                with open(self.body_path, 'rb') as body_file:
+                    self._body = body_file.read()
+            return self._body
+
+        if self._body is None and self.buffer is not None:
+            self._body = self.buffer.getvalue()
+            # The buffer holds a copy of its own, swap it for one reading from our string
+            self.buffer = cStringIO.StringIO(self._body)
+
+        return self._body
+
+    def copy_for(self, request):
+        """Build a copy of this response for another identical request
+
+        The copy shares our headers and body rather than copying them. Decoded
+        JSON can be changed by whoever has it, so the copy decodes it's own.
+        """
+        # Make sure the body is loaded once here rather than by each copy.
+        self.body
+
+        resp = copy.copy(self)
+        resp.__dict__.pop('_json', None)
+        resp.request = request
+        resp.coalesced = True
+        return resp
+
+    def compact(self, keep='body'):
+        """Build a `CompactResponse` from this one, keeping only what `keep` says"""
+        if keep not in COMPACT_KEEP:
+            raise ValueError("Unknown compact mode %r" % keep)
+
+        resp = CompactResponse(self.request, self.code, error=self.error,
+                               request_time=self.request_time)
+        resp.queue_time = self.queue_time
+        resp.attempts = self.attempts
+        resp.coalesced = self.coalesced
+        resp.from_cache = self.from_cache
+        resp.codec = self.codec
+
+        if keep != 'status':
+            resp.headers = self.headers
+        if keep == 'body':
+            if self.body_path is not None:
+                resp.body_path = self.body_path
+                resp.body_size = self.body_size
+            else:
+                resp._body = self.body
+            if hasattr(self, '_json'):
+                resp._json = self._json
+
+        # Errors for bad status codes hold on to their response
+        if getattr(resp.error, 'response', None) is self:
+            resp.error.response = resp
+
+        return resp
+
     @classmethod
-    def from_response(self, response):
-        return Response(response.request, response.code,
-                        headers=response.headers,
-                        buffer=response.buffer,
-                        effective_url=response.effective_url,
-                        error=response.error,
-                        request_time=response.request_time,
-                        time_info=response.time_info)
+    def from_response(cls, response):
+        """Adopt a response from the http client as a `Response`
+
+        Plain `HTTPResponse` objects are converted in place, rather than
+        copying their headers and body, so the client's response is changed
+        (and it's `request` replaced by the batch). A response that's already
+        been adopted gets a new object instead, so the same response handed
+        back for two requests doesn't end up shared between them.
+        """
+        if getattr(response, '_adopted', False):
+            resp = None
+        elif isinstance(response, cls):
+            resp = response
+        elif type(response) is httpclient.HTTPResponse:
+            response.__class__ = cls
+            resp = response
+        else:
+            resp = None
+
+        if resp is None:
+            resp = cls(response.request, response.code,
+                       headers=response.headers,
+                       buffer=response.buffer,
+                       effective_url=response.effective_url,
+                       error=response.error,
+                       request_time=response.request_time,
+                       time_info=response.time_info)
+            resp.from_cache = getattr(response, 'from_cache', False)
+        resp._adopted = True
+
+        sink = getattr(response.request, 'body_sink', None)
+        if sink is not None:
+            sink.finish()
+            resp.body_size = sink.size
+            resp.body_path = sink.path
+            if sink.buffer is not None:
+                resp.buffer = sink.buffer
+            if sink.exceeded:
+                resp.error = BodyTooLarge(
+                    "Response body larger than %d bytes" % sink.max_body_size)
+
+        return resp
+
+
+class CompactResponse(BodyMixin):
+    """A `Response` cut down to a fixed set of attributes, for huge batches
+
+    Built by `Response.compact`. Depending on what was kept, `body` or both
+    `body` and `headers` may be None. There's no `time_info`, and the
+    `effective_url` is always the request's url.
+    """
+    __slots__ = ('request', 'code', 'headers', 'error', 'request_time', 'queue_time',
+                 'attempts', 'coalesced', 'from_cache', 'codec', 'body_path', 'body_size',
+                 '_body', '_json')
+
+    def __init__(self, request, code, headers=None, body=None, error=None, request_time=None):
+        self.request = request
+        self.code = code
+        self.headers = headers
+        self._body = body
+        self.error = error
+        self.request_time = request_time
+        self.queue_time = None
+        self.attempts = 1
+        self.coalesced = False
+        self.from_cache = False
+        self.codec = None
+        self.body_path = None
+        self.body_size = None
+
+    @property
+    def reason(self):
+        return httputil.responses.get(self.code, "Unknown")
+
+    @property
+    def effective_url(self):
+        return self.request.url
+
+    @property
+    def time_info(self):
+        return {}
+
+    @property
+    def body(self):
+        if self._body is None and self.body_path is not None:
+            with open(self.body_path, 'rb') as body_file:
+                self._body = body_file.read()
+        return self._body
+
+    @property
+    def buffer(self):
+        body = self.body
+        return cStringIO.StringIO(body) if body is not None else None
+
+    def rethrow(self):
+        if self.error:
+            raise self.error
+
+    def copy_for(self, request):
+        resp = CompactResponse(request, self.code, headers=self.headers, body=self._body,
+                               error=self.error, request_time=self.request_time)
+        resp.queue_time = self.queue_time
+        resp.attempts = self.attempts
+        resp.coalesced = True
+        resp.from_cache = self.from_cache
+        resp.codec = self.codec
+        resp.body_path = self.body_path
+        resp.body_size = self.body_size
+        return resp
+
+    def __repr__(self):
+        return "%s(code=%r, url=%r)" % (self.__class__.__name__, self.code, self.request.url)
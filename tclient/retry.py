@@ -0,0 +1,137 @@
+"""
+tclient.retry
+~~~~~~~~
+
+This module provides the RetryPolicy class, which decides if and when a failed
+request should be tried again.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import math
+import random
+import time
+
+import tornado.httpclient
+
+from .utils import parse_http_date
+
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+
+DEFAULT_RETRY_CODES = frozenset([500, 502, 503, 504, 599])
+
+
+def parse_retry_after(value):
+    """Parse the value of a Retry-After header into a number of seconds from now"""
+    if value is None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    date = parse_http_date(value)
+    if date is None:
+        return None
+
+    return max(0.0, date - time.time())
+
+
+class RetryPolicy(object):
+    """Decides which failed requests to retry, and how long to wait before doing so.
+
+    Args:
+        max_retries - Maximum number of retries for any single request
+        backoff - Delay before the first retry. Each retry after that doubles it.
+        max_backoff - Largest delay we'll ever wait between attempts
+        jitter - Randomize delays (between 0 and the backoff) so retries from
+            a batch don't all land on the backend at once
+        retry_codes - HTTP status codes to retry. None retries any error.
+        retry_exceptions - Exception types (other than HTTP errors) to retry
+        methods - HTTP methods that are safe to retry. None allows any method.
+        respect_retry_after - Wait as long as the server's Retry-After header asks
+        max_retry_after - Don't retry at all if the server asks us to wait longer than this
+        budget - Fraction of the batch we're willing to send again as retries,
+            e.g. 0.1 means at most 10% extra requests.
+
+    The defaults only retry idempotent requests, on server errors and connection failures.
+    """
+    def __init__(self, max_retries=3, backoff=0.1, max_backoff=10.0, jitter=True,
+                 retry_codes=DEFAULT_RETRY_CODES, retry_exceptions=(IOError,),
+                 methods=IDEMPOTENT_METHODS, respect_retry_after=True, max_retry_after=60.0,
+                 budget=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_codes = retry_codes
+        self.retry_exceptions = retry_exceptions
+        self.methods = methods
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+
+    @classmethod
+    def from_retries(cls, retries):
+        """Build a policy for the simple `retries=N` style argument.
+
+        This retries any error, for any method, right away.
+        """
+        return cls(max_retries=retries, backoff=0, jitter=False, retry_codes=None,
+                   methods=None, respect_retry_after=False)
+
+    def is_retryable(self, response):
+        if not response.error:
+            return False
+
+        if self.methods is not None and response.request.method.upper() not in self.methods:
+            return False
+
+        if self.retry_codes is None:
+            return True
+
+        if isinstance(response.error, tornado.httpclient.HTTPError):
+            return response.error.code in self.retry_codes
+
+        return isinstance(response.error, self.retry_exceptions)
+
+    def get_backoff(self, attempts):
+        if not self.backoff:
+            return 0.0
+
+        delay = min(self.max_backoff, self.backoff * (2 ** (attempts - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+
+        return delay
+
+    def retry_delay(self, response, attempts):
+        """Decide whether to retry a failed response
+
+        Returns the number of seconds to wait before trying again, or None if
+        the request shouldn't be retried.
+        """
+        if attempts > self.max_retries or not self.is_retryable(response):
+            return None
+
+        delay = self.get_backoff(attempts)
+
+        if self.respect_retry_after:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                if retry_after > self.max_retry_after:
+                    return None
+
+                delay = max(delay, retry_after)
+
+        return delay
+
+    def budget_allows(self, retries, requests):
+        """Is there room in the budget for another retry, given how many retries and
+        requests we've already made?"""
+        if self.budget is None:
+            return True
+
+        return retries < math.ceil(self.budget * requests)
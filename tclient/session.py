@@ -0,0 +1,120 @@
+"""
+tclient.session
+~~~~~~~~
+
+This module provides the Session class, which keeps an io loop and http client
+around so they can be reused across many batches of requests.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import logging
+
+import tornado.ioloop
+
+from . import core
+
+
+log = logging.getLogger(__name__)
+
+# Connections that took less time than this (in seconds) to establish after the
+# name lookup are taken to be reused. For a reused connection curl marks the
+# connect time right after the lookup, while even a new loopback connection
+# has a TCP handshake to wait on.
+REUSE_CONNECT_TIME = 0.00001
+
+
+class Session(object):
+    """Reusable io loop and http client
+
+    `tclient.fetch_all` builds (and tears down) a new loop and client for every
+    call. If you're making lots of calls against the same backends, a Session
+    lets the http client keep connections alive between batches:
+
+        session = tclient.Session()
+        responses = session.fetch_all([req1, req2], timeout=30)
+        ...
+        session.close()
+
+    Requests that miss their deadline are sent with a `request_timeout` that
+    matches it, so the client itself gives up on the connection the next time
+    the session's loop runs.
+
+    Connection reuse requires an http client that supports keep-alive, such as
+    tornado's CurlAsyncHTTPClient.
+
+    We also keep a count of how many connections were opened vs. reused. curl
+    doesn't report this directly, so it's estimated from the time between the
+    name lookup and the connection being ready (see `REUSE_CONNECT_TIME`).
+    Clients that don't report timing info (like tornado's simple client, which
+    never reuses connections) will have every request counted as opening a
+    connection.
+
+    Responses can be cached across batches by providing a `tclient.Cache`, and
+    a JSON codec can be set for all our batches with `codec`. `hooks` from
+    `tclient.metrics` are installed for every batch.
+    """
+    def __init__(self, cache=None, codec=None, hooks=None):
+        self.loop = tornado.ioloop.IOLoop()
+        self.client = core.build_client(self.loop, cache=cache)
+        self.codec = codec
+        self.hooks = hooks
+
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def record_response(self, response):
+        if getattr(response, 'from_cache', False):
+            return
+
+        connect_time = response.time_info.get('connect')
+        if connect_time is not None \
+                and connect_time - response.time_info.get('namelookup', 0.0) < REUSE_CONNECT_TIME:
+            self.connections_reused += 1
+        else:
+            self.connections_opened += 1
+
+    def fetch_all(self, requests, **kwargs):
+        """Fetch all provided requests
+
+        Works just like `tclient.fetch_all` (and takes the same arguments), but
+        using this session's loop and client.
+        """
+        log.debug("Starting session fetch_all with %d requests", len(requests))
+        kwargs.setdefault('codec', self.codec)
+        kwargs.setdefault('hooks', self.hooks)
+        return core.run_all(
+            self.loop, self.client, requests, on_response=self.record_response, **kwargs)
+
+    def fetch_iter(self, requests, **kwargs):
+        """Fetch all provided requests, yielding (index, response) pairs as they complete
+
+        See `tclient.fetch_iter`
+        """
+        kwargs.setdefault('codec', self.codec)
+        kwargs.setdefault('hooks', self.hooks)
+        return core.iter_all(
+            self.loop, self.client, requests, on_response=self.record_response, **kwargs)
+
+    def fetch_segmented(self, requests, **kwargs):
+        """Fetch all provided requests, split up into segments
+
+        See `tclient.fetch_segmented`
+        """
+        kwargs.setdefault('codec', self.codec)
+        kwargs.setdefault('hooks', self.hooks)
+        return core.run_segmented(
+            self.loop, self.client, requests, on_response=self.record_response, **kwargs)
+
+    def fetch(self, request, **kwargs):
+        return self.fetch_all([request], **kwargs)[0]
+
+    def close(self):
+        core.close_loop(self.loop, self.client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,234 @@
+"""
+tclient.sharding
+~~~~~~~~
+
+This module provides fetch_sharded, which splits a very large batch of
+requests across worker processes, each running it's own io loop.
+
+Workers are forked, so requests never have to be pickled. Responses are sent
+back over a pipe, as they complete, in a compact form built from plain
+tuples, and reassembled in the order of the requests. Hooks are called in
+the parent, from events the workers send back over the same pipe.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import io
+import logging
+import marshal
+import multiprocessing
+import select
+import traceback
+
+import tornado.httpclient
+from tornado import httputil
+
+from . import core
+from .errors import BodyTooLarge, ShardFailed
+from .metrics import Hooks, build_hooks
+from .response import Response
+
+
+log = logging.getLogger(__name__)
+
+# Arguments that limit concurrency, which are split up between the workers
+SPLIT_LIMITS = ('max_concurrency', 'max_per_host')
+
+
+def pack_response(ndx, resp):
+    """Convert a response into a tuple of builtin types that marshal can handle"""
+    error = None
+    if resp.error is not None:
+        message = resp.error.message if isinstance(resp.error, tornado.httpclient.HTTPError) \
+            else str(resp.error)
+        error = (type(resp.error).__name__, message)
+
+    if isinstance(resp.headers, httputil.HTTPHeaders):
+        header_list = list(resp.headers.get_all())
+    else:
+        header_list = (resp.headers or {}).items()
+
+    body = None
+    if resp.body_path is None and resp.buffer is not None:
+        body = resp.body
+
+    return (ndx, resp.code, header_list, body, resp.effective_url, error,
+            resp.request_time, dict(resp.time_info or {}), resp.queue_time, resp.attempts,
+            resp.coalesced, resp.from_cache, resp.body_path, resp.body_size,
+            hasattr(resp, '_json'), getattr(resp, '_json', None))
+
+
+def unpack_response(request, packed):
+    """Build a `Response` for the request from a tuple made by `pack_response`"""
+    (_, code, header_list, body, effective_url, error, request_time, time_info, queue_time,
+     attempts, coalesced, from_cache, body_path, body_size, decoded, json_value) = packed
+
+    headers = httputil.HTTPHeaders()
+    for name, value in header_list:
+        headers.add(name, value)
+
+    if error is not None:
+        error_type, message = error
+        if error_type == BodyTooLarge.__name__:
+            error = BodyTooLarge(message)
+        else:
+            error = tornado.httpclient.HTTPError(code, message)
+
+    resp = Response(request, code, headers=headers,
+                    buffer=io.BytesIO(body) if body is not None else None,
+                    effective_url=effective_url, error=error, request_time=request_time,
+                    time_info=time_info)
+    resp.queue_time = queue_time
+    resp.attempts = attempts
+    resp.coalesced = coalesced
+    resp.from_cache = from_cache
+    resp.body_path = body_path
+    resp.body_size = body_size
+    if decoded:
+        resp._json = json_value
+
+    return resp
+
+
+class ForwardingHooks(Hooks):
+    """Worker side hooks, sending each event back to the parent to call the real hooks
+
+    Responses are sent back anyway, and the parent covers the batch starting
+    and finishing.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def on_dispatch(self, ndx, request, queue_time):
+        self.conn.send_bytes(marshal.dumps(('dispatch', ndx, queue_time)))
+
+    def on_retry(self, ndx, request, response, attempts, delay):
+        error = str(response.error) if response.error is not None else None
+        self.conn.send_bytes(marshal.dumps(
+            ('retry', ndx, response.code, error, attempts, delay)))
+
+    def on_timeout(self, ndx, request):
+        self.conn.send_bytes(marshal.dumps(('timeout', ndx)))
+
+
+def call_hook(hooks, request, ndx, packed):
+    """Call the hook for an event sent by `ForwardingHooks`"""
+    if packed[0] == 'dispatch':
+        hooks.on_dispatch(ndx, request, packed[2])
+    elif packed[0] == 'retry':
+        _, _, code, error, attempts, delay = packed
+        if error is not None:
+            error = tornado.httpclient.HTTPError(code, error)
+        hooks.on_retry(ndx, request, Response(request, code, error=error), attempts, delay)
+    elif packed[0] == 'timeout':
+        hooks.on_timeout(ndx, request)
+
+
+class ShardedBatch(object):
+    """Stands in for the batch when the parent calls `on_batch_start` and `on_batch_finish`"""
+    def __init__(self, requests, processes):
+        self.requests = requests
+        self.processes = processes
+
+
+def run_shard(conn, requests, kwargs):
+    """Worker process: fetch our share of the requests, sending each response back
+    as it completes"""
+    if kwargs.get('hooks') is not None:
+        kwargs = dict(kwargs, hooks=ForwardingHooks(conn))
+
+    try:
+        for ndx, resp in core.fetch_iter(requests, **kwargs):
+            conn.send_bytes(marshal.dumps(pack_response(ndx, resp)))
+    except Exception:
+        conn.send_bytes(marshal.dumps(('error', traceback.format_exc())))
+    finally:
+        conn.close()
+
+
+def fetch_sharded(requests, processes=None, **kwargs):
+    """Fetch all provided requests, split up between worker processes
+
+    For very large batches, a single loop ends up limited by the CPU rather
+    than the network. This forks `processes` (by default, one per CPU)
+    workers, each fetching every Nth request with `tclient.fetch_iter`.
+
+    Takes the same arguments as `fetch_all`. `max_concurrency` and
+    `max_per_host` are divided up between the workers, so they still limit
+    the batch as a whole. Anything else, like a cache, is per worker, except
+    `hooks`, which are called in this process.
+
+    Responses are returned in the same order as the requests. With `compact`,
+    workers only send back what's kept.
+    """
+    processes = min(processes or multiprocessing.cpu_count(), len(requests))
+    if processes <= 1:
+        return core.fetch_all(requests, **kwargs)
+
+    for name in SPLIT_LIMITS:
+        if kwargs.get(name) is not None:
+            kwargs[name] = max(1, kwargs[name] // processes)
+
+    log.debug("Starting fetch_sharded with %d requests in %d processes",
+              len(requests), processes)
+
+    hooks = build_hooks(kwargs.get('hooks'))
+    batch = ShardedBatch(requests, processes)
+    if hooks is not None:
+        hooks.on_batch_start(batch)
+
+    responses = [None] * len(requests)
+    workers = {}
+    try:
+        for shard in range(processes):
+            indexes = range(shard, len(requests), processes)
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            worker = multiprocessing.Process(
+                target=run_shard, name='tclient-shard-%d' % shard,
+                args=(send_conn, [requests[ndx] for ndx in indexes], kwargs))
+            worker.daemon = True
+            worker.start()
+            send_conn.close()
+            workers[recv_conn.fileno()] = (recv_conn, worker, indexes)
+
+        while workers:
+            readable, _, _ = select.select(list(workers), [], [])
+            for fileno in readable:
+                conn, worker, indexes = workers[fileno]
+                try:
+                    packed = marshal.loads(conn.recv_bytes())
+                except EOFError:
+                    del workers[fileno]
+                    conn.close()
+                    worker.join()
+                    if worker.exitcode:
+                        raise ShardFailed("Worker %s exited with %d" % (
+                            worker.name, worker.exitcode))
+                    continue
+
+                if packed[0] == 'error':
+                    raise ShardFailed("Worker %s failed:\n%s" % (worker.name, packed[1]))
+
+                if isinstance(packed[0], str):
+                    ndx = indexes[packed[1]]
+                    call_hook(hooks, requests[ndx], ndx, packed)
+                    continue
+
+                ndx = indexes[packed[0]]
+                resp = unpack_response(requests[ndx], packed)
+                if hooks is not None:
+                    hooks.on_response(ndx, resp)
+                if kwargs.get('compact') is not None:
+                    resp = resp.compact(kwargs['compact'])
+                responses[ndx] = resp
+    finally:
+        for conn, worker, _ in workers.itervalues():
+            conn.close()
+            worker.terminate()
+            worker.join()
+
+    if hooks is not None:
+        hooks.on_batch_finish(batch)
+
+    return responses
@@ -0,0 +1,95 @@
+"""
+tclient.stream
+~~~~~~~~
+
+This module provides the BodySink class, which receives response bodies
+through tornado's `streaming_callback` so they don't have to be held in memory.
+
+:copyright: (c) 2013 by Rhett Garber.
+:license: ISC, see LICENSE for more details.
+
+"""
+import io
+
+from .errors import BodyTooLarge
+
+
+class BodySink(object):
+    """Destination for a streamed response body
+
+    The target can be:
+
+        None - The body is kept in memory, but only up to `max_body_size`
+        a path - The body is written to the file, which is replaced on each attempt
+        a file object - The body is written to it
+        a callable - Called with each chunk of the body
+
+    If the body grows larger than `max_body_size` we raise `BodyTooLarge`,
+    which aborts the request.
+    """
+    def __init__(self, target=None, max_body_size=None):
+        self.target = target
+        self.max_body_size = max_body_size
+
+        self.size = 0
+        self.exceeded = False
+        self.started = False
+
+        self.buffer = None
+        self._file = None
+        self._file_start = None
+        if hasattr(target, 'write'):
+            try:
+                self._file_start = target.tell()
+            except (AttributeError, IOError):
+                pass
+
+    @property
+    def path(self):
+        if isinstance(self.target, basestring):
+            return self.target
+        return None
+
+    def start(self):
+        """Get ready to receive a new body, discarding anything from earlier attempts"""
+        self.size = 0
+        self.exceeded = False
+        self.started = True
+
+        if self.target is None:
+            self.buffer = io.BytesIO()
+        elif self.path is not None:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'wb')
+        elif self._file_start is not None:
+            self.target.seek(self._file_start)
+            self.target.truncate()
+
+    def write(self, chunk):
+        if not self.started:
+            self.start()
+
+        self.size += len(chunk)
+        if self.max_body_size is not None and self.size > self.max_body_size:
+            self.exceeded = True
+            raise BodyTooLarge("Response body larger than %d bytes" % self.max_body_size)
+
+        if self.buffer is not None:
+            self.buffer.write(chunk)
+        elif self._file is not None:
+            self._file.write(chunk)
+        elif callable(self.target):
+            self.target(chunk)
+        else:
+            self.target.write(chunk)
+
+    def finish(self):
+        """The body is complete, make sure it's all written out"""
+        self.started = False
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif hasattr(self.target, 'flush'):
+            self.target.flush()
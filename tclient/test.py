@@ -9,12 +9,16 @@ This module provides tools helpful for testing with tclient
 
 """
 
+import functools
+import io
 import logging
+import random
 import re
 import json
 import urlparse
 
 import tornado.httpclient
+import tornado.ioloop
 from . import core
 
 
@@ -36,6 +40,109 @@ def clear_test_client():
     core._CLIENT = None
 
 
+# Python's re module won't compile a pattern with more groups than this
+MAX_GROUPS = 99
+
+# Patterns that can't be merged with others: inline flags apply to the whole
+# pattern, back references are numbered from the start of it, group names
+# have to be unique across it, and anchors (other than a leading ^) would
+# anchor to the start of the dispatch key rather than the path.
+UNMERGEABLE_RE = re.compile(r'\\[1-9]|\(\?P[=<]|\(\?[iLmsux]|\\A|(?<![\\\[])\^')
+
+# Flags of a pattern compiled without any. Patterns compiled with flags of their
+# own can't be merged either, the flags would be lost.
+DEFAULT_FLAGS = re.compile('').flags
+
+
+class Route(object):
+    __slots__ = ('regex', 'callback', 'method', 'host', 'latency', 'jitter')
+
+    def __init__(self, regex, callback, method=None, host=None, latency=None, jitter=0.0):
+        self.regex = re.compile(regex)
+        self.callback = callback
+        self.method = method.upper() if method is not None else None
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def mergeable(self):
+        pattern = self.regex.pattern
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+
+        return not UNMERGEABLE_RE.search(pattern) and self.regex.flags == DEFAULT_FLAGS \
+            and self.regex.groups < MAX_GROUPS
+
+    @property
+    def dispatch_pattern(self):
+        """Pattern matching against a 'METHOD host path' dispatch key"""
+        pattern = self.regex.pattern
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+
+        return "%s %s (?:%s)" % (
+            re.escape(self.method) if self.method is not None else "[^ ]*",
+            re.escape(self.host) if self.host is not None else "[^ ]*",
+            pattern)
+
+    def matches(self, method, host, path):
+        return (self.method is None or self.method == method) \
+            and (self.host is None or self.host == host) \
+            and self.regex.match(path) is not None
+
+
+class RouteGroup(object):
+    """Routes merged into a single alternation, matched in one go"""
+    def __init__(self, routes):
+        self.routes = []
+        self.group_routes = {}
+
+        patterns = []
+        group_ndx = 1
+        for route in routes:
+            patterns.append("(%s)" % route.dispatch_pattern)
+            self.group_routes[group_ndx] = route
+            group_ndx += 1 + route.regex.groups
+
+        self.regex = re.compile("|".join(patterns))
+
+    def match(self, key):
+        match = self.regex.match(key)
+        if match is None:
+            return None
+
+        # The group wrapping each route is the last to close, whatever groups it contains
+        return self.group_routes[match.lastindex]
+
+
+def build_route_groups(routes):
+    """Merge routes into as few groups as we can, keeping them in order"""
+    groups = []
+    pending = []
+    pending_groups = 0
+
+    for route in routes:
+        if not route.mergeable:
+            if pending:
+                groups.append(RouteGroup(pending))
+                pending, pending_groups = [], 0
+            groups.append(route)
+            continue
+
+        if pending and pending_groups + route.regex.groups + 1 > MAX_GROUPS:
+            groups.append(RouteGroup(pending))
+            pending, pending_groups = [], 0
+
+        pending.append(route)
+        pending_groups += route.regex.groups + 1
+
+    if pending:
+        groups.append(RouteGroup(pending))
+
+    return groups
+
+
 class MockClient(object):
     """Simple HTTP Client Mock implementation.
 
@@ -43,14 +150,24 @@ class MockClient(object):
 
         resp = yield tornado.gen.Task(self.api_client, request)
 
-    In your test fixture, you can register responses for certain calls, like:
+    In your test fixture, you can register handlers for paths, like:
+
+        client.handle(r'/test', lambda r: client.build_response(r))
 
-        self.service_client.put(request, response)
+    Routes are tried in the order they were registered, and can be limited to a
+    method or host. Registered routes are merged into a few big regular
+    expressions, so lots of routes doesn't mean lots of matching.
 
+    To exercise timeouts and concurrency limits, responses can be delayed by
+    `latency` seconds (plus up to `jitter` more) on the io loop, either for all
+    routes or for just one.
     """
 
-    def __init__(self):
+    def __init__(self, latency=None, jitter=0.0):
         self.routes = []
+        self.latency = latency
+        self.jitter = jitter
+        self._groups = None
 
     def build_response(self, request, code=200, error=None, headers=None):
         if headers is None:
@@ -60,42 +177,84 @@ class MockClient(object):
             request, code, error=error, headers=headers)
         return resp
 
-    def fetch(self, request, **kwargs):
-        for reg, callback in self.routes:
-            path = urlparse.urlparse(request.url).path
-            if reg.match(path):
-                response_data = callback(request)
-
-                if isinstance(response_data, str):
-                    response = self.build_response(request)
-                    #response.buffer = StringIO.StringIO(response_data)
-                    response.buffer = "<data>"
-                    response._body = response_data
-                elif isinstance(response_data, dict):
-                    response = self.build_response(request)
-                    #response.buffer = StringIO.StringIO(json.dumps(response_data))
-                    response.buffer = "<data>"
-                    response._body = json.dumps(response_data)
-                else:
-                    response = response_data
-
-                break
+    def find_route(self, method, host, path):
+        if self._groups is None:
+            self._groups = build_route_groups(self.routes)
+
+        key = "%s %s %s" % (method, host, path)
+        for group in self._groups:
+            if isinstance(group, Route):
+                if group.matches(method, host, path):
+                    return group
+            else:
+                route = group.match(key)
+                if route is not None:
+                    return route
+
+        return None
+
+    def fetch(self, request, callback=None, io_loop=None, **kwargs):
+        url = urlparse.urlparse(request.url)
+        route = self.find_route(request.method.upper(), url.netloc, url.path)
+
+        if route is not None:
+            response_data = route.callback(request)
+
+            if isinstance(response_data, str):
+                response = self.build_response(request)
+                response.buffer = io.BytesIO(response_data)
+            elif isinstance(response_data, dict):
+                response = self.build_response(request)
+                response.buffer = io.BytesIO(json.dumps(response_data))
+            else:
+                response = response_data
         else:
             log.warning("No response for %s", str(request.url))
             response = self.build_response(request, code=404)
 
-        if 'callback' in kwargs:
-            if response is None:
-                log.warning("No response, somebody else must call callback")
-                return None
-            else:
-                kwargs['callback'](response)
-                return None
-        else:
+        if callback is None:
             return response
 
-    def handle(self, regex, callback):
-        self.routes.append((re.compile(regex), callback))
+        if response is None:
+            log.warning("No response, somebody else must call callback")
+            return None
+
+        latency, jitter = self.latency, self.jitter
+        if route is not None and route.latency is not None:
+            latency, jitter = route.latency, route.jitter
+
+        if latency is None:
+            callback(response)
+        else:
+            delay = latency + (random.uniform(0, jitter) if jitter else 0.0)
+            if response.request_time is None:
+                response.request_time = delay
+            io_loop = io_loop or tornado.ioloop.IOLoop.current()
+            io_loop.add_timeout(io_loop.time() + delay, functools.partial(callback, response))
+
+        return None
+
+    def handle(self, regex, callback, method=None, host=None, latency=None, jitter=0.0):
+        self.routes.append(Route(regex, callback, method=method, host=host, latency=latency,
+                                 jitter=jitter))
+        self._groups = None
+
+    def bind(self, io_loop):
+        """Client for running requests on a specific io loop"""
+        return BoundClient(self, io_loop)
+
+    def close(self):
+        pass
+
+
+class BoundClient(object):
+    """MockClient that delivers delayed responses on a specific io loop"""
+    def __init__(self, client, io_loop):
+        self.client = client
+        self.io_loop = io_loop
+
+    def fetch(self, request, callback=None, **kwargs):
+        return self.client.fetch(request, callback=callback, io_loop=self.io_loop, **kwargs)
 
     def close(self):
         pass
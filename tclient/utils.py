@@ -11,35 +11,200 @@ that are also useful for external consumption.
 :license: ISC, see LICENSE for more details.
 
 """
+import email.utils
 
 
-def segment_requests(requests, max_bytes=None, max_length=None):
-    """Split up requests so that no chunk is larger than the specified size
+def parse_http_date(value):
+    """Parse an HTTP date header value into a unix timestamp, or None if it's invalid"""
+    if not value:
+        return None
 
-    Args:
-        requests - list of requests to split up
-        max_bytes - Maximum size for any segment of requests
-        max_length - Maximum number of requests for any segment
-    """
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+
+    return email.utils.mktime_tz(date)
+
+
+class VersionedDict(dict):
+    """Dictionary that counts changes to it, so anything rendered from it can be cached"""
+    version = 0
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return dict.setdefault(self, key, default)
 
-    out_chunks = []
-    requests_queue = requests[:]
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
 
+
+def request_size(request):
+    """Size of the request's body, without rendering it where we can avoid it"""
+    body_size = getattr(request, 'body_size', None)
+    if isinstance(body_size, (int, long)):
+        return body_size
+
+    body = request.body
+    return body and len(body) or 0
+
+
+def _iter_greedy_segments(sized_items, max_bytes=None, max_length=None):
+    """Split up (item, size) pairs, in order, yielding lists of items for each segment"""
     current_bytes = 0
     current_chunk = []
-    while requests_queue:
-        req = requests_queue.pop(0)
+    for item, size in sized_items:
+        if current_chunk and max_bytes is not None and current_bytes + size > max_bytes:
+            yield current_chunk
+            current_bytes = 0
+            current_chunk = []
 
-        current_bytes += req.body and len(req.body) or 0
-        current_chunk.append(req)
+        current_bytes += size
+        current_chunk.append(item)
 
-        if (max_bytes is not None and current_bytes > max_bytes) \
-                or (max_length is not None and len(current_chunk) >= max_length):
+        if max_length is not None and len(current_chunk) >= max_length:
+            yield current_chunk
             current_bytes = 0
-            out_chunks.append(current_chunk)
             current_chunk = []
+
+    if current_chunk:
+        yield current_chunk
+
+
+def iter_segment_indices(sizes, max_bytes=None, max_length=None):
+    """Split up a sequence of sizes, in order, yielding lists of indexes for each segment
+
+    A segment only exceeds `max_bytes` if a single item is larger than that by itself.
+    """
+    return _iter_greedy_segments(
+        ((ndx, size) for ndx, size in enumerate(sizes)), max_bytes, max_length)
+
+
+def pack_segment_indices(sizes, max_bytes, max_length=None):
+    """Pack sizes into as few segments as we can, using first-fit decreasing
+
+    Returns lists of indexes for each segment. Within a segment, indexes are
+    kept in their original order.
+    """
+    order = sorted(xrange(len(sizes)), key=lambda ndx: sizes[ndx], reverse=True)
+
+    # A segment tree of the room left in each bin, so finding the first bin with
+    # enough room takes log(n) rather than scanning all of them.
+    leaves = 1
+    while leaves < max(len(sizes), 1):
+        leaves *= 2
+    room = [-1] * (2 * leaves)
+
+    bins = []
+    bin_lengths = []
+
+    def set_room(bin_ndx, value):
+        pos = bin_ndx + leaves
+        room[pos] = value
+        pos //= 2
+        while pos:
+            room[pos] = max(room[2 * pos], room[2 * pos + 1])
+            pos //= 2
+
+    for ndx in order:
+        size = sizes[ndx]
+
+        if room[1] >= size:
+            # Walk down to the left-most bin with enough room
+            pos = 1
+            while pos < leaves:
+                pos = 2 * pos if room[2 * pos] >= size else 2 * pos + 1
+            bin_ndx = pos - leaves
+        else:
+            bin_ndx = len(bins)
+            bins.append([])
+            bin_lengths.append(0)
+            room[bin_ndx + leaves] = max_bytes
+
+        bins[bin_ndx].append(ndx)
+        bin_lengths[bin_ndx] += 1
+
+        if max_length is not None and bin_lengths[bin_ndx] >= max_length:
+            set_room(bin_ndx, -1)
+        else:
+            # Oversized items end up alone in a bin with no room left
+            set_room(bin_ndx, max(room[bin_ndx + leaves] - size, -1))
+
+    for indexes in bins:
+        indexes.sort()
+
+    return bins
+
+
+def segment_indices(requests, max_bytes=None, max_length=None, packing='greedy'):
+    """Split up requests, returning lists of indexes into `requests` for each segment
+
+    See `segment_requests`
+    """
+    if packing == 'greedy':
+        if max_bytes is None:
+            sizes = (0 for _ in requests)
+        else:
+            sizes = (request_size(req) for req in requests)
+        return iter_segment_indices(sizes, max_bytes=max_bytes, max_length=max_length)
+    elif packing == 'ffd':
+        if max_bytes is None:
+            return segment_indices(requests, max_length=max_length)
+        return pack_segment_indices(
+            [request_size(req) for req in requests], max_bytes, max_length=max_length)
     else:
-        if current_chunk:
-            out_chunks.append(current_chunk)
+        raise ValueError("Unknown packing %r" % packing)
 
-    return out_chunks
+
+def iter_segments(requests, max_bytes=None, max_length=None):
+    """Split up requests, in order, yielding each segment as we go
+
+    Requests can be any iterable, and are only consumed as segments are
+    needed. See `segment_requests`.
+    """
+    if max_bytes is None:
+        sized_requests = ((req, 0) for req in requests)
+    else:
+        sized_requests = ((req, request_size(req)) for req in requests)
+
+    return _iter_greedy_segments(sized_requests, max_bytes, max_length)
+
+
+def segment_requests(requests, max_bytes=None, max_length=None, packing='greedy'):
+    """Split up requests so that no chunk is larger than the specified size
+
+    Args:
+        requests - list of requests to split up
+        max_bytes - Maximum size for any segment of requests. Only a single request
+            larger than this will end up in a segment that exceeds it.
+        max_length - Maximum number of requests for any segment
+        packing - 'greedy' keeps requests in order, starting a new segment when the
+            current one is full. 'ffd' (first-fit decreasing) reorders requests to
+            minimize the number of segments.
+
+    Request sizes come from `Request.body_size`, which avoids rendering bodies
+    (like reading files for multipart forms) where it can.
+    """
+    return [[requests[ndx] for ndx in indexes]
+            for indexes in segment_indices(requests, max_bytes=max_bytes,
+                                           max_length=max_length, packing=packing)]
@@ -0,0 +1,112 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_raises,
+    assert_true)
+
+import threading
+
+import tornado.ioloop
+
+from tclient import background
+from tclient import core
+from tclient import request
+from tests.test_core import TestClientMixin, DelayedClient, FetchError
+
+
+class BackgroundClientTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        if req.url.endswith('/error'):
+            raise FetchError('here')
+        return self.client.build_response(req)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    @setup
+    def build_background(self):
+        self.background = background.BackgroundClient()
+
+    @teardown
+    def close_background(self):
+        self.background.close()
+
+    def test_submit_all(self):
+        requests = [request.Request("/foo/%d" % ndx) for ndx in range(3)]
+        responses = self.background.submit_all(requests).result(timeout=5)
+        assert_equal([resp.request for resp in responses], requests)
+        assert_true(all(resp.code == 200 for resp in responses))
+
+    def test_submit(self):
+        resp = self.background.submit(request.Request("/foo")).result(timeout=5)
+        assert_equal(resp.code, 200)
+
+    def test_exception(self):
+        future = self.background.submit(request.Request("/error"))
+        with assert_raises(FetchError):
+            future.result(timeout=5)
+
+    def test_threads(self):
+        results = []
+
+        def run():
+            reqs = [request.Request("/foo/%d" % ndx) for ndx in range(10)]
+            results.append(self.background.submit_all(reqs).result(timeout=5))
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_equal(len(results), 8)
+        assert_true(all(len(responses) == 10 for responses in results))
+
+    def test_closed(self):
+        self.background.close()
+        with assert_raises(RuntimeError):
+            self.background.submit(request.Request("/foo"))
+
+
+class LimitedClientTest(TestCase):
+    @setup
+    def build_client(self):
+        self.loop = tornado.ioloop.IOLoop()
+        self.delayed = DelayedClient(self.loop)
+        self.client = background.LimitedClient(self.delayed, 3)
+
+    @teardown
+    def close_loop(self):
+        self.loop.close()
+
+    def test(self):
+        requests = [request.Request("http://host/%d" % ndx) for ndx in range(10)]
+
+        # Across separate batches
+        futures = [core.start_all(self.loop, self.client, requests[:5]),
+                   core.start_all(self.loop, self.client, requests[5:])]
+        responses = self.loop.run_sync(lambda: futures[1])
+        responses = futures[0].result() + responses
+
+        assert_equal([resp.request for resp in responses], requests)
+        assert_equal(self.delayed.max_in_flight[None], 3)
+        assert_equal(self.client.in_flight, 0)
+
+    def test_expired(self):
+        self.delayed.delays['http://host/slow'] = 0.2
+        self.client.max_concurrency = 1
+        slow = core.start_all(self.loop, self.client, [request.Request("http://host/slow")])
+
+        requests = [request.Request("http://host/%d" % ndx) for ndx in range(3)]
+        responses = self.loop.run_sync(
+            lambda: core.start_all(self.loop, self.client, requests, timeout=0.05))
+        assert_equal([resp.code for resp in responses], [599] * 3)
+
+        # Once the slow request is done, the expired ones are dropped rather than sent
+        self.loop.run_sync(lambda: slow)
+        assert_equal(self.delayed.urls, ["http://host/slow"])
+        assert_equal(self.client.expired, 3)
+        assert_equal(self.client.in_flight, 0)
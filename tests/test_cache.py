@@ -0,0 +1,195 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_true)
+
+import io
+import shutil
+import tempfile
+
+import tornado.httpclient
+from tornado import httputil
+
+from tclient import cache
+from tclient import core
+from tclient import request
+from tests.test_core import TestClientMixin
+
+
+class FreshnessTest(TestCase):
+    def test_max_age(self):
+        headers = {'Cache-Control': 'public, max-age=60'}
+        assert_equal(cache.freshness_lifetime(headers, 0), 60)
+
+    def test_age(self):
+        headers = {'Cache-Control': 'max-age=60', 'Age': '50'}
+        assert_equal(cache.freshness_lifetime(headers, 0), 10)
+
+    def test_expires(self):
+        headers = {'Date': 'Wed, 21 Oct 2015 07:28:00 GMT',
+                   'Expires': 'Wed, 21 Oct 2015 07:38:00 GMT'}
+        assert_equal(cache.freshness_lifetime(headers, 0), 600)
+
+    def test_no_store(self):
+        headers = {'Cache-Control': 'no-store'}
+        assert_equal(cache.freshness_lifetime(headers, 0), None)
+
+    def test_no_cache(self):
+        headers = {'Cache-Control': 'no-cache, max-age=60'}
+        assert_equal(cache.freshness_lifetime(headers, 0), 0)
+
+
+class MemoryStoreTest(TestCase):
+    def build_entry(self, size):
+        return cache.CacheEntry(200, {}, 'x' * size, 0, ())
+
+    def test_lru(self):
+        store = cache.MemoryStore(10)
+        store.set('a', self.build_entry(4))
+        store.set('b', self.build_entry(4))
+        store.get('a')
+        store.set('c', self.build_entry(4))
+
+        assert_true(store.get('a') is not None)
+        assert_true(store.get('b') is None)
+        assert_true(store.get('c') is not None)
+        assert_equal(store.size, 8)
+
+    def test_too_big(self):
+        store = cache.MemoryStore(10)
+        store.set('a', self.build_entry(11))
+        assert_true(store.get('a') is None)
+        assert_equal(store.size, 0)
+
+
+class CacheTestMixin(TestClientMixin):
+    @setup
+    def build_cache(self):
+        self.calls = []
+        self.headers = {'Cache-Control': 'max-age=60'}
+        self.cache = cache.Cache()
+
+    def handle_request(self, req):
+        self.calls.append(req)
+        if req.headers.get('If-None-Match') == '"v1"':
+            return tornado.httpclient.HTTPResponse(
+                req, 304, headers=httputil.HTTPHeaders({'Cache-Control': 'max-age=60'}))
+
+        return tornado.httpclient.HTTPResponse(
+            req, 200, headers=httputil.HTTPHeaders(self.headers),
+            buffer=io.BytesIO('{"value": 10}'))
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+
+class CacheHitTest(CacheTestMixin, TestCase):
+    def test(self):
+        resp = core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_true(not resp.from_cache)
+
+        req = request.Request("/foo")
+        resp = core.fetch(req, cache=self.cache)
+
+        assert_equal(len(self.calls), 1)
+        assert_true(resp.from_cache)
+        assert_true(resp.request is req)
+        assert_equal(resp.code, 200)
+        assert_equal(resp.json['value'], 10)
+        assert_equal((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_not_get(self):
+        core.fetch(request.Request("/foo", method="POST", body="hi"), cache=self.cache)
+        core.fetch(request.Request("/foo", method="POST", body="hi"), cache=self.cache)
+        assert_equal(len(self.calls), 2)
+
+    def test_no_store(self):
+        self.headers = {'Cache-Control': 'no-store'}
+        core.fetch(request.Request("/foo"), cache=self.cache)
+        core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_equal(len(self.calls), 2)
+
+    def test_vary(self):
+        self.headers = {'Cache-Control': 'max-age=60', 'Vary': 'Accept'}
+        core.fetch(request.Request("/foo", headers={'Accept': 'text/plain'}), cache=self.cache)
+        core.fetch(request.Request("/foo", headers={'Accept': 'text/html'}), cache=self.cache)
+        assert_equal(len(self.calls), 2)
+
+        core.fetch(request.Request("/foo", headers={'Accept': 'text/html'}), cache=self.cache)
+        assert_equal(len(self.calls), 2)
+
+    def test_credentials(self):
+        core.fetch(request.Request("/foo", headers={'Authorization': 'alice'}), cache=self.cache)
+        resp = core.fetch(request.Request("/foo", headers={'Authorization': 'bob'}),
+                          cache=self.cache)
+        assert_true(not resp.from_cache)
+        assert_equal(len(self.calls), 2)
+
+        resp = core.fetch(request.Request("/foo", auth_username='bob', auth_password='pw'),
+                          cache=self.cache)
+        assert_true(not resp.from_cache)
+
+        resp = core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_true(not resp.from_cache)
+        assert_equal(len(self.calls), 4)
+
+        resp = core.fetch(request.Request("/foo", headers={'Authorization': 'alice'}),
+                          cache=self.cache)
+        assert_true(resp.from_cache)
+        assert_equal(len(self.calls), 4)
+
+    def test_refresh(self):
+        core.fetch(request.Request("/foo"), cache=self.cache)
+        for cache_control in ('no-cache', 'max-age=0'):
+            resp = core.fetch(request.Request("/foo", headers={'Cache-Control': cache_control}),
+                              cache=self.cache)
+            assert_true(not resp.from_cache)
+
+        assert_equal(len(self.calls), 3)
+
+        resp = core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_true(resp.from_cache)
+        assert_equal(len(self.calls), 3)
+
+
+class RevalidateTest(CacheTestMixin, TestCase):
+    def test(self):
+        self.headers = {'Cache-Control': 'no-cache', 'ETag': '"v1"'}
+        core.fetch(request.Request("/foo"), cache=self.cache)
+        resp = core.fetch(request.Request("/foo"), cache=self.cache)
+
+        assert_equal(len(self.calls), 2)
+        assert_equal(self.calls[1].headers['If-None-Match'], '"v1"')
+        assert_equal(resp.code, 200)
+        assert_true(resp.from_cache)
+        assert_equal(resp.json['value'], 10)
+        assert_equal(self.cache.revalidations, 1)
+
+        # The 304 made it fresh again
+        core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_equal(len(self.calls), 2)
+        assert_equal(self.cache.hits, 1)
+
+
+class DiskCacheTest(CacheTestMixin, TestCase):
+    @setup
+    def build_disk_cache(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = cache.Cache(path=self.path, disk_threshold=4)
+
+    @teardown
+    def remove_disk_cache(self):
+        shutil.rmtree(self.path)
+
+    def test(self):
+        core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_equal(self.cache.memory.size, 0)
+
+        # A new cache object should find it on disk
+        disk_cache = cache.Cache(path=self.path, disk_threshold=4)
+        resp = core.fetch(request.Request("/foo"), cache=disk_cache)
+        assert_equal(len(self.calls), 1)
+        assert_equal(resp.json['value'], 10)
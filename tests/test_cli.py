@@ -0,0 +1,122 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_true)
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import tornado.ioloop
+
+from tclient import cli
+from tclient import request
+
+
+class CLITestCase(TestCase):
+    @setup
+    def build_files(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmp_dir, 'requests.jsonl')
+        self.output_path = os.path.join(self.tmp_dir, 'responses.jsonl')
+
+        specs = [{'url': "http://host/%d" % ndx, 'params': {'n': ndx}} for ndx in range(10)]
+        specs.append({'method': "POST", 'url': "http://host/post", 'body': {'k': 1}})
+        with open(self.input_path, 'wb') as input_file:
+            for spec in specs:
+                input_file.write(json.dumps(spec) + "\n")
+            input_file.write("\n")
+
+    @teardown
+    def remove_files(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_output(self):
+        with open(self.output_path, 'rb') as output_file:
+            return [json.loads(line) for line in output_file]
+
+    def test(self):
+        cli.main([self.input_path, '-o', self.output_path, '--mock', '--quiet', '--bodies'])
+
+        results = self.read_output()
+        assert_equal(sorted(result['index'] for result in results), range(11))
+        by_index = dict((result['index'], result) for result in results)
+        assert_equal(by_index[3]['url'], "http://host/3?n=3")
+        assert_equal(by_index[10]['method'], "POST")
+        assert_true(all(result['code'] == 200 for result in results))
+        assert_equal(by_index[0]['body'], "")
+
+    def test_rate(self):
+        start = time.time()
+        cli.main([self.input_path, '-o', self.output_path, '--mock', '--quiet',
+                  '--rate', '200', '-c', '3', '--mock-latency', '0.001'])
+
+        # 11 requests at 200 a second
+        assert_true(time.time() - start >= 0.05)
+        assert_equal(len(self.read_output()), 11)
+
+
+class BuildRequestTestCase(TestCase):
+    def test_spec(self):
+        req = cli.build_request({'method': 'put', 'url': "http://host/", 'headers': {'X-A': '1'},
+                                 'body': u"text"})
+        assert_equal(req.method, "PUT")
+        assert_equal(req.headers['X-A'], '1')
+        assert_equal(req.body, "text")
+
+    def test_empty_post(self):
+        req = cli.build_request({'method': 'POST', 'url': "http://host/"})
+        assert_equal(req.body, "")
+
+
+class RateLimitedClientTestCase(TestCase):
+    @setup
+    def build_loop(self):
+        self.loop = tornado.ioloop.IOLoop()
+
+    @teardown
+    def close_loop(self):
+        self.loop.close()
+
+    def test(self):
+        sent = []
+
+        class Client(object):
+            def fetch(self, request, callback):
+                sent.append(time.time())
+                callback(None)
+
+        client = cli.RateLimitedClient(Client(), self.loop, 100)
+        for _ in range(5):
+            client.fetch(request.Request("http://host/"), callback=lambda resp: None)
+
+        self.loop.add_timeout(time.time() + 0.1, self.loop.stop)
+        self.loop.start()
+
+        assert_equal(len(sent), 5)
+        assert_true(sent[-1] - sent[0] >= 0.035)
+
+    def test_expired(self):
+        sent = []
+        codes = []
+
+        class Client(object):
+            def fetch(self, request, callback):
+                sent.append(request.request_timeout)
+                callback(None)
+
+        client = cli.RateLimitedClient(Client(), self.loop, 20)
+        for _ in range(3):
+            client.fetch(request.Request("http://host/", request_timeout=0.02),
+                         callback=lambda resp: codes.append(resp and resp.code))
+
+        self.loop.add_timeout(time.time() + 0.1, self.loop.stop)
+        self.loop.start()
+
+        # Only the first made it out before running out of time
+        assert_equal(len(sent), 1)
+        assert_equal(codes, [None, 599, 599])
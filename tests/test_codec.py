@@ -0,0 +1,106 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_raises,
+    turtle)
+
+import io
+import json
+
+from tclient import codec
+from tclient import core
+from tclient import request
+from tclient import response
+from tests.test_core import TestClientMixin
+
+
+class UpperCodec(codec.JSONCodec):
+    name = 'upper'
+
+    def dumps(self, value):
+        return json.dumps(value).upper()
+
+    def loads(self, data):
+        return {'decoded': json.loads(data)}
+
+
+class DefaultCodecTest(TestCase):
+    @teardown
+    def restore_default(self):
+        codec.set_default(codec.get('json'))
+
+    def test(self):
+        assert_equal(codec.get_default().name, 'json')
+        codec.set_default(UpperCodec())
+
+        req = request.Request("http://localhost:8888", method="POST")
+        req.body = {'msg': 'hi'}
+        assert_equal(req.body, '{"MSG": "HI"}')
+
+    def test_missing(self):
+        with assert_raises(ValueError):
+            codec.get('no such codec')
+
+
+class RequestCodecTest(TestCase):
+    def test(self):
+        req = request.Request("http://localhost:8888", method="POST", codec=UpperCodec())
+        req.body = {'msg': 'hi'}
+        assert_equal(req.body, '{"MSG": "HI"}')
+
+
+class BatchCodecTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        self.bodies.append(req.body)
+        resp = self.client.build_response(req)
+        resp.buffer = io.BytesIO('[1, 2]')
+        return resp
+
+    @setup
+    def setup_handlers(self):
+        self.bodies = []
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        req = request.Request("/foo", method="POST")
+        req.body = {'msg': 'hi'}
+
+        resp = core.fetch(req, codec=UpperCodec())
+        assert_equal(self.bodies, ['{"MSG": "HI"}'])
+        assert_equal(resp.json, {'decoded': [1, 2]})
+
+    def test_request_untouched(self):
+        req = request.Request("/foo", method="POST")
+        req.body = {'msg': 'hi'}
+
+        core.fetch(req, codec=UpperCodec())
+        assert_equal(req.codec, None)
+
+        # A later batch without a codec uses the default
+        core.fetch(req)
+        assert_equal(self.bodies, ['{"MSG": "HI"}', '{"msg": "hi"}'])
+
+
+class IterJSONArrayTest(TestCase):
+    def test(self):
+        data = json.dumps([1, 22, {'a': [3, 4]}, "five", 6.5, None])
+        chunks = [data[ndx:ndx + 3] for ndx in range(0, len(data), 3)]
+        assert_equal(list(codec.iter_json_array(chunks)), json.loads(data))
+
+    def test_empty(self):
+        assert_equal(list(codec.iter_json_array([' [ ] '])), [])
+
+    def test_not_array(self):
+        with assert_raises(ValueError):
+            list(codec.iter_json_array(['{"a": 1}']))
+
+    def test_truncated(self):
+        with assert_raises(ValueError):
+            list(codec.iter_json_array(['[1, 2, {"a"']))
+
+    def test_response(self):
+        resp = response.Response(
+            turtle.Turtle(), 200, buffer=io.BytesIO('[{"value": 10}, {"value": 11}]'))
+        assert_equal([item['value'] for item in resp.iter_json()], [10, 11])
@@ -0,0 +1,168 @@
+from testify import (
+    TestCase,
+    setup,
+    assert_equal,
+    assert_raises,
+    assert_true)
+
+import io
+import zlib
+
+import tornado.httpclient
+from tornado import httputil
+
+from tclient import cache
+from tclient import compression
+from tclient import core
+from tclient import errors
+from tclient import metrics
+from tclient import request
+
+from tests.test_core import TestClientMixin
+
+
+def gzip(data):
+    return compression.get('gzip').compress(data)
+
+
+class EncodingTest(TestCase):
+    def test_round_trip(self):
+        for encoding in compression.ENCODINGS:
+            data = "turtles " * 1000
+            compressed = encoding.compress(data)
+            assert_true(len(compressed) < len(data))
+            assert_equal(encoding.decompress(compressed), data)
+
+    def test_gzip(self):
+        assert_equal(zlib.decompress(gzip("hello"), 16 + zlib.MAX_WBITS), "hello")
+
+    def test_unknown(self):
+        with assert_raises(ValueError):
+            compression.get('lzma')
+
+        with assert_raises(ValueError):
+            compression.Compression('lzma')
+
+
+class CompressTest(TestClientMixin, TestCase):
+    """Requests go to an echo handler that answers with the body it received, gzipped"""
+    def handle_request(self, req):
+        body = req.body
+        if req.headers.get('Content-Encoding') == 'gzip':
+            body = compression.get('gzip').decompress(body)
+
+        headers = httputil.HTTPHeaders({'Content-Type': 'application/json'})
+        if 'gzip' in req.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip(body)
+
+        self.received.append(req)
+        return tornado.httpclient.HTTPResponse(req, 200, headers=headers, buffer=io.BytesIO(body))
+
+    @setup
+    def setup_handlers(self):
+        self.received = []
+        self.client.handle(r'.*', self.handle_request)
+
+    def build_request(self, size):
+        req = request.Request("/echo", method="POST")
+        req.body = {'name': 'x' * size}
+        return req
+
+    def test(self):
+        small, large = self.build_request(10), self.build_request(10000)
+        stats = metrics.BatchStats()
+        responses = core.fetch_all([small, large], compress='gzip', hooks=stats)
+
+        assert_true('Content-Encoding' not in self.received[0].headers)
+        assert_equal(self.received[1].headers['Content-Encoding'], 'gzip')
+
+        for resp in responses:
+            assert_equal(resp.error, None)
+            assert_equal(resp.headers['X-Consumed-Content-Encoding'], 'gzip')
+            assert_true('Content-Encoding' not in resp.headers)
+
+        assert_equal(len(responses[1].json['name']), 10000)
+        assert_true(stats.bytes_saved > 10000)
+
+    def test_request_untouched(self):
+        req = self.build_request(10000)
+        body = req.body
+        core.fetch(req, compress='gzip', request_timeout=5)
+
+        assert_equal(req.body, body)
+        assert_true('Content-Encoding' not in req.headers)
+        assert_true('Accept-Encoding' not in req.headers)
+        assert_true(req.use_gzip is not False)
+
+        resp = core.fetch(req)
+        assert_true('Accept-Encoding' not in self.received[1].headers)
+        assert_equal(len(resp.json['name']), 10000)
+
+    def test_offloaded(self):
+        settings = compression.Compression('gzip', min_size=0, offload_size=0)
+        responses = core.fetch_all([self.build_request(10000) for _ in range(3)],
+                                   compress=settings)
+        for resp in responses:
+            assert_equal(len(resp.json['name']), 10000)
+
+    def test_opt_out(self):
+        req = self.build_request(10000)
+        req.compress = False
+        resp = core.fetch(req, compress=True)
+        assert_true('Content-Encoding' not in self.received[0].headers)
+        assert_equal(len(resp.json['name']), 10000)
+
+    def test_off(self):
+        resp = core.fetch(self.build_request(10000))
+        assert_true('Content-Encoding' not in self.received[0].headers)
+        assert_true('Accept-Encoding' not in self.received[0].headers)
+        assert_equal(len(resp.json['name']), 10000)
+
+
+class CacheTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        self.calls += 1
+        headers = httputil.HTTPHeaders({'Cache-Control': 'max-age=60'})
+        body = '{"value": 10}'
+        if 'gzip' in req.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip(body)
+
+        return tornado.httpclient.HTTPResponse(req, 200, headers=headers, buffer=io.BytesIO(body))
+
+    @setup
+    def setup_handlers(self):
+        self.calls = 0
+        self.cache = cache.Cache()
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        resp = core.fetch(request.Request("/foo"), cache=self.cache, compress=True)
+        assert_equal(resp.json['value'], 10)
+
+        # Served from the cache, and decompressed again
+        resp = core.fetch(request.Request("/foo"), cache=self.cache, compress=True)
+        assert_true(resp.from_cache)
+        assert_equal(resp.json['value'], 10)
+
+        # Without compression the stored gzip body is no good to us
+        resp = core.fetch(request.Request("/foo"), cache=self.cache)
+        assert_true(not resp.from_cache)
+        assert_equal(resp.body, '{"value": 10}')
+        assert_equal(self.calls, 2)
+
+
+class BadEncodingTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        headers = httputil.HTTPHeaders({'Content-Encoding': 'gzip'})
+        return tornado.httpclient.HTTPResponse(req, 200, headers=headers,
+                                               buffer=io.BytesIO("not gzip"))
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        resp = core.fetch(request.Request("/foo"), compress=True)
+        assert_true(isinstance(resp.error, errors.ContentDecodingError))
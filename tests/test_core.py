@@ -6,6 +6,15 @@ from testify import (
     assert_raises,
     assert_true)
 
+import collections
+import io
+import time
+import urlparse
+
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
 from tclient import core
 from tclient import request
 from tclient import test
@@ -38,6 +47,26 @@ class BasicTest(TestClientMixin, TestCase):
         assert_equal(resp.code, 200)
 
 
+class CompactTest(TestClientMixin, TestCase):
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'/ok', lambda req: "ok")
+        self.client.handle(r'.*', lambda req: self.client.build_response(req, code=404))
+
+    def test(self):
+        requests = [request.Request("/ok"), request.Request("/missing")]
+        ok, missing = core.fetch_all(requests, compact='headers')
+        assert_equal((ok.code, missing.code), (200, 404))
+        assert_equal(ok.body, None)
+        assert_true(ok.headers is not None)
+        assert_true(missing.error is not None)
+        assert_true(ok.request is requests[0])
+
+    def test_unknown(self):
+        with assert_raises(ValueError):
+            core.fetch_all([request.Request("/ok")], compact='everything')
+
+
 class FetchError(Exception):
     pass
 
@@ -75,8 +104,10 @@ class TimeoutTest(TestClientMixin, TestCase):
         self.request = request.Request("/foo")
 
     def test(self):
-        resp = core.fetch(self.request, timeout=1)
-        assert_true(resp is None)
+        resp = core.fetch(self.request, timeout=0.1)
+        assert_equal(resp.code, 599)
+        assert_true(resp.request is self.request)
+        assert_true(resp.request_time >= 0.1)
 
 
 class TestRetries(TestClientMixin, TestCase):
@@ -128,3 +159,325 @@ class ParallelTest(TestClientMixin, TestCase):
         resp = core.fetch_all(self.requests, timeout=0.5)
         assert_equal(len(resp), 2)
         assert_equal(self.calls, 2)
+
+
+class DelayedClient(object):
+    """Client that responds to each request after a short delay, keeping track of
+    how many requests it had going at once."""
+    def __init__(self, loop, delay=0.01, delays=None):
+        self.loop = loop
+        self.delay = delay
+        self.delays = delays or {}
+        self.in_flight = collections.defaultdict(int)
+        self.max_in_flight = collections.defaultdict(int)
+        self.urls = []
+        self.request_timeouts = []
+
+    def fetch(self, request, callback):
+        host = urlparse.urlparse(request.url).netloc
+        self.urls.append(request.url)
+        self.request_timeouts.append(request.request_timeout)
+        self.in_flight[None] += 1
+        self.in_flight[host] += 1
+        for key in (None, host):
+            self.max_in_flight[key] = max(self.max_in_flight[key], self.in_flight[key])
+
+        start_time = time.time()
+
+        def respond():
+            self.in_flight[None] -= 1
+            self.in_flight[host] -= 1
+            callback(tornado.httpclient.HTTPResponse(
+                request, 200, request_time=time.time() - start_time))
+
+        self.loop.add_timeout(time.time() + self.delays.get(request.url, self.delay), respond)
+
+    def close(self):
+        pass
+
+
+class DelayedClientMixin(object):
+    @setup
+    def build_client(self):
+        self.loop = tornado.ioloop.IOLoop()
+        self.client = DelayedClient(self.loop)
+
+    @teardown
+    def close_loop(self):
+        self.loop.close()
+
+
+class MaxConcurrencyTest(DelayedClientMixin, TestCase):
+    @setup
+    def build_requests(self):
+        self.requests = [request.Request("http://host%d/%d" % (ndx % 2, ndx)) for ndx in range(10)]
+
+    def test(self):
+        responses = core.run_all(self.loop, self.client, self.requests, max_concurrency=3)
+
+        assert_equal(self.client.max_in_flight[None], 3)
+        assert_equal([r.request for r in responses], self.requests)
+        assert_true(all(r.queue_time is not None for r in responses))
+        assert_true(responses[-1].queue_time > responses[0].queue_time)
+
+    def test_per_host(self):
+        responses = core.run_all(self.loop, self.client, self.requests, max_per_host=2)
+
+        assert_equal(self.client.max_in_flight[None], 4)
+        assert_equal(self.client.max_in_flight['host0'], 2)
+        assert_equal(self.client.max_in_flight['host1'], 2)
+        assert_equal([r.request for r in responses], self.requests)
+
+    def test_blocked_host_does_not_block_others(self):
+        reqs = [request.Request("http://slow/%d" % ndx) for ndx in range(3)]
+        reqs.append(request.Request("http://fast/"))
+
+        core.run_all(self.loop, self.client, reqs, max_per_host=1, max_concurrency=2)
+        assert_equal(self.client.urls[:2], ["http://slow/0", "http://fast/"])
+
+
+class MaxConcurrencySyncTest(TestClientMixin, TestCase):
+    """Clients that respond before fetch() returns shouldn't recurse through the whole batch"""
+    def handle_request(self, req):
+        return self.client.build_response(req)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        requests = [request.Request("/foo") for _ in range(5000)]
+        responses = core.fetch_all(requests, max_concurrency=10)
+        assert_equal(len(responses), 5000)
+        assert_true(all(r.code == 200 for r in responses))
+
+
+class FetchIterTest(DelayedClientMixin, TestCase):
+    @setup
+    def build_requests(self):
+        self.requests = [request.Request("http://host/%d" % ndx) for ndx in range(3)]
+        self.client.delays = {"http://host/0": 0.05, "http://host/2": 0.001}
+
+    def test(self):
+        results = list(core.iter_all(self.loop, self.client, self.requests))
+
+        assert_equal([ndx for ndx, _ in results], [2, 1, 0])
+        for ndx, resp in results:
+            assert_true(resp.request is self.requests[ndx])
+
+    def test_generator(self):
+        requests = (req for req in self.requests)
+        results = list(core.iter_all(self.loop, self.client, requests, max_concurrency=1))
+        assert_equal([ndx for ndx, _ in results], [0, 1, 2])
+
+    def test_timeout(self):
+        results = list(core.iter_all(self.loop, self.client, self.requests, timeout=0.03))
+        assert_equal([ndx for ndx, _ in results], [2, 1, 0])
+        assert_equal([resp.code for _, resp in results], [200, 200, 599])
+
+    def test_stop_early(self):
+        for ndx, resp in core.iter_all(self.loop, self.client, self.requests):
+            break
+
+        # The loop should still be usable, and not see any of the leftover responses
+        responses = core.run_all(self.loop, self.client, self.requests[:1])
+        assert_equal(responses[0].request, self.requests[0])
+
+
+class FetchIterMockTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        return self.client.build_response(req)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        requests = [request.Request("/foo") for _ in range(3)]
+        results = sorted(core.fetch_iter(requests, retries=1))
+        assert_equal([ndx for ndx, _ in results], [0, 1, 2])
+        assert_true(all(resp.code == 200 for _, resp in results))
+
+
+class DeadlineTest(DelayedClientMixin, TestCase):
+    @setup
+    def build_requests(self):
+        self.requests = [request.Request("http://host/%d" % ndx) for ndx in range(4)]
+        self.client.delays = {"http://host/0": 0.2}
+
+    def test_batch(self):
+        responses = core.run_all(self.loop, self.client, self.requests, timeout=0.1,
+                                 max_concurrency=1)
+
+        assert_equal([resp.code for resp in responses], [599] * 4)
+        assert_true(responses[0].request_time >= 0.1)
+        assert_equal(responses[1].request_time, 0.0)
+        assert_true(responses[3].queue_time >= 0.1)
+        assert_equal([resp.request for resp in responses], self.requests)
+
+        # We shouldn't have even sent the others
+        assert_equal(self.client.urls, ["http://host/0"])
+        assert_true(self.client.request_timeouts[0] <= 0.1)
+
+    def test_request(self):
+        responses = core.run_all(self.loop, self.client, self.requests, request_timeout=0.1,
+                                 timeout=1.0, max_concurrency=1)
+
+        assert_equal([resp.code for resp in responses], [599, 200, 200, 200])
+        assert_equal(self.requests[0].request_timeout, None)
+        assert_true(self.client.request_timeouts[0] <= 0.1)
+        assert_true(responses[1].queue_time >= 0.1)
+
+
+class SegmentedTest(DelayedClientMixin, TestCase):
+    @setup
+    def build_requests(self):
+        self.requests = [request.Request("http://host/%d" % ndx) for ndx in range(6)]
+        self.client.delays = {"http://host/0": 0.1}
+        self.segments = []
+
+    def test(self):
+        responses = core.run_segmented(self.loop, self.client, self.requests, max_length=2,
+                                       parallel_segments=2, on_segment=self.segments.append)
+
+        assert_equal([resp.request for resp in responses], self.requests)
+        assert_equal(self.client.max_in_flight[None], 4)
+
+        # The slow segment shouldn't hold up the others
+        assert_equal([segment.index for segment in self.segments], [1, 2, 0])
+        assert_equal(self.segments[2].indexes, [0, 1])
+        assert_true(self.segments[2].elapsed >= 0.1)
+        assert_true(self.segments[0].elapsed < 0.1)
+
+    def test_timeout(self):
+        responses = core.run_segmented(self.loop, self.client, self.requests, max_length=2,
+                                       parallel_segments=1, timeout=0.05,
+                                       on_segment=self.segments.append)
+
+        assert_equal([resp.code for resp in responses], [599, 200] + [599] * 4)
+        assert_equal([resp.request for resp in responses], self.requests)
+        assert_equal(self.client.urls, ["http://host/0", "http://host/1"])
+        assert_true(all(segment.timed_out for segment in self.segments))
+
+
+class SegmentedMockTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        return self.client.build_response(req)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        requests = [request.Request("/foo/%d" % ndx, method="POST", body="x" * ndx)
+                    for ndx in range(1000)]
+        responses = core.fetch_segmented(requests, max_bytes=5000, parallel_segments=3,
+                                         packing='ffd')
+        assert_equal([resp.request for resp in responses], requests)
+        assert_true(all(resp.code == 200 for resp in responses))
+
+
+class FetchAllAsyncTest(DelayedClientMixin, TestCase):
+    @setup
+    def install_client(self):
+        core._CLIENT = self.client
+
+    @teardown
+    def remove_client(self):
+        core._CLIENT = None
+
+    @setup
+    def build_requests(self):
+        self.requests = [request.Request("http://host/%d" % ndx) for ndx in range(3)]
+        self.client.delays = {"http://host/0": 0.2}
+
+    def test(self):
+        @tornado.gen.coroutine
+        def handler():
+            responses = yield core.fetch_all_async(self.requests, io_loop=self.loop)
+            raise tornado.gen.Return(responses)
+
+        responses = self.loop.run_sync(handler)
+        assert_equal([resp.request for resp in responses], self.requests)
+        assert_equal([resp.code for resp in responses], [200] * 3)
+
+    def test_timeout(self):
+        future = core.fetch_all_async(self.requests, io_loop=self.loop, timeout=0.05,
+                                      max_concurrency=1)
+        responses = self.loop.run_sync(lambda: future)
+        assert_equal([resp.code for resp in responses], [599] * 3)
+        assert_equal(self.client.urls, ["http://host/0"])
+
+    def test_empty(self):
+        assert_equal(core.fetch_all_async([], io_loop=self.loop).result(), [])
+
+
+class FetchAllAsyncExceptionTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        raise FetchError('here')
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        loop = tornado.ioloop.IOLoop()
+        try:
+            future = core.fetch_all_async([request.Request("/foo")], io_loop=loop)
+            with assert_raises(FetchError):
+                future.result()
+        finally:
+            loop.close()
+
+
+class CoalesceTest(TestClientMixin, TestCase):
+    @setup
+    def build_counter(self):
+        self.calls = collections.defaultdict(int)
+
+    def handle_request(self, req):
+        self.calls[req.url] += 1
+        response = self.client.build_response(req)
+        response.buffer = io.BytesIO(req.url)
+        return response
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    @setup
+    def build_requests(self):
+        self.requests = []
+        for ndx in range(6):
+            req = request.Request("/user")
+            req.params['id'] = ndx % 2
+            self.requests.append(req)
+
+    def test(self):
+        responses = core.fetch_all(self.requests, coalesce=True)
+
+        assert_equal(dict(self.calls), {'/user?id=0': 1, '/user?id=1': 1})
+        assert_equal(sum(resp.coalesced for resp in responses), 4)
+        for req, resp in zip(self.requests, responses):
+            assert_true(resp.request is req)
+            assert_equal(resp.body, req.url)
+
+        assert_true(responses[0].body is responses[2].body)
+
+    def test_disabled(self):
+        core.fetch_all(self.requests)
+        assert_equal(sum(self.calls.values()), 6)
+
+    def test_not_idempotent(self):
+        for req in self.requests:
+            req.method = "POST"
+            req.body = "hi"
+
+        core.fetch_all(self.requests, coalesce=True)
+        assert_equal(sum(self.calls.values()), 6)
+
+    def test_headers(self):
+        self.requests[2].headers['Accept'] = 'text/plain'
+
+        core.fetch_all(self.requests, coalesce=True)
+        assert_equal(self.calls['/user?id=0'], 2)
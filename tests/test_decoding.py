@@ -0,0 +1,83 @@
+from testify import (
+    TestCase,
+    setup,
+    assert_equal,
+    assert_true)
+
+import io
+import json
+import multiprocessing.pool
+
+from tclient import core
+from tclient import decoding
+from tclient import request
+from tests.test_core import TestClientMixin
+
+
+class DecodeTestMixin(TestClientMixin):
+    def handle_request(self, req):
+        resp = self.client.build_response(req)
+        if req.url == "/invalid":
+            resp.buffer = io.BytesIO('{invalid')
+        elif req.url == "/text":
+            resp.headers = {'Content-Type': 'text/plain'}
+            resp.buffer = io.BytesIO('[1]')
+        else:
+            resp.buffer = io.BytesIO(json.dumps({'url': req.url}))
+        return resp
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    @setup
+    def build_requests(self):
+        self.requests = [request.Request("/%d" % ndx) for ndx in range(10)]
+
+
+class ThreadDecodeTest(DecodeTestMixin, TestCase):
+    def test(self):
+        responses = core.fetch_all(self.requests, decode='thread')
+
+        for req, resp in zip(self.requests, responses):
+            # Already decoded, rather than waiting for us to ask
+            assert_equal(resp.__dict__['_json'], {'url': req.url})
+
+    def test_coalesced(self):
+        responses = core.fetch_all([request.Request("/0"), request.Request("/0")],
+                                   decode='thread', coalesce=True)
+        assert_true(responses[1].coalesced)
+
+        responses[0].json['url'] = 'changed'
+        assert_equal(responses[1].json, {'url': '/0'})
+
+    def test_invalid(self):
+        responses = core.fetch_all([request.Request("/invalid"), request.Request("/text")],
+                                   decode='thread')
+
+        assert_true('_json' not in responses[0].__dict__)
+        assert_true('_json' not in responses[1].__dict__)
+        assert_equal(responses[1].json, [1])
+
+
+class ProcessDecodeTest(DecodeTestMixin, TestCase):
+    def test(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            responses = core.fetch_all(self.requests, decode=pool)
+        finally:
+            pool.terminate()
+
+        for req, resp in zip(self.requests, responses):
+            assert_equal(resp.__dict__['_json'], {'url': req.url})
+
+
+class DecoderTest(TestCase):
+    def test_use_processes(self):
+        assert_true(decoding.Decoder('process').use_processes)
+        assert_true(not decoding.Decoder('thread').use_processes)
+        assert_true(not decoding.Decoder(multiprocessing.pool.ThreadPool(1)).use_processes)
+
+    def test_decode_body(self):
+        assert_equal(decoding.decode_body('json', '[1]'), (True, [1]))
+        assert_equal(decoding.decode_body('json', '[1'), (False, None))
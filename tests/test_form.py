@@ -5,7 +5,10 @@ from testify import (
     assert_equal,
     assert_true)
 
-from tclient.form import Form
+import cgi
+import io
+
+from tclient.form import Form, MultipartEncoder
 
 
 class EmptyFormTestCase(TestCase):
@@ -55,3 +58,30 @@ class FileFormTestCase(TestCase):
         lines = content.split('\n')
         assert_true(lines[0].startswith('--'))
         assert_true(content_type.startswith("multipart/form-data"))
+
+
+class MultipartEncoderTestCase(TestCase):
+    @setup
+    def build_encoder(self):
+        self.file = io.BytesIO("x" * 1000)
+        self.file.seek(100)
+        self.encoder = MultipartEncoder(
+            {'value': 10}, [("data.txt", self.file)], chunk_size=64)
+
+    def test_length(self):
+        assert_equal(self.encoder.content_length, len(self.encoder.read()))
+
+    def test_chunks(self):
+        file_chunks = [chunk for chunk in self.encoder if chunk.startswith('x')]
+        assert_equal(len(file_chunks), 15)
+        assert_true(all(len(chunk) <= 64 for chunk in file_chunks))
+
+    def test_repeatable(self):
+        assert_equal(self.encoder.read(), self.encoder.read())
+
+    def test_parse(self):
+        _, params = cgi.parse_header(self.encoder.content_type)
+        fields = cgi.parse_multipart(io.BytesIO(self.encoder.read()), params)
+
+        assert_equal(fields['value'], ['10'])
+        assert_equal(fields['file_0'], ['x' * 900])
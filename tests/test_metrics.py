@@ -0,0 +1,133 @@
+from testify import (
+    TestCase,
+    setup,
+    assert_equal,
+    assert_true)
+
+import io
+
+from tclient import core
+from tclient import metrics
+from tclient import request
+from tests.test_core import DelayedClientMixin, TestClientMixin
+
+
+class RecordingHooks(metrics.Hooks):
+    def __init__(self):
+        self.events = []
+
+    def on_batch_start(self, batch):
+        self.events.append(('start',))
+
+    def on_dispatch(self, ndx, request, queue_time):
+        self.events.append(('dispatch', ndx))
+
+    def on_retry(self, ndx, request, response, attempts, delay):
+        self.events.append(('retry', ndx, attempts))
+
+    def on_timeout(self, ndx, request):
+        self.events.append(('timeout', ndx))
+
+    def on_response(self, ndx, response):
+        self.events.append(('response', ndx, response.code))
+
+    def on_batch_finish(self, batch):
+        self.events.append(('finish',))
+
+
+class HooksTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        self.calls += 1
+        if self.calls == 1:
+            return self.client.build_response(req, code=500)
+        resp = self.client.build_response(req)
+        resp.buffer = io.BytesIO("hello")
+        return resp
+
+    @setup
+    def setup_handlers(self):
+        self.calls = 0
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        hooks = RecordingHooks()
+        stats = metrics.BatchStats()
+        core.fetch_all([request.Request("/foo", method="POST", body="abc")], retries=1,
+                       hooks=[hooks, stats])
+
+        assert_equal(hooks.events, [('start',), ('dispatch', 0), ('retry', 0, 2),
+                                    ('response', 0, 200), ('finish',)])
+
+        assert_equal((stats.batches, stats.requests, stats.responses, stats.retries),
+                     (1, 1, 1, 1))
+        assert_equal(stats.bytes_out, 6)
+        assert_equal(stats.bytes_in, 5)
+        assert_equal(stats.in_flight, 0)
+
+
+class HooksTimeoutTest(DelayedClientMixin, TestCase):
+    def test(self):
+        self.client.delays = {"http://host/0": 0.2}
+        requests = [request.Request("http://host/%d" % ndx) for ndx in range(3)]
+        hooks = RecordingHooks()
+        stats = metrics.BatchStats()
+        core.run_all(self.loop, self.client, requests, timeout=0.05, max_concurrency=2,
+                     max_per_host=1, hooks=[hooks, stats])
+
+        assert_true(('timeout', 0) in hooks.events)
+        assert_true(('response', 0, 599) in hooks.events)
+        assert_true(('timeout', 2) in hooks.events)
+        assert_equal(stats.timeouts, 3)
+        assert_equal(stats.max_in_flight, 1)
+        assert_true(stats.wall_time >= 0.05)
+
+
+class LatencyHistogramTest(DelayedClientMixin, TestCase):
+    def test(self):
+        self.client.delays = {"http://slow/": 0.05}
+        requests = [request.Request("http://fast/%d" % ndx) for ndx in range(9)]
+        requests.append(request.Request("http://slow/"))
+
+        latency = metrics.LatencyHistogram()
+        core.run_all(self.loop, self.client, requests, hooks=latency)
+
+        assert_equal(latency.get().count, 10)
+        assert_equal(latency.get(host='fast', code=200).count, 9)
+        assert_equal(latency.get(code=500).count, 0)
+        assert_true(latency.percentile(0.5) < latency.percentile(1.0))
+        assert_true(latency.percentile(1.0, host='slow') >= 0.05)
+
+    def test_phase(self):
+        latency = metrics.LatencyHistogram(phase='connect')
+        core.run_all(self.loop, self.client, [request.Request("http://fast/")], hooks=latency)
+        assert_equal(latency.get().count, 0)
+
+
+class HistogramTest(TestCase):
+    def test_percentile(self):
+        histogram = metrics.Histogram()
+        for value in (0.0005, 0.0015, 0.003, 100.0):
+            histogram.add(value)
+
+        assert_equal(histogram.percentile(0.25), 0.0005)
+        assert_equal(histogram.percentile(0.5), 0.0015)
+        assert_equal(histogram.percentile(1.0), 100.0)
+        assert_equal(metrics.Histogram().percentile(0.5), None)
+
+    def test_accuracy(self):
+        histogram = metrics.Histogram()
+        for ndx in range(1000):
+            histogram.add(0.010 + ndx * 0.00001)
+
+        for fraction in (0.5, 0.9, 0.99):
+            expected = 0.010 + fraction * 0.01
+            assert_true(abs(histogram.percentile(fraction) - expected) < expected * 0.05)
+
+    def test_merge(self):
+        histogram, other = metrics.Histogram(), metrics.Histogram()
+        histogram.add(0.01)
+        other.add(0.02)
+        histogram.merge(other)
+
+        assert_equal((histogram.count, histogram.min, histogram.max), (2, 0.01, 0.02))
+        assert_equal(histogram.percentile(1.0), 0.02)
@@ -0,0 +1,156 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_raises,
+    assert_true)
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from tclient import core
+from tclient import metrics
+from tclient import recording
+from tclient import request
+from tclient import test
+from tests.test_core import TestClientMixin, FetchError
+
+
+class RecordTestCase(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        if req.method == "POST":
+            return "\xff\xfe binary"
+        return {'url': req.url}
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    @setup
+    def build_dir(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'traffic.jsonl')
+
+    @teardown
+    def remove_dir(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self):
+        requests = [request.Request("http://host/%d" % ndx, headers={'X-Num': str(ndx)})
+                    for ndx in range(3)]
+        requests.append(request.Request("http://host/upload", method="POST", body="\x00\x01"))
+
+        recorder = recording.Recorder(self.path)
+        responses = core.fetch_all(requests, hooks=recorder)
+        recorder.close()
+        return requests, responses
+
+    def test_record(self):
+        requests, _ = self.record()
+
+        records = list(recording.iter_records(self.path))
+        assert_equal(len(records), 4)
+
+        by_url = dict((record['request']['url'], record) for record in records)
+        record = by_url["http://host/1"]
+        assert_equal(record['request']['headers'], [['X-Num', '1']])
+        assert_equal(record['response']['code'], 200)
+        assert_equal(json.loads(record['response']['body']), {'url': "http://host/1"})
+
+        upload = by_url["http://host/upload"]
+        assert_equal(upload['request']['body'], u"\x00\x01")
+        assert_equal(upload['response']['body_encoding'], 'base64')
+
+    def test_fixtures(self):
+        self.record()
+
+        client = test.MockClient()
+        recording.install_fixtures(client, recording.iter_records(self.path))
+
+        resp = client.fetch(request.Request("http://host/2"))
+        assert_equal(resp.code, 200)
+        assert_equal(json.loads(resp.body), {'url': "http://host/2"})
+
+        resp = client.fetch(request.Request("http://host/upload", method="POST", body=""))
+        assert_equal(resp.body, "\xff\xfe binary")
+
+        resp = client.fetch(request.Request("http://host/missing"))
+        assert_equal(resp.code, 404)
+
+    def test_replay(self):
+        self.record()
+        self.client.routes = []
+
+        received = []
+        self.client.handle(r'.*', lambda req: received.append(req) or "ok")
+
+        replayed = []
+        count = recording.replay(recording.iter_records(self.path), base_url="http://local:81",
+                                 speed=None, max_concurrency=2,
+                                 on_response=lambda record, resp: replayed.append(resp.code))
+
+        assert_equal(count, 4)
+        assert_equal(replayed, [200] * 4)
+        assert_true(all(req.url.startswith("http://local:81/") for req in received))
+        upload = [req for req in received if req.method == "POST"][0]
+        assert_equal(upload.body, "\x00\x01")
+
+
+class BoundedReplayTestCase(TestClientMixin, TestCase):
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', lambda req: "ok", latency=0.001)
+
+    def iter_records(self, count):
+        record = {'start': 0.0,
+                  'request': {'method': 'GET', 'url': "http://host/", 'headers': [],
+                              'body': None}}
+        for _ in xrange(count):
+            yield record
+
+    def test(self):
+        stats = metrics.BatchStats()
+        count = recording.replay(self.iter_records(300), speed=None, hooks=stats)
+        assert_equal(count, 300)
+        assert_equal(stats.max_in_flight, recording.REPLAY_CONCURRENCY)
+
+
+def build_records(starts):
+    for start in starts:
+        response = test.MockClient().build_response(request.Request("http://host/"))
+        response.buffer = io.BytesIO("ok")
+        response.request_time = 0.0
+        yield recording.build_record(response, now=start)
+
+
+class PacedReplayTestCase(TestClientMixin, TestCase):
+    @setup
+    def setup_handlers(self):
+        self.sent = []
+        self.client.handle(r'.*', lambda req: self.sent.append(time.time()) or "ok")
+
+    def test(self):
+        records = build_records([100.0, 100.1, 100.2])
+        count = recording.replay(records, speed=2.0)
+
+        assert_equal(count, 3)
+        assert_true(0.09 <= self.sent[-1] - self.sent[0] < 0.2)
+
+
+class FailedReplayTestCase(TestClientMixin, TestCase):
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def handle_request(self, req):
+        raise FetchError('here')
+
+    def test(self):
+        records = build_records([100.0, 100.1])
+        with assert_raises(FetchError):
+            recording.replay(records, speed=1.0)
@@ -1,10 +1,18 @@
 from testify import (
     TestCase,
     setup,
+    teardown,
     assert_equal,
     assert_true)
 
+import io
 import urlparse
+
+import tornado.concurrent
+from tornado import httputil
+
+from tclient import codec
+from tclient import form
 from tclient import request
 
 
@@ -62,6 +70,43 @@ class ParamsTestCase(TestCase):
         assert_equal(query['query'][0], 'a sentence')
 
 
+class CachedURLTestCase(TestCase):
+    @setup
+    def build_request(self):
+        self.request = request.Request("http://localhost:8888")
+        self.request.params['foo'] = 'bar'
+
+    def test_cached(self):
+        url = self.request.url
+        assert_true(self.request.url is url)
+
+    def test_params_changed(self):
+        self.request.url
+        self.request.params['baz'] = '1'
+        assert_equal(urlparse.parse_qs(urlparse.urlparse(self.request.url).query),
+                     {'foo': ['bar'], 'baz': ['1']})
+
+        del self.request.params['foo']
+        assert_equal(self.request.url, "http://localhost:8888?baz=1")
+
+        self.request.params.update(foo='bar')
+        self.request.params.pop('baz')
+        assert_equal(self.request.url, "http://localhost:8888?foo=bar")
+
+    def test_params_replaced(self):
+        self.request.url
+        self.request.params = {'a': 'b'}
+        assert_equal(self.request.url, "http://localhost:8888?a=b")
+
+        self.request.params['c'] = 'd'
+        assert_true('c=d' in self.request.url)
+
+    def test_url_changed(self):
+        self.request.url
+        self.request.url = "http://github.com/rhettg"
+        assert_equal(self.request.url, "http://github.com/rhettg?foo=bar")
+
+
 class RawBodyTestCase(TestCase):
     @setup
     def build_request(self):
@@ -83,3 +128,183 @@ class JSONBodyTestCase(TestCase):
     def test(self):
         assert_equal(self.request.body, '{"msg": "Hello world"}')
         assert_equal(self.request.headers['Content-Type'], 'application/json')
+
+    def test_reused_dict(self):
+        body = {}
+        requests = []
+        for ndx in range(3):
+            body['id'] = ndx
+            requests.append(request.Request("http://localhost:8888", method="POST", body=body))
+
+        assert_equal([req.body for req in requests], ['{"id": 0}', '{"id": 1}', '{"id": 2}'])
+
+    def test_new_codec(self):
+        body = {'msg': self.msg}
+        self.request.body = body
+        body['msg'] = "changed"
+
+        self.request.codec = codec.JSONCodec()
+        assert_equal(self.request.body, '{"msg": "Hello world"}')
+
+
+class CachedBodyTestCase(TestCase):
+    def test_unicode(self):
+        req = request.Request("http://localhost:8888", method="POST", body=u"caf\xe9")
+        assert_equal(req.body, "caf\xc3\xa9")
+        assert_true(req.body is req.body)
+
+    def test_json_changed(self):
+        req = request.Request("http://localhost:8888", method="POST", body={'a': 1})
+        assert_equal(req.body, '{"a": 1}')
+
+        req.body = {'b': 2}
+        assert_equal(req.body, '{"b": 2}')
+
+    def test_form_changed(self):
+        req = request.Request("http://localhost:8888", method="POST")
+        req.form['name'] = 'Raphael'
+        assert_equal(req.body, "name=Raphael")
+        assert_true(req.body is req.body)
+
+        req.form['name'] = 'Leonardo'
+        assert_equal(req.body, "name=Leonardo")
+
+    def test_explicit_body_wins(self):
+        req = request.Request("http://localhost:8888", method="POST")
+        req.form['name'] = 'Raphael'
+        req.body = "raw"
+        req.form['name'] = 'Leonardo'
+        assert_equal(req.body, "raw")
+
+
+class StreamingFormTestCase(TestCase):
+    @setup
+    def enable_streaming(self):
+        self.streaming_supported = form.STREAMING_SUPPORTED
+        form.STREAMING_SUPPORTED = True
+
+    @teardown
+    def restore_streaming(self):
+        form.STREAMING_SUPPORTED = self.streaming_supported
+
+    @setup
+    def build_request(self):
+        self.request = request.Request("http://localhost:8888", method="POST")
+        self.request.form['name'] = 'Raphael'
+        self.request.form.add_file("tmnt.jpg", io.BytesIO("x" * 1000))
+
+    def test(self):
+        assert_true(self.request.body is None)
+        assert_true(self.request.body_producer is not None)
+
+        encoder = self.request.get_encoder()
+        assert_equal(self.request.headers['Content-Length'], str(encoder.content_length))
+        assert_true(self.request.headers['Content-Type'].startswith("multipart/form-data"))
+
+        chunks = []
+
+        def write(chunk):
+            chunks.append(chunk)
+            future = tornado.concurrent.Future()
+            future.set_result(None)
+            return future
+
+        self.request.body_producer(write).result()
+        assert_equal(len("".join(chunks)), encoder.content_length)
+
+
+class UnreadableFile(io.BytesIO):
+    def read(self, *args):
+        raise AssertionError("File was read")
+
+
+class BodySizeTestCase(TestCase):
+    def test_raw(self):
+        req = request.Request("http://localhost:8888", method="POST", body="hello")
+        assert_equal(req.body_size, 5)
+
+    def test_empty(self):
+        req = request.Request("http://localhost:8888")
+        assert_equal(req.body_size, 0)
+
+    def test_multipart(self):
+        req = request.Request("http://localhost:8888", method="POST")
+        req.form['name'] = 'Raphael'
+        req.form.add_file("tmnt.jpg", UnreadableFile("x" * 1000))
+        size = req.body_size
+        assert_true(size > 1000)
+        assert_equal(size, req.form.get_encoder().content_length)
+
+
+class DeriveTestCase(TestCase):
+    @setup
+    def build_template(self):
+        self.template = request.Request("http://localhost:8888/search", method="POST",
+                                        headers={'X-Test': '1'}, request_timeout=5.0)
+        self.template.params['q'] = 'turtles'
+        self.template.body = {'limit': 10}
+
+    def test_params(self):
+        req = self.template.derive(params={'page': 2})
+        assert_equal(self.template.url, "http://localhost:8888/search?q=turtles")
+        assert_equal(urlparse.parse_qs(urlparse.urlparse(req.url).query),
+                     {'q': ['turtles'], 'page': ['2']})
+
+        req.params['q'] = 'pizza'
+        assert_equal(self.template.params['q'], 'turtles')
+
+    def test_shared_defaults(self):
+        req = self.template.derive()
+        assert_equal(req.method, "POST")
+        assert_equal(req.request_timeout, 5.0)
+        assert_equal(req.body, '{"limit": 10}')
+        assert_true(req.body is self.template.body)
+
+    def test_headers(self):
+        req = self.template.derive(headers={'X-Page': '2'})
+        assert_equal(req.headers['X-Test'], '1')
+        assert_equal(req.headers['X-Page'], '2')
+        assert_true('X-Page' not in self.template.headers)
+
+        other = self.template.derive()
+        other.headers['X-Test'] = '2'
+        assert_equal(self.template.headers['X-Test'], '1')
+
+    def test_template_changed(self):
+        req = self.template.derive()
+        requests = self.template.expand([{'page': 1}])
+        self.template.headers['X-Other'] = '2'
+        self.template.params['q'] = 'pizza'
+
+        for derived in [req] + requests:
+            assert_true('X-Other' not in derived.headers)
+            assert_equal(derived.params['q'], 'turtles')
+
+    def test_multiple_header_values(self):
+        self.template.headers = httputil.HTTPHeaders()
+        self.template.headers.add('Cookie', 'a=1')
+        self.template.headers.add('Cookie', 'b=2')
+        req = self.template.derive()
+        assert_equal(req.headers.get_list('Cookie'), ['a=1', 'b=2'])
+
+    def test_overrides(self):
+        req = self.template.derive(url="http://localhost:8888/other", body="raw",
+                                   request_timeout=1.0)
+        assert_equal(req.url, "http://localhost:8888/other?q=turtles")
+        assert_equal(req.body, "raw")
+        assert_equal(req.request_timeout, 1.0)
+        assert_equal(self.template.body, '{"limit": 10}')
+        assert_equal(self.template.request_timeout, 5.0)
+
+    def test_form(self):
+        template = request.Request("http://localhost:8888", method="POST")
+        template.form['name'] = 'Raphael'
+        req = template.derive()
+        req.form['name'] = 'Leonardo'
+        assert_equal(req.body, "name=Leonardo")
+        assert_equal(template.body, "name=Raphael")
+
+    def test_expand(self):
+        requests = self.template.expand({'page': page} for page in range(3))
+        assert_equal([req.params['page'] for req in requests], [0, 1, 2])
+        assert_equal(len(set(id(req.params) for req in requests)), 3)
@@ -2,12 +2,19 @@ from testify import (
     TestCase,
     setup,
     turtle,
-    assert_equal)
+    assert_equal,
+    assert_raises,
+    assert_true)
 
 import json
 import io
 
+import tornado.httpclient
+
+from tclient import core
+from tclient import request
 from tclient import response
+from tests.test_core import TestClientMixin
 
 
 class JSONTest(TestCase):
@@ -21,3 +28,87 @@ class JSONTest(TestCase):
 
     def test(self):
         assert_equal(self.response.json['value'], 10)
+
+
+class FromResponseTest(TestCase):
+    @setup
+    def build_response(self):
+        self.request = request.Request("http://localhost/foo")
+        self.http_response = tornado.httpclient.HTTPResponse(
+            self.request, 500, headers={'X-Test': '1'}, buffer=io.BytesIO("oops"))
+
+    def test_adopt(self):
+        resp = response.Response.from_response(self.http_response)
+        assert_true(resp is self.http_response)
+        assert_true(isinstance(resp, response.Response))
+        assert_equal(resp.body, "oops")
+        assert_equal(resp.buffer.read(), "oops")
+        assert_equal(resp.body_view()[1:3].tobytes(), "op")
+
+    def test_adopted_twice(self):
+        first = response.Response.from_response(self.http_response)
+        second = response.Response.from_response(self.http_response)
+        assert_true(second is not first)
+        assert_equal(second.body, "oops")
+
+
+class SharedResponseTest(TestClientMixin, TestCase):
+    @setup
+    def setup_handlers(self):
+        shared = tornado.httpclient.HTTPResponse(
+            request.Request("/shared"), 200, buffer=io.BytesIO("ok"))
+        self.client.handle(r'.*', lambda req: shared)
+
+    def test(self):
+        requests = [request.Request("/a"), request.Request("/b")]
+        responses = core.fetch_all(requests)
+
+        assert_true(responses[0] is not responses[1])
+        assert_equal([resp.request for resp in responses], requests)
+        assert_equal([resp.body for resp in responses], ["ok", "ok"])
+
+
+class CompactTest(TestCase):
+    @setup
+    def build_response(self):
+        self.request = request.Request("http://localhost/foo")
+        self.response = response.Response(
+            self.request, 500, headers={'Content-Type': 'application/json'},
+            buffer=io.BytesIO('{"value": 10}'))
+        self.response.attempts = 2
+
+    def test_body(self):
+        resp = self.response.compact()
+        assert_equal(resp.code, 500)
+        assert_equal(resp.attempts, 2)
+        assert_equal(resp.json['value'], 10)
+        assert_equal(resp.headers['Content-Type'], 'application/json')
+        assert_equal(resp.effective_url, "http://localhost/foo")
+        assert_true(resp.error.response is resp)
+        assert_true(not hasattr(resp, '__dict__'))
+
+        with assert_raises(tornado.httpclient.HTTPError):
+            resp.rethrow()
+
+    def test_headers(self):
+        resp = self.response.compact('headers')
+        assert_equal(resp.headers['Content-Type'], 'application/json')
+        assert_equal(resp.body, None)
+        assert_equal(resp.buffer, None)
+
+    def test_status(self):
+        resp = self.response.compact('status')
+        assert_equal(resp.code, 500)
+        assert_equal(resp.headers, None)
+        assert_equal(resp.body, None)
+
+    def test_copy_for(self):
+        other = request.Request("http://localhost/foo")
+        resp = self.response.compact().copy_for(other)
+        assert_true(resp.request is other)
+        assert_true(resp.coalesced)
+        assert_equal(resp.body, '{"value": 10}')
+
+    def test_unknown(self):
+        with assert_raises(ValueError):
+            self.response.compact('everything')
@@ -0,0 +1,130 @@
+from testify import (
+    TestCase,
+    setup,
+    assert_equal,
+    assert_true)
+
+import socket
+import time
+
+import tornado.httpclient
+
+from tclient import core
+from tclient import request
+from tclient import retry
+from tests.test_core import TestClientMixin
+
+
+def build_response(method="GET", code=503, error=None, headers=None):
+    req = request.Request("http://localhost/", method=method)
+    return tornado.httpclient.HTTPResponse(req, code, error=error, headers=headers)
+
+
+class RetryPolicyTest(TestCase):
+    @setup
+    def build_policy(self):
+        self.policy = retry.RetryPolicy(max_retries=2, backoff=1.0, jitter=False)
+
+    def test_backoff(self):
+        resp = build_response()
+        assert_equal(self.policy.retry_delay(resp, 1), 1.0)
+        assert_equal(self.policy.retry_delay(resp, 2), 2.0)
+        assert_equal(self.policy.retry_delay(resp, 3), None)
+
+    def test_success(self):
+        assert_equal(self.policy.retry_delay(build_response(code=200), 1), None)
+
+    def test_status_codes(self):
+        assert_equal(self.policy.retry_delay(build_response(code=400), 1), None)
+        assert_equal(self.policy.retry_delay(build_response(code=599), 1), 1.0)
+
+    def test_exceptions(self):
+        resp = build_response(code=599, error=socket.error("connection refused"))
+        assert_equal(self.policy.retry_delay(resp, 1), 1.0)
+
+        resp = build_response(code=599, error=ValueError())
+        assert_equal(self.policy.retry_delay(resp, 1), None)
+
+    def test_not_idempotent(self):
+        assert_equal(self.policy.retry_delay(build_response(method="POST"), 1), None)
+
+    def test_retry_after(self):
+        resp = build_response(headers={'Retry-After': '5'})
+        assert_equal(self.policy.retry_delay(resp, 1), 5.0)
+
+        resp = build_response(headers={'Retry-After': '3600'})
+        assert_equal(self.policy.retry_delay(resp, 1), None)
+
+    def test_retry_after_date(self):
+        resp = build_response(headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        assert_equal(self.policy.retry_delay(resp, 1), 1.0)
+
+    def test_jitter(self):
+        policy = retry.RetryPolicy(backoff=1.0)
+        for _ in range(10):
+            delay = policy.retry_delay(build_response(), 1)
+            assert_true(0.0 <= delay <= 1.0)
+
+    def test_budget(self):
+        policy = retry.RetryPolicy(budget=0.1)
+        assert_true(policy.budget_allows(0, 10))
+        assert_true(not policy.budget_allows(1, 10))
+        assert_true(policy.budget_allows(1, 11))
+
+
+class BackoffTest(TestClientMixin, TestCase):
+    @setup
+    def build_counter(self):
+        self.call_times = []
+
+    def handle_request(self, req):
+        self.call_times.append(time.time())
+        return self.client.build_response(req, code=503)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        policy = retry.RetryPolicy(max_retries=2, backoff=0.05, jitter=False)
+        resp = core.fetch(request.Request("/foo"), retries=policy)
+
+        assert_equal(resp.code, 503)
+        assert_equal(resp.attempts, 3)
+        assert_equal(len(self.call_times), 3)
+        assert_true(self.call_times[1] - self.call_times[0] >= 0.05)
+        assert_true(self.call_times[2] - self.call_times[1] >= 0.1)
+
+    def test_no_retry_past_deadline(self):
+        policy = retry.RetryPolicy(max_retries=2, backoff=0.5, jitter=False)
+        resp = core.fetch(request.Request("/foo"), retries=policy, request_timeout=0.1)
+
+        assert_equal(resp.code, 503)
+        assert_equal(resp.attempts, 1)
+
+    def test_timeout_cancels_retry(self):
+        policy = retry.RetryPolicy(max_retries=2, backoff=10.0, jitter=False)
+        core.fetch(request.Request("/foo"), retries=policy, timeout=0.05)
+        assert_equal(len(self.call_times), 1)
+
+
+class BudgetTest(TestClientMixin, TestCase):
+    @setup
+    def build_counter(self):
+        self.calls = 0
+
+    def handle_request(self, req):
+        self.calls += 1
+        return self.client.build_response(req, code=503)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        policy = retry.RetryPolicy(max_retries=3, backoff=0, budget=0.1)
+        requests = [request.Request("/foo") for _ in range(20)]
+        responses = core.fetch_all(requests, retries=policy)
+
+        assert_equal(self.calls, 22)
+        assert_equal(sum(resp.attempts for resp in responses), 22)
@@ -0,0 +1,94 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_raises,
+    assert_true)
+
+import tornado.httpclient
+
+from tclient import request
+from tclient import session
+from tests.test_core import TestClientMixin, FetchError
+
+
+class SessionTestMixin(TestClientMixin):
+    @setup
+    def build_session(self):
+        self.session = session.Session()
+
+    @teardown
+    def close_session(self):
+        self.session.close()
+
+
+class MultipleBatchTest(SessionTestMixin, TestCase):
+    def handle_request(self, req):
+        return self.client.build_response(req)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        loop = self.session.loop
+        for _ in range(3):
+            responses = self.session.fetch_all([request.Request("/foo"), request.Request("/bar")])
+            assert_equal([r.code for r in responses], [200, 200])
+
+        assert_true(self.session.loop is loop)
+        assert_equal(self.session.connections_opened, 6)
+
+
+class ConnectionReuseTest(SessionTestMixin, TestCase):
+    def handle_request(self, req):
+        # Like curl, a reused connection is ready right after the (cached) name lookup
+        if req.url == "/reused":
+            time_info = {'namelookup': 0.000031, 'connect': 0.000032}
+        else:
+            time_info = {'namelookup': 0.000031, 'connect': 0.000412}
+        return tornado.httpclient.HTTPResponse(req, 200, time_info=time_info)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        self.session.fetch_all([request.Request("/new"), request.Request("/reused")])
+        self.session.fetch(request.Request("/reused"))
+
+        assert_equal(self.session.connections_opened, 1)
+        assert_equal(self.session.connections_reused, 2)
+
+
+class TimeoutThenFetchTest(SessionTestMixin, TestCase):
+    """A batch that times out shouldn't break the next batch on the same session"""
+    def handle_request(self, req):
+        if req.url == "/slow":
+            return None
+        return self.client.build_response(req)
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        resp = self.session.fetch(request.Request("/slow"), timeout=0.1)
+        assert_equal(resp.code, 599)
+
+        resp = self.session.fetch(request.Request("/fast"), timeout=1)
+        assert_equal(resp.code, 200)
+
+
+class ExceptionTest(SessionTestMixin, TestCase):
+    def handle_request(self, req):
+        raise FetchError('here')
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        with assert_raises(FetchError):
+            self.session.fetch(request.Request("/foo"))
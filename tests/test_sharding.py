@@ -0,0 +1,108 @@
+from testify import (
+    TestCase,
+    setup,
+    assert_equal,
+    assert_raises,
+    assert_true)
+
+import io
+import marshal
+import multiprocessing
+
+import tornado.httpclient
+from tornado import httputil
+
+from tclient import errors
+from tclient import metrics
+from tclient import request
+from tclient import sharding
+from tests.test_core import TestClientMixin, FetchError
+
+
+class FetchShardedTest(TestClientMixin, TestCase):
+    def handle_request(self, req):
+        resp = self.client.build_response(req, headers={'X-Path': req.url})
+        resp.buffer = io.BytesIO('{"url": "%s"}' % req.url)
+        return resp
+
+    def handle_missing(self, req):
+        return self.client.build_response(req, code=404)
+
+    def handle_error(self, req):
+        raise FetchError('here')
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'/missing', self.handle_missing)
+        self.client.handle(r'/error', self.handle_error)
+        self.client.handle(r'.*', self.handle_request)
+
+    def test(self):
+        requests = [request.Request("http://host/%d" % ndx) for ndx in range(50)]
+        responses = sharding.fetch_sharded(requests, processes=4)
+
+        assert_equal([resp.request for resp in responses], requests)
+        for req, resp in zip(requests, responses):
+            assert_equal(resp.code, 200)
+            assert_equal(resp.headers['X-Path'], req.url)
+            assert_equal(resp.json['url'], req.url)
+
+    def test_error_response(self):
+        requests = [request.Request("http://host/missing"), request.Request("http://host/1")]
+        responses = sharding.fetch_sharded(requests, processes=2)
+
+        assert_equal([resp.code for resp in responses], [404, 200])
+        assert_true(isinstance(responses[0].error, tornado.httpclient.HTTPError))
+        with assert_raises(tornado.httpclient.HTTPError):
+            responses[0].rethrow()
+
+    def test_hooks(self):
+        stats = metrics.BatchStats()
+        requests = [request.Request("http://host/%d" % ndx) for ndx in range(20)]
+        requests.append(request.Request("http://host/missing"))
+        sharding.fetch_sharded(requests, processes=4, hooks=stats)
+
+        assert_equal(stats.batches, 1)
+        assert_equal(stats.requests, 21)
+        assert_equal(stats.responses, 21)
+        assert_equal(stats.in_flight, 0)
+        assert_true(stats.wall_time > 0.0)
+
+    def test_worker_failed(self):
+        requests = [request.Request("http://host/error"), request.Request("http://host/1")]
+        with assert_raises(errors.ShardFailed):
+            sharding.fetch_sharded(requests, processes=2)
+
+
+class PackResponseTest(TestCase):
+    def test(self):
+        req = request.Request("http://host/")
+        headers = httputil.HTTPHeaders()
+        headers.add('Set-Cookie', 'a')
+        headers.add('Set-Cookie', 'b')
+        resp = sharding.Response(req, 200, headers=headers, buffer=io.BytesIO("[1, 2]"),
+                                 request_time=0.5)
+        resp.queue_time = 0.25
+        resp.attempts = 2
+        resp.json
+
+        copy = sharding.unpack_response(req, sharding.pack_response(0, resp))
+        assert_equal(copy.headers.get_list('Set-Cookie'), ['a', 'b'])
+        assert_equal(copy.body, "[1, 2]")
+        assert_equal(copy._json, [1, 2])
+        assert_equal((copy.request_time, copy.queue_time, copy.attempts), (0.5, 0.25, 2))
+
+
+class ForwardingHooksTest(TestCase):
+    def test(self):
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        req = request.Request("http://host/")
+        forwarding = sharding.ForwardingHooks(send_conn)
+        forwarding.on_retry(0, req, sharding.Response(req, 503), 2, 0.5)
+        forwarding.on_timeout(0, req)
+
+        stats = metrics.BatchStats()
+        for _ in range(2):
+            sharding.call_hook(stats, req, 3, marshal.loads(recv_conn.recv_bytes()))
+
+        assert_equal((stats.retries, stats.timeouts), (1, 1))
@@ -0,0 +1,152 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_raises,
+    assert_true)
+
+import io
+import os
+import tempfile
+
+import tornado.httpclient
+from tornado import httputil
+
+from tclient import cache
+from tclient import core
+from tclient import errors
+from tclient import request
+from tclient import stream
+from tests.test_core import TestClientMixin
+
+
+class MemorySinkTest(TestCase):
+    def test(self):
+        sink = stream.BodySink(max_body_size=10)
+        sink.write("hello")
+        assert_equal(sink.buffer.getvalue(), "hello")
+
+        with assert_raises(errors.BodyTooLarge):
+            sink.write("world!")
+        assert_true(sink.exceeded)
+
+
+class FileObjectSinkTest(TestCase):
+    def test_restart(self):
+        target = io.BytesIO("header")
+        target.seek(6)
+
+        sink = stream.BodySink(target)
+        sink.start()
+        sink.write("first attempt")
+        sink.start()
+        sink.write("second")
+        sink.finish()
+
+        assert_equal(target.getvalue(), "headersecond")
+
+
+class CallableSinkTest(TestCase):
+    def test(self):
+        chunks = []
+        sink = stream.BodySink(chunks.append)
+        sink.write("one")
+        sink.write("two")
+        assert_equal(chunks, ["one", "two"])
+        assert_equal(sink.size, 6)
+
+
+class StreamTestMixin(TestClientMixin):
+    @setup
+    def build_path(self):
+        self.calls = 0
+        self.fail_first = False
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    @teardown
+    def remove_path(self):
+        os.unlink(self.path)
+
+    def handle_request(self, req):
+        """Acts like tornado, sending the body through the streaming callback"""
+        self.calls += 1
+        try:
+            for _ in range(self.calls):
+                req.streaming_callback("x" * 100)
+        except errors.BodyTooLarge, e:
+            return tornado.httpclient.HTTPResponse(req, 599, error=e)
+
+        code = 503 if self.fail_first and self.calls == 1 else 200
+        headers = httputil.HTTPHeaders({'Cache-Control': 'max-age=60'})
+        # Tornado leaves an empty buffer behind when streaming
+        return tornado.httpclient.HTTPResponse(req, code, headers=headers, buffer=io.BytesIO())
+
+    @setup
+    def setup_handlers(self):
+        self.client.handle(r'.*', self.handle_request)
+
+
+class StreamToPathTest(StreamTestMixin, TestCase):
+    def test(self):
+        resp = core.fetch(request.Request("/foo", stream_to=self.path))
+
+        assert_equal(resp.code, 200)
+        assert_equal(resp.body_path, self.path)
+        assert_equal(resp.body_size, 100)
+        assert_equal(os.path.getsize(self.path), 100)
+        assert_equal(resp.body_mmap()[:], "x" * 100)
+        assert_equal(resp.body, "x" * 100)
+
+
+class MaxBodySizeTest(StreamTestMixin, TestCase):
+    def test_memory(self):
+        resp = core.fetch(request.Request("/foo", max_body_size=150))
+        assert_equal(resp.body, "x" * 100)
+
+    def test_exceeded(self):
+        self.calls = 1
+        resp = core.fetch(request.Request("/foo", max_body_size=150))
+        assert_true(isinstance(resp.error, errors.BodyTooLarge))
+
+    def test_retry(self):
+        # Each retry gets a bigger body, so only the first fits
+        self.fail_first = True
+        req = request.Request("/foo", stream_to=self.path, max_body_size=150)
+        resp = core.fetch(req, retries=1)
+
+        assert_equal(self.calls, 2)
+        assert_true(isinstance(resp.error, errors.BodyTooLarge))
+        assert_equal(os.path.getsize(self.path), 100)
+
+
+class StreamCacheTest(StreamTestMixin, TestCase):
+    def test(self):
+        response_cache = cache.Cache()
+        resp = core.fetch(request.Request("/foo", stream_to=self.path), cache=response_cache)
+        assert_equal(resp.body, "x" * 100)
+
+        resp = core.fetch(request.Request("/foo", stream_to=self.path), cache=response_cache)
+        assert_equal(self.calls, 2)
+        assert_true(not resp.from_cache)
+
+
+class StreamCoalesceTest(StreamTestMixin, TestCase):
+    @setup
+    def build_other_path(self):
+        fd, self.other_path = tempfile.mkstemp()
+        os.close(fd)
+
+    @teardown
+    def remove_other_path(self):
+        os.unlink(self.other_path)
+
+    def test(self):
+        requests = [request.Request("/foo", stream_to=self.path),
+                    request.Request("/foo", stream_to=self.other_path)]
+        responses = core.fetch_all(requests, coalesce=True)
+
+        assert_equal([resp.body_path for resp in responses], [self.path, self.other_path])
+        assert_true(os.path.getsize(self.other_path) > 0)
+        assert_true(not any(resp.coalesced for resp in responses))
@@ -0,0 +1,124 @@
+from testify import (
+    TestCase,
+    setup,
+    teardown,
+    assert_equal,
+    assert_true)
+
+import re
+import time
+
+from tclient import core
+from tclient import request
+from tclient import test
+
+
+class MockClientTestCase(TestCase):
+    @setup
+    def build_client(self):
+        self.client = test.MockClient()
+
+    def route_for(self, url, method="GET"):
+        return self.client.fetch(request.Request(url, method=method)).body
+
+    def respond(self, body):
+        return lambda req: body
+
+    def test_order(self):
+        self.client.handle(r'/foo/bar', self.respond("bar"))
+        self.client.handle(r'/foo', self.respond("foo"))
+        self.client.handle(r'.*', self.respond("any"))
+
+        assert_equal(self.route_for("http://host/foo/bar"), "bar")
+        assert_equal(self.route_for("http://host/foo/baz"), "foo")
+        assert_equal(self.route_for("http://host/other?foo=1"), "any")
+
+    def test_many_routes(self):
+        # More groups than fit in a single regular expression
+        for ndx in range(300):
+            self.client.handle(r'/(item)/(%d)$' % ndx, self.respond(str(ndx)))
+
+        assert_equal(self.route_for("http://host/item/0"), "0")
+        assert_equal(self.route_for("http://host/item/150"), "150")
+        assert_equal(self.route_for("http://host/item/299"), "299")
+        assert_true(len(self.client._groups) > 1)
+
+    def test_method_and_host(self):
+        self.client.handle(r'/foo', self.respond("post"), method="POST")
+        self.client.handle(r'/foo', self.respond("other"), host="other.com")
+        self.client.handle(r'^/foo', self.respond("get"))
+
+        assert_equal(self.route_for("http://host/foo", method="POST"), "post")
+        assert_equal(self.route_for("http://other.com/foo"), "other")
+        assert_equal(self.route_for("http://host/foo"), "get")
+
+    def test_unmergeable(self):
+        self.client.handle(r'/(\w+)/\1', self.respond("repeated"))
+        self.client.handle(r'(?i)/FOO', self.respond("foo"))
+        self.client.handle(r'/bar', self.respond("bar"))
+
+        assert_equal(self.route_for("http://host/abc/abc"), "repeated")
+        assert_equal(self.route_for("http://host/foo"), "foo")
+        assert_equal(self.route_for("http://host/bar"), "bar")
+        assert_equal(self.route_for("http://host/abc/def"), None)
+
+    def test_named_groups(self):
+        self.client.handle(r'/a/(?P<id>\d+)$', self.respond("a"))
+        self.client.handle(r'/b/(?P<id>\d+)$', self.respond("b"))
+        self.client.handle(r'/[^/]+$', self.respond("any"))
+
+        assert_equal(self.route_for("http://host/a/1"), "a")
+        assert_equal(self.route_for("http://host/b/2"), "b")
+        assert_equal(self.route_for("http://host/c"), "any")
+
+    def test_anchored_alternation(self):
+        self.client.handle(r'^/a|^/b', self.respond("ab"))
+        self.client.handle(r'/c', self.respond("c"))
+
+        assert_equal(self.route_for("http://host/a"), "ab")
+        assert_equal(self.route_for("http://host/b"), "ab")
+        assert_equal(self.route_for("http://host/c"), "c")
+
+    def test_compiled_flags(self):
+        self.client.handle(re.compile(r'/foo', re.I), self.respond("foo"))
+        self.client.handle(r'/bar', self.respond("bar"))
+
+        assert_true(not self.client.routes[0].mergeable)
+        assert_equal(self.route_for("http://host/FOO"), "foo")
+        assert_equal(self.route_for("http://host/bar"), "bar")
+
+    def test_missing(self):
+        resp = self.client.fetch(request.Request("http://host/foo"))
+        assert_equal(resp.code, 404)
+
+    def test_dict(self):
+        self.client.handle(r'/foo', self.respond({'ok': True}))
+        resp = self.client.fetch(request.Request("http://host/foo"))
+        assert_equal(resp.body, '{"ok": true}')
+
+
+class MockClientLatencyTestCase(TestCase):
+    @setup
+    def install_client(self):
+        self.client = test.get_test_client()
+        self.client.handle(r'/slow', lambda req: "slow", latency=0.2)
+        self.client.handle(r'/fast', lambda req: "fast")
+        self.client.latency = 0.01
+        self.client.jitter = 0.01
+
+    @teardown
+    def clear_client(self):
+        test.clear_test_client()
+
+    def test(self):
+        requests = [request.Request("http://host/fast") for _ in range(5)]
+        start = time.time()
+        responses = core.fetch_all(requests)
+
+        assert_true(0.01 <= time.time() - start < 0.2)
+        assert_equal([resp.body for resp in responses], ["fast"] * 5)
+
+    def test_timeout(self):
+        requests = [request.Request("http://host/slow"), request.Request("http://host/fast")]
+        responses = core.fetch_all(requests, timeout=0.1)
+        assert_equal([resp.code for resp in responses], [599, 200])
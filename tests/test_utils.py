@@ -31,3 +31,48 @@ class SegmentRequestsTestCase(TestCase):
         assert_equal(len(segments), len(self.requests))
         for segment in segments:
             assert_equal(len(segment), 1)
+
+    def test_iter_segments(self):
+        segments = utils.iter_segments(iter(self.requests), max_length=2)
+        assert_equal(next(segments), self.requests[:2])
+        assert_equal(list(segments), [self.requests[2:]])
+
+
+class SizedRequest(object):
+    def __init__(self, size):
+        self.body_size = size
+
+
+class PackingTestCase(TestCase):
+    @setup
+    def build_requests(self):
+        self.requests = [SizedRequest(size) for size in (6, 5, 5, 4, 3, 1)]
+
+    def test_greedy_keeps_order(self):
+        segments = utils.segment_requests(self.requests, max_bytes=10)
+        assert_equal([[req.body_size for req in seg] for seg in segments],
+                     [[6], [5, 5], [4, 3, 1]])
+
+    def test_ffd_fewer_segments(self):
+        self.requests = [SizedRequest(size) for size in (2, 5, 4, 7, 1, 3, 8)]
+        greedy = utils.segment_requests(self.requests, max_bytes=10)
+        packed = utils.segment_requests(self.requests, max_bytes=10, packing='ffd')
+        assert_equal(len(greedy), 5)
+        assert_equal(len(packed), 3)
+        for segment in packed:
+            assert sum(req.body_size for req in segment) <= 10
+
+    def test_ffd_max_length(self):
+        packed = utils.segment_indices(self.requests, max_bytes=100, max_length=2,
+                                       packing='ffd')
+        assert_equal(sorted(sum(packed, [])), range(len(self.requests)))
+        for segment in packed:
+            assert len(segment) <= 2
+
+    def test_oversized(self):
+        self.requests.append(SizedRequest(20))
+        for packing in ('greedy', 'ffd'):
+            segments = utils.segment_requests(self.requests, max_bytes=10, packing=packing)
+            for segment in segments:
+                total = sum(req.body_size for req in segment)
+                assert total <= 10 or len(segment) == 1